@@ -15,10 +15,25 @@ FORMATTER = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s',
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from verifier import Verifier
+from verifier.reject_rules import RejectRules
+from scripts.asset_processor.media_probe import MediaProbe
+from scripts.asset_processor.frame_index import FrameIndex
+from scripts.asset_processor.metric_executor import MetricExecutor
 
 
 def create_verifier():
-    verifier = Verifier(config.VERIFICATION_MAX_SAMPLES, config.VERIFICATION_MODEL_URI, False, False, False)
+    MediaProbe.CACHE_DIR = config.PROBE_CACHE_DIR or None
+    FrameIndex.CACHE_DIR = config.FRAME_INDEX_CACHE_DIR or None
+    FrameIndex.CACHE_MAX_BYTES = int(config.FRAME_INDEX_CACHE_SIZE)
+    reject_rules = None
+    if config.FAST_REJECT_RULES:
+        reject_rules = RejectRules(config.FAST_REJECT_RULES, duration_tolerance=float(config.FAST_REJECT_DURATION_TOLERANCE))
+    # metrics of all requests served by this process share the same pools
+    metric_executor = MetricExecutor(config.METRIC_EXECUTOR, int(config.METRIC_WORKERS) or None, int(config.METRIC_THREADS) or None, int(config.METRIC_QUEUE_SIZE))
+    MetricExecutor.set_default(metric_executor)
+    verifier = Verifier(config.VERIFICATION_MAX_SAMPLES, config.VERIFICATION_MODEL_URI, False, False, False, master_cache_size=int(config.MASTER_CACHE_SIZE),
+                        frame_memory_budget=int(config.FRAME_MEMORY_BUDGET), reject_rules=reject_rules, metric_executor=metric_executor,
+                        metric_backends=[backend for backend in config.METRIC_BACKENDS.split(',') if backend])
     return verifier
 
 
@@ -81,7 +96,7 @@ def status():
     Status check endpoint
     @return:
     """
-    return jsonify({'status': 'OK', 'time': datetime.datetime.now(), 'model': config.VERIFICATION_MODEL_URI})
+    return jsonify({'status': 'OK', 'time': datetime.datetime.now(), 'model': config.VERIFICATION_MODEL_URI, 'metric_executor': verifier.metric_executor.stats()})
 
 
 @APP.route('/verify', methods=['POST'])
@@ -153,6 +168,8 @@ def post_route():
                             tampering,
                 "tamper_ul": A boolean indicating whether the Unsupervised Learning model detected
                             tampering,
+                "reject_reason": Present only if the rendition was rejected by its metadata before decoding,
+                                 code of the failed rule (e.g. resolution_mismatch), tamper is 1 and model outputs are absent,
                 "uri": The URI of the rendition
      }
     """
@@ -9,6 +9,33 @@ class BaseConfig():
     API_HOST = 'localhost'
     API_PORT = 5000
     TEMP_PATH = '/tmp'
+    # bytes of source video samples to keep between verifications of the same source, 0 disables caching.
+    # Every server process keeps its own cache, so a host needs up to this size times the number of workers on top of regular usage,
+    # e.g. 8 gunicorn workers of Dockerfile-api with 256 MiB each take 2 GiB. Size it from memory left per worker on the host.
+    MASTER_CACHE_SIZE = 0
+    # bytes of full resolution samples to keep per verification for QoE metrics, 0 means no limit
+    FRAME_MEMORY_BUDGET = 0
+    # directory to persist media probe results keyed by file content, empty disables persistence
+    PROBE_CACHE_DIR = ''
+    # directory to persist frame indexes of sparse decoding keyed by file content, empty disables persistence
+    FRAME_INDEX_CACHE_DIR = ''
+    # max total bytes of persisted frame indexes, least recently used ones are deleted first
+    FRAME_INDEX_CACHE_SIZE = 256 * 1024 ** 2
+    # comma separated rules rejecting renditions by metadata before decoding, see RejectRules, empty disables fast rejection
+    # e.g. 'resolution_mismatch,frame_rate_mismatch,duration_mismatch,pixels_mismatch'
+    FAST_REJECT_RULES = ''
+    # max relative difference of rendition duration from source duration
+    FAST_REJECT_DURATION_TOLERANCE = 0.1
+    # where pairwise metrics are computed: 'threads', 'processes', or 'auto' to compute metrics holding the GIL in processes when it pays off
+    METRIC_EXECUTOR = 'threads'
+    # number of metric worker processes per server process, 0 means number of CPUs divided by WEB_CONCURRENCY, see MetricExecutor.cpu_share()
+    METRIC_WORKERS = 0
+    # number of metric threads per server process, 0 means number of CPUs divided by WEB_CONCURRENCY, see MetricExecutor.cpu_share()
+    METRIC_THREADS = 0
+    # max number of metric jobs waiting for a thread, 0 means no limit
+    METRIC_QUEUE_SIZE = 0
+    # comma separated alternative metric implementations, see VideoMetrics.BACKENDS, e.g. 'opencv_gaussian'. Empty uses default implementations models were trained with.
+    METRIC_BACKENDS = ''
 
 class DevConfig(BaseConfig):
     pass
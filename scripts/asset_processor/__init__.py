@@ -1,3 +1,17 @@
 from .video_asset_processor import *
 from .video_capture import *
-from .video_metrics import *
\ No newline at end of file
+from .video_metrics import *
+from .frame_index import *
+from .packet_timestamps import *
+from .timestamp_aligner import *
+from .decode_scheduler import *
+from .frame_ring import *
+from .live_asset_processor import *
+from .master_cache import *
+from .frame_features import *
+from .metric_registry import *
+from .metric_executor import *
+from .audio_reader import *
+from .audio_comparator import *
+from .container_parser import *
+from .media_probe import *
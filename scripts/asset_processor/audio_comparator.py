@@ -0,0 +1,196 @@
+"""
+Bounded memory comparison of audio tracks, tolerant to length and offset differences
+"""
+import logging
+import numpy as np
+
+logger = logging.getLogger()
+
+
+class ChunkReader:
+    """
+    Reads fixed size pieces from a stream of arrays of arbitrary sizes
+    """
+
+    def __init__(self, chunks):
+        """
+
+        @param chunks: iterable of 1-D arrays
+        """
+        self.chunks = iter(chunks)
+        self.pending = []
+
+    def read(self, count: int) -> np.ndarray:
+        """
+        Returns next count samples, less only if the stream ended
+        @param count:
+        @return:
+        """
+        pieces = []
+        size = 0
+        while size < count:
+            piece = self.pending.pop() if self.pending else next(self.chunks, None)
+            if piece is None:
+                break
+            if size + len(piece) > count:
+                self.pending.append(piece[count - size:])
+                piece = piece[:count - size]
+            pieces.append(piece)
+            size += len(piece)
+        if not pieces:
+            return np.array([], dtype=np.int16)
+        return np.concatenate(pieces) if len(pieces) > 1 else pieces[0]
+
+    def unread(self, samples: np.ndarray):
+        """
+        Puts samples back in front of the stream
+        @param samples:
+        @return:
+        """
+        if len(samples):
+            self.pending.append(samples)
+
+
+class AudioComparator:
+    """
+    Computes Euclidean distance between two PCM tracks. Samples are compared in fixed size float64 chunks, so memory doesn't depend on track length,
+    and tracks can be either arrays, memory-mapped files (np.memmap) or streams of chunks.
+    Before comparison, offset of the rendition relative to the source is estimated by correlating compact spectral fingerprints of track beginnings,
+    log energies of a few frequency bands in short frames, refined to a single sample. Samples left without counterpart, because of the offset
+    or different lengths, are compared to silence, so truncated or padded audio still increases the distance.
+    """
+    CHUNK_SAMPLES = 1 << 16
+    # fingerprint frame length and hop, samples
+    FINGERPRINT_FRAME = 256
+    FINGERPRINT_HOP = 128
+    FINGERPRINT_BANDS = 16
+    # min correlation of fingerprints to accept an offset, unrelated tracks are compared as they are
+    MIN_CORRELATION = 0.5
+
+    def __init__(self, sample_rate: int, max_offset: float = 1.0, fingerprint_duration: float = 10.0, chunk_samples: int = CHUNK_SAMPLES):
+        """
+
+        @param sample_rate: sample rate of compared tracks, Hz
+        @param max_offset: max offset between tracks to look for, seconds
+        @param fingerprint_duration: length of track beginnings used to estimate offset, seconds
+        @param chunk_samples: number of samples compared at once
+        """
+        self.sample_rate = sample_rate
+        self.max_offset = int(max_offset * sample_rate)
+        self.fingerprint_samples = int(fingerprint_duration * sample_rate) + self.max_offset
+        self.chunk_samples = chunk_samples
+
+    def fingerprint(self, samples) -> np.ndarray:
+        """
+        Computes spectral fingerprint of a track
+        @param samples: 1-D array of PCM samples
+        @return: (frames, bands) array of log band energies with per band mean removed
+        """
+        samples = np.ascontiguousarray(samples, dtype=np.float32)
+        frames = 1 + (len(samples) - self.FINGERPRINT_FRAME) // self.FINGERPRINT_HOP
+        if frames < 1:
+            return np.zeros((0, self.FINGERPRINT_BANDS), dtype=np.float32)
+        framed = np.lib.stride_tricks.as_strided(samples, (frames, self.FINGERPRINT_FRAME),
+                                                 (samples.strides[0] * self.FINGERPRINT_HOP, samples.strides[0]))
+        power = np.abs(np.fft.rfft(framed * np.hanning(self.FINGERPRINT_FRAME).astype(np.float32), axis=1)) ** 2
+        # logarithmically spaced bands, skipping DC
+        edges = np.unique(np.geomspace(1, power.shape[1], self.FINGERPRINT_BANDS + 1).astype(int))
+        energies = np.log1p(np.add.reduceat(power, edges[:-1], axis=1)[:, :self.FINGERPRINT_BANDS])
+        return energies - energies.mean(axis=0)
+
+    def estimate_offset(self, source, rendition) -> int:
+        """
+        Estimates how many samples rendition is delayed relative to source
+        @param source: 1-D array of source samples
+        @param rendition: 1-D array of rendition samples
+        @return: offset in samples, negative if rendition is ahead of source
+        """
+        source_fp = self.fingerprint(source[:self.fingerprint_samples])
+        rendition_fp = self.fingerprint(rendition[:self.fingerprint_samples])
+        max_lag = min(self.max_offset // self.FINGERPRINT_HOP, len(source_fp) - 1, len(rendition_fp) - 1)
+        if max_lag < 0:
+            return 0
+        best_lag, best_score = 0, -np.inf
+        for lag in range(-max_lag, max_lag + 1):
+            s = source_fp[max(0, -lag):]
+            r = rendition_fp[max(0, lag):]
+            n = min(len(s), len(r))
+            norm = np.sqrt(np.sum(s[:n] ** 2) * np.sum(r[:n] ** 2))
+            score = np.sum(s[:n] * r[:n]) / norm if norm > 0 else 0
+            if score > best_score:
+                best_lag, best_score = lag, score
+        if best_score < self.MIN_CORRELATION:
+            return 0
+        return self._refine_offset(source, rendition, best_lag * self.FINGERPRINT_HOP)
+
+    def _refine_offset(self, source, rendition, offset: int) -> int:
+        # cross-correlate waveforms within one fingerprint hop around the coarse offset
+        hop = self.FINGERPRINT_HOP
+        start = max(0, -offset) + hop
+        segment = np.asarray(source[start:start + 4 * self.FINGERPRINT_FRAME], dtype=np.float64)
+        window = np.asarray(rendition[max(0, start + offset - hop):start + offset + len(segment) + hop], dtype=np.float64)
+        if not len(segment) or len(window) < len(segment) or not np.any(segment):
+            return offset
+        corr = np.correlate(window, segment, mode='valid')
+        return int(max(0, start + offset - hop) + np.argmax(corr) - start)
+
+    def _energy(self, samples) -> float:
+        total = 0.0
+        for start in range(0, len(samples), self.chunk_samples):
+            chunk = np.asarray(samples[start:start + self.chunk_samples], dtype=np.float64)
+            total += np.dot(chunk, chunk)
+        return total
+
+    def compare(self, source, rendition) -> float:
+        """
+        Computes distance between two tracks held in arrays or memory-mapped files
+        @param source: 1-D array of source samples
+        @param rendition: 1-D array of rendition samples
+        @return: Euclidean distance
+        """
+        offset = self.estimate_offset(source, rendition)
+        if offset:
+            logger.info(f'Audio offset of rendition is {offset / self.sample_rate:.4f} sec')
+        total = self._energy(rendition[:offset]) if offset > 0 else self._energy(source[:-offset])
+        source = source[max(0, -offset):]
+        rendition = rendition[max(0, offset):]
+        n = min(len(source), len(rendition))
+        for start in range(0, n, self.chunk_samples):
+            end = min(n, start + self.chunk_samples)
+            diff = np.asarray(source[start:end], dtype=np.float64) - rendition[start:end]
+            total += np.dot(diff, diff)
+        total += self._energy(source[n:]) + self._energy(rendition[n:])
+        return float(np.sqrt(total))
+
+    def compare_streams(self, source_chunks, rendition_chunks) -> float:
+        """
+        Computes distance between two tracks read as streams of chunks, e.g. from decoder pipes. Only track beginnings used for offset estimation are buffered.
+        @param source_chunks: iterable of 1-D arrays of source samples
+        @param rendition_chunks: iterable of 1-D arrays of rendition samples
+        @return: Euclidean distance
+        """
+        source, rendition = ChunkReader(source_chunks), ChunkReader(rendition_chunks)
+        source_head, rendition_head = source.read(self.fingerprint_samples), rendition.read(self.fingerprint_samples)
+        offset = self.estimate_offset(source_head, rendition_head)
+        if offset:
+            logger.info(f'Audio offset of rendition is {offset / self.sample_rate:.4f} sec')
+        source.unread(source_head)
+        rendition.unread(rendition_head)
+        total = self._energy(rendition.read(offset) if offset > 0 else source.read(-offset))
+        while True:
+            a, b = source.read(self.chunk_samples), rendition.read(self.chunk_samples)
+            n = min(len(a), len(b))
+            if n == 0:
+                # one of the tracks ended, the rest of the other one is compared to silence
+                total += self._energy(a) + self._energy(b)
+                for reader in [source, rendition]:
+                    rest = reader.read(self.chunk_samples)
+                    while len(rest):
+                        total += self._energy(rest)
+                        rest = reader.read(self.chunk_samples)
+                break
+            diff = np.asarray(a[:n], dtype=np.float64) - b[:n]
+            total += np.dot(diff, diff)
+            source.unread(a[n:])
+            rendition.unread(b[n:])
+        return float(np.sqrt(total))
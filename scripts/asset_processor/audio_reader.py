@@ -0,0 +1,93 @@
+"""
+Decoding of video audio tracks straight to NumPy arrays, through ffmpeg pipes
+"""
+import subprocess
+import logging
+import numpy as np
+
+logger = logging.getLogger()
+
+
+class AudioReader:
+    """
+    Reads the first audio track of a video as low rate mono PCM. Audio is downmixed and resampled by ffmpeg
+    and passed through a pipe, so no intermediate files are written. Either the whole track or only windows around given timestamps are decoded.
+    """
+    SAMPLE_RATE = 8000
+    DTYPE = np.dtype('<i2')
+
+    def __init__(self, filename: str, sample_rate: int = SAMPLE_RATE):
+        """
+
+        @param filename: video file
+        @param sample_rate: output sample rate, Hz
+        """
+        self.filename = filename
+        self.sample_rate = sample_rate
+
+    def _output_args(self) -> list:
+        return ['-vn', '-sn', '-dn', '-ac', '1', '-ar', str(self.sample_rate), '-acodec', 'pcm_s16le', '-f', 's16le', 'pipe:']
+
+    def open(self, input_args=None) -> subprocess.Popen:
+        """
+        Starts decoding, PCM samples are read from stdout of returned process
+        @param input_args: ffmpeg input arguments, whole file by default
+        @return:
+        """
+        if input_args is None:
+            input_args = ['-i', self.filename]
+        ffmpeg_cmd = ['ffmpeg', '-v', 'error', '-nostdin'] + input_args + self._output_args()
+        return subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def _read(self, input_args=None) -> np.ndarray:
+        ffmpeg = self.open(input_args)
+        stdout, stderr = ffmpeg.communicate()
+        if ffmpeg.returncode:
+            raise Exception(f'Unable to decode audio of {self.filename}: {stderr.decode("ascii", "ignore")}')
+        # trailing odd byte can't be a sample
+        return np.frombuffer(stdout[:len(stdout) // 2 * 2], dtype=self.DTYPE)
+
+    def read(self) -> np.ndarray:
+        """
+        Decodes the whole track
+        @return: int16 samples
+        """
+        return self._read()
+
+    def stream(self, chunk_samples: int):
+        """
+        Decodes the whole track, yielding it in chunks as it is decoded
+        @param chunk_samples: number of samples per chunk, the last one may be shorter
+        @return: generator of int16 arrays
+        """
+        ffmpeg = self.open()
+        try:
+            while True:
+                data = ffmpeg.stdout.read(chunk_samples * self.DTYPE.itemsize)
+                if len(data) < self.DTYPE.itemsize:
+                    break
+                yield np.frombuffer(data[:len(data) // 2 * 2], dtype=self.DTYPE)
+            if ffmpeg.wait():
+                raise Exception(f'Unable to decode audio of {self.filename}: {ffmpeg.stderr.read().decode("ascii", "ignore")}')
+        finally:
+            if ffmpeg.poll() is None:
+                ffmpeg.kill()
+                ffmpeg.wait()
+
+    def read_windows(self, timestamps, duration: float) -> np.ndarray:
+        """
+        Decodes only windows of audio centered at given timestamps, seeking to each of them.
+        All windows are decoded by a single ffmpeg process, each window is a separate input concatenated by a filter.
+        @param timestamps: window centers, seconds from the beginning of the file
+        @param duration: window length, seconds
+        @return: int16 samples of all windows, in order of timestamps
+        """
+        timestamps = np.sort(np.asarray(timestamps, dtype=np.float64))
+        if not len(timestamps):
+            return np.array([], dtype=self.DTYPE)
+        input_args = []
+        for ts in timestamps:
+            input_args += ['-ss', f'{max(0.0, ts - duration / 2):.6f}', '-t', f'{duration:.6f}', '-i', self.filename]
+        streams = ''.join(f'[{i}:a:0]' for i in range(len(timestamps)))
+        input_args += ['-filter_complex', f'{streams}concat=n={len(timestamps)}:v=0:a=1']
+        return self._read(input_args)
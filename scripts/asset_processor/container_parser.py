@@ -0,0 +1,515 @@
+"""
+Pure Python parsing of MP4 and MPEG-TS headers, reading only a few KB of local or remote files
+"""
+import os
+import struct
+import logging
+import urllib.request
+from collections import Counter
+from fractions import Fraction
+
+logger = logging.getLogger()
+
+
+def guess_frame_rate(r_frame_rate: float, avg_frame_rate: float) -> float:
+    """
+    Chooses video frame rate the same way as av_guess_frame_rate, which OpenCV reports
+    @param r_frame_rate: lowest frame rate all timestamps can be represented with
+    @param avg_frame_rate: number of frames divided by duration
+    @return:
+    """
+    if 0 < avg_frame_rate < 70 and r_frame_rate > 210:
+        return avg_frame_rate
+    return r_frame_rate or avg_frame_rate
+
+
+class BitReader:
+    """
+    Reads bits and Exp-Golomb codes of H.264 parameter sets
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def u(self, bits: int) -> int:
+        value = 0
+        for _ in range(bits):
+            byte = self.data[self.pos >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+    def ue(self) -> int:
+        zeros = 0
+        while not self.u(1):
+            zeros += 1
+            if zeros > 31:
+                raise ValueError('Invalid Exp-Golomb code')
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self) -> int:
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+class ContainerParser:
+    """
+    Reads video properties needed by pre-verification straight from container headers, without starting a demuxer or decoder:
+    moov/mvhd/mdhd/hdlr/stsd/avcC/stts boxes of MP4 files, or PAT, PMT, H.264 SPS and first and last PES timestamps of MPEG-TS files.
+    Video dimensions are taken from H.264 SPS in both cases, as the ones declared by MP4 sample entries aren't checked by decoders.
+    Files are read by byte ranges, so remote renditions are checked with HTTP range requests instead of being downloaded.
+    Values are returned as MediaProbe fields and follow its conventions. Whenever headers are incomplete or not understood, parse() returns None
+    and the caller is expected to fall back to ffprobe.
+    """
+    # max bytes of MP4 moov box to read
+    MAX_MOOV_SIZE = 64 * 1024 ** 2
+    # max bytes of MPEG-TS file head and tail to look for stream tables and timestamps in
+    TS_HEAD_SIZE = 1024 ** 2
+    TS_TAIL_SIZE = 256 * 1024
+    TS_PACKET_SIZE = 188
+    # number of first and last video PES timestamps to find, enough to cover frame reordering
+    TS_PTS_COUNT = 16
+    READ_SIZE = 16 * 1024
+
+    MP4_CONTAINERS = {b'moov', b'trak', b'edts', b'mdia', b'minf', b'stbl'}
+    MP4_HANDLERS = {b'vide': 'video', b'soun': 'audio', b'subt': 'subtitle', b'text': 'subtitle', b'sbtl': 'subtitle'}
+    MP4_CODECS = {b'avc1': 'h264', b'avc3': 'h264', b'hev1': 'hevc', b'hvc1': 'hevc', b'vp09': 'vp9', b'av01': 'av1', b'mp4v': 'mpeg4',
+                  b'mp4a': 'aac', b'ac-3': 'ac3', b'ec-3': 'eac3', b'Opus': 'opus', b'.mp3': 'mp3'}
+    # MPEG-TS stream types, streams of other types make parsing fail, as their kind depends on descriptors
+    TS_STREAM_TYPES = {0x1B: ('video', 'h264'), 0x24: ('video', 'hevc'), 0x02: ('video', 'mpeg2video'), 0x10: ('video', 'mpeg4'),
+                       0x0F: ('audio', 'aac'), 0x11: ('audio', 'aac_latm'), 0x03: ('audio', 'mp2'), 0x04: ('audio', 'mp3'),
+                       0x81: ('audio', 'ac3'), 0x87: ('audio', 'eac3')}
+    PTS_CLOCK = 90000
+
+    def __init__(self, uri: str):
+        """
+
+        @param uri: local path or http(s) URL
+        """
+        self.uri = uri
+        self.remote = uri.lower().startswith('http')
+        self.file = None
+        self.size = None
+        self.bytes_read = 0
+
+    @classmethod
+    def parse_file(cls, uri: str):
+        """
+        Parses headers of a file, logging failures
+        @param uri: local path or http(s) URL
+        @return: dict of MediaProbe fields or None
+        """
+        parser = cls(uri)
+        try:
+            return parser.parse()
+        except Exception as e:
+            logger.info(f'Unable to parse container headers of {uri}: {e}')
+            return None
+        finally:
+            parser.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def read(self, offset: int, size: int) -> bytes:
+        """
+        Reads a byte range, shorter at the end of file
+        @param offset:
+        @param size:
+        @return:
+        """
+        if size <= 0:
+            return b''
+        if self.remote:
+            request = urllib.request.Request(self.uri, headers={'Range': f'bytes={offset}-{offset + size - 1}'})
+            with urllib.request.urlopen(request) as response:
+                # servers not supporting ranges would send the whole file
+                if response.status != 206:
+                    raise ValueError('Server does not support range requests')
+                content_range = response.headers.get('Content-Range', '')
+                if self.size is None and '/' in content_range:
+                    self.size = int(content_range.rsplit('/', 1)[1])
+                data = response.read(size)
+        else:
+            if self.file is None:
+                self.file = open(self.uri, 'rb')
+                self.size = os.fstat(self.file.fileno()).st_size
+            self.file.seek(offset)
+            data = self.file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def parse(self):
+        """
+        Detects container format and parses its headers
+        @return: dict of MediaProbe fields or None if format is not supported
+        """
+        head = self.read(0, self.READ_SIZE)
+        if len(head) > self.TS_PACKET_SIZE and head[0] == 0x47 and head[self.TS_PACKET_SIZE] == 0x47:
+            return self._parse_ts(head)
+        if len(head) >= 8 and head[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide'):
+            return self._parse_mp4(head)
+        return None
+
+    # MP4
+
+    @staticmethod
+    def _box_header(data: bytes, offset: int):
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', data, offset + 8)
+            header_size = 16
+        return size, box_type, header_size
+
+    def _parse_mp4(self, head: bytes):
+        offset = 0
+        moov = None
+        while self.size is None or offset < self.size:
+            header = head[offset:offset + 16] if offset + 16 <= len(head) else self.read(offset, 16)
+            if len(header) < 8:
+                break
+            size, box_type, header_size = self._box_header(header, 0)
+            if size == 0:
+                size = self.size - offset
+            if size < header_size:
+                return None
+            if box_type == b'moov':
+                if size > self.MAX_MOOV_SIZE:
+                    return None
+                moov = head[offset + header_size:offset + size] if offset + size <= len(head) else self.read(offset + header_size, size - header_size)
+                break
+            offset += size
+        if moov is None:
+            return None
+        movie = {}
+        tracks = []
+        self._parse_boxes(moov, movie, tracks)
+        video = next((t for t in tracks if t.get('codec_type') == 'video'), None)
+        if video is None or not video.get('stts') or not video.get('timescale') or not movie.get('timescale') or 'sps' not in video:
+            return None
+        width, height, _ = self._parse_sps(video['sps'])
+        stts = video['stts']
+        frame_count = sum(count for count, _ in stts)
+        if len(stts) == 1 or (len(stts) == 2 and stts[1][0] == 1):
+            delta = stts[0][1]
+        else:
+            # most frequent frame duration approximates rate guessed by demuxer from timestamps
+            delta = Counter(d for count, d in stts for _ in range(min(count, 1024))).most_common(1)[0][0]
+        r_frame_rate = float(Fraction(video['timescale'], delta)) if delta else 0.0
+        media_duration = sum(count * d for count, d in stts)
+        avg_frame_rate = float(Fraction(frame_count * video['timescale'], media_duration)) if media_duration else 0.0
+        # demuxer reports duration of the longest track and start of the earliest one, delayed by empty edits
+        duration = max((self._track_duration(t) for t in tracks if t.get('timescale')), default=movie['duration'] / movie['timescale'])
+        start_time = min(t.get('empty_edits', 0) / movie['timescale'] for t in tracks)
+        streams = [{'index': i, 'codec_type': t.get('codec_type', 'data'), 'codec_name': t.get('codec_name', 'unknown')} for i, t in enumerate(tracks)]
+        return self._fields(guess_frame_rate(r_frame_rate, avg_frame_rate), frame_count, width, height, duration, start_time, streams)
+
+    @staticmethod
+    def _track_duration(track: dict) -> float:
+        # samples before edit list start are dropped, unless the edit only compensates composition time offsets
+        skipped = 0 if track.get('ctts') else track.get('media_time', 0)
+        return (track['duration'] - skipped) / track['timescale']
+
+    def _fields(self, fps, frame_count, width, height, duration, start_time, streams) -> dict:
+        return {'filename': self.uri, 'fps': fps, 'frame_count': frame_count, 'width': width, 'height': height, 'duration': duration, 'size': self.size,
+                'bit_rate': self.size * 8 * 10 ** 6 // round(duration * 10 ** 6) if duration > 0 else 0, 'start_time': start_time, 'streams': streams}
+
+    def _parse_boxes(self, data: bytes, movie: dict, tracks: list):
+        offset = 0
+        while offset + 8 <= len(data):
+            size, box_type, header_size = self._box_header(data, offset)
+            if size == 0:
+                size = len(data) - offset
+            if size < header_size:
+                raise ValueError(f'Invalid {box_type} box size')
+            body = data[offset + header_size:offset + size]
+            if box_type == b'trak':
+                tracks.append({})
+            if box_type in self.MP4_CONTAINERS:
+                self._parse_boxes(body, movie, tracks)
+            elif box_type == b'mvhd':
+                movie['timescale'], movie['duration'] = self._parse_time_header(body)
+            elif tracks:
+                self._parse_track_box(box_type, body, tracks[-1])
+            offset += size
+
+    @staticmethod
+    def _parse_time_header(body: bytes):
+        # mvhd and mdhd: version, flags, creation and modification times, timescale, duration
+        if body[0] == 1:
+            return struct.unpack_from('>IQ', body, 20)
+        return struct.unpack_from('>II', body, 12)
+
+    def _parse_track_box(self, box_type: bytes, body: bytes, track: dict):
+        if box_type == b'elst':
+            version = body[0]
+            entry_count, = struct.unpack_from('>I', body, 4)
+            entry = struct.Struct('>Qq' if version == 1 else '>Ii')
+            empty_edits = 0
+            for i in range(entry_count):
+                segment_duration, media_time = entry.unpack_from(body, 8 + (entry.size + 4) * i)
+                if media_time != -1:
+                    track['media_time'] = media_time
+                    break
+                empty_edits += segment_duration
+            track['empty_edits'] = empty_edits
+        elif box_type == b'mdhd':
+            track['timescale'], track['duration'] = self._parse_time_header(body)
+        elif box_type == b'hdlr':
+            track['codec_type'] = self.MP4_HANDLERS.get(body[8:12], 'data')
+        elif box_type == b'stsd':
+            entry_count, = struct.unpack_from('>I', body, 4)
+            if entry_count:
+                entry_size, entry_type = struct.unpack_from('>I4s', body, 8)
+                track['codec_name'] = self.MP4_CODECS.get(entry_type, entry_type.decode('ascii', 'ignore').strip())
+                if track.get('codec_type') == 'video' and track['codec_name'] == 'h264':
+                    sps = self._avc_sps(body[8:8 + entry_size])
+                    if sps is not None:
+                        track['sps'] = sps
+        elif box_type == b'ctts':
+            track['ctts'] = True
+        elif box_type == b'stts':
+            entry_count, = struct.unpack_from('>I', body, 4)
+            track['stts'] = [struct.unpack_from('>II', body, 8 + 8 * i) for i in range(entry_count)]
+
+    @classmethod
+    def _avc_sps(cls, entry: bytes):
+        """
+        Finds first SPS of H.264 visual sample entry
+        @param entry: avc1 or avc3 sample entry, including its header
+        @return: SPS NAL unit payload, without header byte, or None if it isn't stored in avcC box
+        """
+        # box header, 8 bytes of sample entry fields and 70 bytes of visual sample entry fields precede child boxes
+        offset = 8 + 8 + 70
+        while offset + 8 <= len(entry):
+            size, box_type, header_size = cls._box_header(entry, offset)
+            if size < header_size:
+                return None
+            if box_type == b'avcC':
+                body = entry[offset + header_size:offset + size]
+                # version, profile, compatibility, level, NAL length size, number of SPS, then length prefixed SPS
+                if len(body) < 8 or not body[5] & 0x1F:
+                    return None
+                sps_length, = struct.unpack_from('>H', body, 6)
+                return body[9:8 + sps_length]
+            offset += size
+        return None
+
+    # MPEG-TS
+
+    def _ts_packets(self, data: bytes):
+        # yields pid, payload unit start flag and payload of each packet
+        packet_size = self.TS_PACKET_SIZE
+        offset = data.find(b'\x47')
+        while offset >= 0 and offset + packet_size <= len(data):
+            if data[offset] != 0x47:
+                offset = data.find(b'\x47', offset + 1)
+                continue
+            b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+            pid = ((b1 & 0x1F) << 8) | b2
+            start = offset + 4
+            if b3 & 0x20:
+                start += 1 + data[start]
+            if b3 & 0x10 and start < offset + packet_size:
+                yield pid, bool(b1 & 0x40), data[start:offset + packet_size]
+            offset += packet_size
+
+    @staticmethod
+    def _section(payload: bytes) -> bytes:
+        # skips pointer field, returns section up to CRC
+        start = 1 + payload[0]
+        length = ((payload[start + 1] & 0x0F) << 8) | payload[start + 2]
+        return payload[start:start + 3 + length - 4]
+
+    @staticmethod
+    def _pes_pts(payload: bytes):
+        if len(payload) < 14 or payload[:3] != b'\x00\x00\x01' or not payload[7] & 0x80:
+            return None
+        p = payload[9:14]
+        return ((p[0] >> 1) & 0x07) << 30 | p[1] << 22 | (p[2] >> 1) << 15 | p[3] << 7 | p[4] >> 1
+
+    def _ts_head_packets(self, head: bytes):
+        # yields packets of file head, reading further as they are consumed
+        chunk_size = self.READ_SIZE // self.TS_PACKET_SIZE * self.TS_PACKET_SIZE
+        offset = len(head) // self.TS_PACKET_SIZE * self.TS_PACKET_SIZE
+        yield from self._ts_packets(head[:offset])
+        while offset < self.TS_HEAD_SIZE:
+            chunk = self.read(offset, chunk_size)
+            yield from self._ts_packets(chunk)
+            if len(chunk) < chunk_size:
+                break
+            offset += chunk_size
+
+    def _parse_ts(self, head: bytes):
+        pmt_pid = None
+        streams = None
+        video_pid = None
+        es = b''
+        pts = []
+        sps = None
+        for pid, unit_start, payload in self._ts_head_packets(head):
+            if pid == 0 and unit_start and pmt_pid is None:
+                section = self._section(payload)
+                for i in range(8, len(section) - 3, 4):
+                    program, = struct.unpack_from('>H', section, i)
+                    if program:
+                        pmt_pid = struct.unpack_from('>H', section, i + 2)[0] & 0x1FFF
+                        break
+            elif pid == pmt_pid and unit_start and streams is None:
+                streams, video_pid = self._parse_pmt(self._section(payload))
+                if streams is None:
+                    return None
+            elif pid == video_pid:
+                if unit_start:
+                    value = self._pes_pts(payload)
+                    if value is not None:
+                        pts.append(value)
+                    payload = payload[9 + payload[8]:] if len(payload) > 9 else b''
+                if sps is None:
+                    es += payload
+                    sps = self._find_sps(es)
+                if sps is not None and len(pts) >= self.TS_PTS_COUNT:
+                    break
+        if video_pid is None or sps is None or not pts:
+            return None
+        width, height, fps = self._parse_sps(sps)
+        if not fps:
+            deltas = [b - a for a, b in zip(sorted(pts), sorted(pts)[1:]) if b > a]
+            if not deltas:
+                return None
+            fps = float(Fraction(self.PTS_CLOCK, min(deltas)))
+        last_pts = self._last_pts(video_pid)
+        if last_pts is None:
+            return None
+        start_pts = min(pts)
+        if last_pts < start_pts:
+            last_pts += 1 << 33
+        # demuxer estimates duration up to the end of the last frame
+        duration = (last_pts - start_pts) / self.PTS_CLOCK + 1 / fps
+        return self._fields(fps, int(duration * fps + 0.5), width, height, duration, start_pts / self.PTS_CLOCK, streams)
+
+    def _parse_pmt(self, section: bytes):
+        program_info_length = ((section[10] & 0x0F) << 8) | section[11]
+        offset = 12 + program_info_length
+        streams = []
+        video_pid = None
+        while offset + 5 <= len(section):
+            stream_type = section[offset]
+            pid = ((section[offset + 1] & 0x1F) << 8) | section[offset + 2]
+            es_info_length = ((section[offset + 3] & 0x0F) << 8) | section[offset + 4]
+            if stream_type not in self.TS_STREAM_TYPES:
+                return None, None
+            codec_type, codec_name = self.TS_STREAM_TYPES[stream_type]
+            if codec_type == 'video' and video_pid is None:
+                # only H.264 parameter sets are parsed
+                if codec_name != 'h264':
+                    return None, None
+                video_pid = pid
+            streams.append({'index': len(streams), 'codec_type': codec_type, 'codec_name': codec_name})
+            offset += 5 + es_info_length
+        return streams, video_pid
+
+    def _last_pts(self, video_pid: int):
+        if self.size is None:
+            return None
+        size = self.READ_SIZE
+        while True:
+            size = min(self.size, self.TS_TAIL_SIZE, size)
+            # tail is aligned to packets counted from the beginning of file
+            offset = (self.size - size) // self.TS_PACKET_SIZE * self.TS_PACKET_SIZE
+            tail = self.read(offset, self.size - offset)
+            values = [self._pes_pts(payload) for pid, unit_start, payload in self._ts_packets(tail) if pid == video_pid and unit_start]
+            values = [v for v in values if v is not None]
+            if len(values) >= self.TS_PTS_COUNT or size >= min(self.size, self.TS_TAIL_SIZE):
+                return max(values) if values else None
+            size *= 2
+
+    @staticmethod
+    def _find_sps(es: bytes):
+        start = es.find(b'\x00\x00\x01')
+        while start >= 0:
+            end = es.find(b'\x00\x00\x01', start + 3)
+            if start + 3 < len(es) and es[start + 3] & 0x1F == 7:
+                # complete only once the next start code arrived
+                return es[start + 4:end] if end >= 0 else None
+            start = end
+        return None
+
+    @staticmethod
+    def _parse_sps(nal: bytes):
+        """
+        Parses H.264 sequence parameter set
+        @param nal: SPS NAL unit payload, without header byte
+        @return: width, height and frame rate from VUI timing info, 0 if absent
+        """
+        rbsp = nal.replace(b'\x00\x00\x03', b'\x00\x00')
+        r = BitReader(rbsp)
+        profile_idc = r.u(8)
+        r.u(16)
+        r.ue()
+        chroma_format_idc = 1
+        separate_colour_plane = 0
+        if profile_idc in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+            chroma_format_idc = r.ue()
+            if chroma_format_idc == 3:
+                separate_colour_plane = r.u(1)
+            r.ue()
+            r.ue()
+            r.u(1)
+            if r.u(1):
+                for i in range(8 if chroma_format_idc != 3 else 12):
+                    if r.u(1):
+                        last, next_scale = 8, 8
+                        for _ in range(16 if i < 6 else 64):
+                            if next_scale:
+                                next_scale = (last + r.se() + 256) % 256
+                            last = next_scale or last
+        r.ue()
+        pic_order_cnt_type = r.ue()
+        if pic_order_cnt_type == 0:
+            r.ue()
+        elif pic_order_cnt_type == 1:
+            r.u(1)
+            r.se()
+            r.se()
+            for _ in range(r.ue()):
+                r.se()
+        r.ue()
+        r.u(1)
+        width_mbs = r.ue() + 1
+        height_map_units = r.ue() + 1
+        frame_mbs_only = r.u(1)
+        if not frame_mbs_only:
+            r.u(1)
+        r.u(1)
+        crop = [0, 0, 0, 0]
+        if r.u(1):
+            crop = [r.ue() for _ in range(4)]
+        chroma_array_type = 0 if separate_colour_plane else chroma_format_idc
+        crop_x = 1 if chroma_array_type in (0, 3) else 2
+        crop_y = (2 - frame_mbs_only) * (2 if chroma_array_type == 1 else 1)
+        width = width_mbs * 16 - crop_x * (crop[0] + crop[1])
+        height = (2 - frame_mbs_only) * height_map_units * 16 - crop_y * (crop[2] + crop[3])
+        fps = 0.0
+        if r.u(1):
+            if r.u(1) and r.u(8) == 255:
+                r.u(32)
+            if r.u(1):
+                r.u(1)
+            if r.u(1):
+                r.u(4)
+                if r.u(1):
+                    r.u(24)
+            if r.u(1):
+                r.ue()
+                r.ue()
+            if r.u(1):
+                num_units_in_tick = r.u(32)
+                time_scale = r.u(32)
+                if num_units_in_tick:
+                    fps = float(Fraction(time_scale, 2 * num_units_in_tick))
+        return width, height, fps
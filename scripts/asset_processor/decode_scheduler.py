@@ -0,0 +1,74 @@
+"""
+Scheduling of video decoding jobs
+"""
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+logger = logging.getLogger()
+
+
+class DecodeScheduler:
+    """
+    Runs decoding jobs keyed by video path with limited concurrency.
+    Threads are a good default, since decoders release the GIL, process pool is an option for readers that don't.
+    With a single worker jobs are deferred until their result is requested, so that videos are decoded one at a time, the way they are consumed.
+    """
+
+    def __init__(self, max_workers: int = 1, use_processes: bool = False):
+        """
+
+        @param max_workers: max number of videos decoded at the same time
+        @param use_processes: run jobs in a process pool instead of threads. Job functions and arguments have to be picklable then.
+        """
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.jobs = {}
+        self.executor = None
+        if max_workers > 1:
+            executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            self.executor = executor_class(max_workers=max_workers)
+            logger.info(f'Decoding up to {max_workers} videos concurrently using {"processes" if use_processes else "threads"}')
+
+    @property
+    def concurrent(self) -> bool:
+        return self.executor is not None
+
+    def submit(self, key, fn, *args):
+        """
+        Schedules a job, unless a job with the same key is already scheduled
+        @param key: job key, e.g. video path
+        @param fn: function to run
+        @param args: function arguments
+        @return:
+        """
+        if key in self.jobs:
+            return
+        if self.executor is None:
+            self.jobs[key] = (fn, args)
+        else:
+            self.jobs[key] = self.executor.submit(fn, *args)
+
+    def result(self, key):
+        """
+        Waits for job to complete and returns its result, re-raising job exception if any
+        @param key:
+        @return:
+        """
+        job = self.jobs.pop(key)
+        if isinstance(job, Future):
+            return job.result()
+        fn, args = job
+        return fn(*args)
+
+    def shutdown(self):
+        """
+        Cancels pending jobs and releases workers
+        @return:
+        """
+        for job in self.jobs.values():
+            if isinstance(job, Future):
+                job.cancel()
+        self.jobs.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
@@ -0,0 +1,106 @@
+"""
+Per-frame features shared by pairwise metrics
+"""
+import threading
+
+
+class FrameFeatures:
+    """
+    Sample frame together with its unary features (luminance plane, Gaussian filtered plane, edges, DCT, LBP, GLCM properties, hashes).
+    Features are computed on first use, by a function given by the caller, and stored in a FrameFeatureCache under (file, sample index, transform),
+    or in the instance itself if the frame is not cached.
+    """
+
+    def __init__(self, frame, plane=None, cache=None, file=None, index=None):
+        """
+
+        @param frame: BGR frame, may be None if only luminance features are used
+        @param plane: luminance plane of the frame, if it was decoded directly
+        @param cache: FrameFeatureCache the features are stored in, None to keep them in the instance
+        @param file: path of the video the frame was sampled from
+        @param index: sample index of the frame
+        """
+        self.frame = frame
+        self.plane = plane
+        self.cache = cache
+        self.file = file
+        self.index = index
+        self.features = {}
+
+    def get(self, transform: str, compute):
+        """
+        Returns feature of the frame, computing it on first use
+        @param transform: feature name
+        @param compute: function without arguments computing the feature
+        @return:
+        """
+        if self.cache is not None:
+            return self.cache.get((self.file, self.index, transform), compute)
+        if transform not in self.features:
+            self.features[transform] = compute()
+        return self.features[transform]
+
+
+class FrameFeatureCache:
+    """
+    Features of sample frames computed once per request and shared by all pairwise metrics and renditions.
+    Source samples are compared against every rendition and each sample is also the next frame of the previous one,
+    so caching their features removes most of per-pair work done on the source side.
+    Entries are keyed by (file, sample index, transform). Concurrent requests of the same entry compute it only once.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def frame(self, file, index, frame, plane=None) -> FrameFeatures:
+        """
+        Returns features of a sample frame, backed by this cache
+        @param file: video path
+        @param index: sample index
+        @param frame: BGR frame
+        @param plane: luminance plane
+        @return:
+        """
+        return FrameFeatures(frame, plane, self, file, index)
+
+    def get(self, key: tuple, compute):
+        """
+        Returns cached value, computing and storing it if missing
+        @param key: (file, sample index, transform)
+        @param compute: function without arguments computing the value
+        @return:
+        """
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+            key_lock = self.pending.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.lock:
+                if key in self.entries:
+                    self.hits += 1
+                    return self.entries[key]
+            value = compute()
+            with self.lock:
+                self.entries[key] = value
+                self.pending.pop(key, None)
+                self.misses += 1
+        return value
+
+    def evict(self, file):
+        """
+        Drops features of all samples of a video
+        @param file: video path
+        @return:
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == file]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,243 @@
+"""
+Packet level index of a video stream: presentation timestamps and keyframe positions
+"""
+import os
+import struct
+import hashlib
+import subprocess
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from .timestamp_aligner import nearest
+
+logger = logging.getLogger()
+
+# content keys of recently hashed files, keyed by (path, size, mtime), least recently used first
+_content_keys = OrderedDict()
+_content_keys_lock = threading.Lock()
+
+
+def parse_compact_line(line: str):
+    """
+    Splits a line of ffprobe compact writer output into section name and field values
+    @param line: e.g. "packet|pts_time=0.0|flags=K_"
+    @return: Tuple[section, dict of field values]
+    """
+    section, _, fields = line.strip().partition('|')
+    return section, dict(field.split('=', 1) for field in fields.split('|') if '=' in field)
+
+
+class FrameIndex:
+    """
+    Index of video stream packets, built in a single demux-only pass with ffprobe.
+    Records are sorted by presentation timestamp, so position of a record is the index
+    of the corresponding decoded frame. Timestamps are relative to the container start time,
+    the same way OpenCV reports them.
+    """
+    DTYPE = np.dtype([('pts', np.float64), ('key', np.bool_), ('size', np.int32), ('pos', np.int64)])
+    # directory for index sidecar files, None disables persistence
+    CACHE_DIR = None
+    # max total bytes of sidecar files, least recently used ones are deleted once it is exceeded, 0 means no limit
+    CACHE_MAX_BYTES = 256 * 1024 ** 2
+    # sidecar layout: magic, version, video file size, start time, number of records, followed by raw records
+    SIDECAR_HEADER = struct.Struct('<4sIqdq')
+    SIDECAR_MAGIC = b'FIDX'
+    SIDECAR_VERSION = 1
+    # bytes read at a time when hashing file content
+    HASH_READ_SIZE = 1 << 20
+    # max number of memoized content keys
+    CONTENT_KEYS_SIZE = 1024
+
+    def __init__(self, filename: str, packets: np.ndarray, start_time: float = 0.0):
+        """
+
+        @param filename: video file the index belongs to
+        @param packets: structured array of FrameIndex.DTYPE records in any order
+        @param start_time: container start time, already subtracted from packet timestamps
+        """
+        self.filename = filename
+        self.start_time = start_time
+        self.packets = np.sort(packets, order='pts')
+        self.keyframes = np.flatnonzero(self.packets['key'])
+
+    def __len__(self):
+        return len(self.packets)
+
+    @property
+    def pts(self) -> np.ndarray:
+        return self.packets['pts']
+
+    @classmethod
+    def load(cls, filename: str, cache_dir: str = None):
+        """
+        Returns index of the file, reading it from sidecar file if the same content was indexed before, otherwise builds and persists it.
+        Sidecars are keyed by content rather than path, so copies of the same video downloaded to different locations share the index.
+        @param filename:
+        @param cache_dir: sidecar directory, defaults to FrameIndex.CACHE_DIR
+        @return: FrameIndex instance
+        """
+        cache_dir = cache_dir or cls.CACHE_DIR
+        if not cache_dir:
+            return cls.build(filename)
+        sidecar = os.path.join(cache_dir, f'{cls.content_key(filename)}.fidx')
+        try:
+            index = cls._read_sidecar(filename, sidecar)
+            if index is not None:
+                # modification time orders sidecars for eviction
+                os.utime(sidecar)
+                logger.info(f'Frame index of {filename} loaded from {sidecar}')
+                return index
+        except Exception:
+            logger.exception(f'Unable to read frame index sidecar {sidecar}, rebuilding')
+        index = cls.build(filename)
+        try:
+            index._write_sidecar(sidecar)
+            cls.evict(cache_dir)
+        except Exception:
+            logger.exception(f'Unable to write frame index sidecar {sidecar}')
+        return index
+
+    @classmethod
+    def evict(cls, cache_dir: str, max_bytes: int = None):
+        """
+        Deletes least recently used sidecar files until their total size fits the limit
+        @param cache_dir: sidecar directory
+        @param max_bytes: defaults to FrameIndex.CACHE_MAX_BYTES
+        @return:
+        """
+        max_bytes = cls.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        if not max_bytes:
+            return
+        sidecars = []
+        with os.scandir(cache_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.fidx'):
+                    stat = entry.stat()
+                    sidecars.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in sidecars)
+        for _, size, path in sorted(sidecars):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # deleted by another process
+                pass
+            total -= size
+
+    @classmethod
+    def content_key(cls, filename: str) -> str:
+        """
+        Computes a key identifying file content, SHA-256 of the whole file. Files differing anywhere get different keys, so cached values
+        derived from a file are never served for another one, e.g. a re-encoded file with the same size, head and tail.
+        Keys of the last CONTENT_KEYS_SIZE files are memoized by path, size and modification time, so a file is hashed once unless it changes.
+        @param filename:
+        @return: hex digest
+        """
+        stat = os.stat(filename)
+        stat_key = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+        with _content_keys_lock:
+            key = _content_keys.get(stat_key)
+            if key is not None:
+                _content_keys.move_to_end(stat_key)
+                return key
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(cls.HASH_READ_SIZE), b''):
+                digest.update(chunk)
+        key = digest.hexdigest()
+        with _content_keys_lock:
+            _content_keys[stat_key] = key
+            while len(_content_keys) > cls.CONTENT_KEYS_SIZE:
+                _content_keys.popitem(last=False)
+        return key
+
+    @classmethod
+    def _read_sidecar(cls, filename, sidecar):
+        if not os.path.exists(sidecar):
+            return None
+        with open(sidecar, 'rb') as f:
+            data = f.read()
+        magic, version, file_size, start_time, count = cls.SIDECAR_HEADER.unpack_from(data)
+        if magic != cls.SIDECAR_MAGIC or version != cls.SIDECAR_VERSION or file_size != os.path.getsize(filename):
+            logger.warning(f'Frame index sidecar {sidecar} is stale')
+            return None
+        packets = np.frombuffer(data, dtype=cls.DTYPE, count=count, offset=cls.SIDECAR_HEADER.size).copy()
+        return cls(filename, packets, start_time)
+
+    def _write_sidecar(self, sidecar):
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        # write to temporary file first, so that concurrent readers never see partial index
+        tmp_name = f'{sidecar}.{os.getpid()}.tmp'
+        with open(tmp_name, 'wb') as f:
+            f.write(self.SIDECAR_HEADER.pack(self.SIDECAR_MAGIC, self.SIDECAR_VERSION, os.path.getsize(self.filename), self.start_time, len(self.packets)))
+            f.write(self.packets.tobytes())
+        os.replace(tmp_name, sidecar)
+
+    @classmethod
+    def build(cls, filename: str):
+        """
+        Reads packet metadata of the first video stream without decoding it
+        @param filename:
+        @return: FrameIndex instance
+        """
+        ffprobe_cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                       '-show_entries', 'format=start_time:packet=pts_time,dts_time,size,pos,flags',
+                       '-of', 'compact', filename]
+        ffprobe = subprocess.Popen(ffprobe_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = ffprobe.communicate()
+        if ffprobe.returncode:
+            raise Exception(f'Unable to index video file {filename}: {stderr.decode("ascii", "ignore")}')
+        start_time, records = cls._parse_compact(stdout.decode('ascii', 'ignore').splitlines())
+        packets = np.array(records, dtype=cls.DTYPE)
+        packets['pts'] -= start_time
+        logger.info(f'Indexed {len(packets)} packets of {filename}, {int(np.sum(packets["key"]))} keyframes')
+        return cls(filename, packets, start_time)
+
+    @staticmethod
+    def _parse_compact(lines):
+        """
+        Parses ffprobe compact writer output, one section per line: "packet|pts_time=0.0|..."
+        @param lines:
+        @return: Tuple[start_time, list of (pts, key, size, pos) tuples]
+        """
+        start_time = 0.0
+        records = []
+        for line in lines:
+            section, values = parse_compact_line(line)
+            if section == 'format':
+                start = values.get('start_time', 'N/A')
+                start_time = float(start) if start != 'N/A' else 0.0
+            elif section == 'packet':
+                # some containers don't store pts for every packet, dts is a good enough estimate then
+                ts = values.get('pts_time', 'N/A')
+                if ts == 'N/A':
+                    ts = values.get('dts_time', 'N/A')
+                if ts == 'N/A':
+                    continue
+                pos = values.get('pos', 'N/A')
+                records.append((float(ts),
+                                'K' in values.get('flags', ''),
+                                int(values.get('size', 0)),
+                                int(pos) if pos != 'N/A' else -1))
+        return start_time, records
+
+    def keyframe_before(self, frame_idx: int) -> int:
+        """
+        Returns index of the closest keyframe at or before given frame, that is where decoding has to start to obtain the frame
+        @param frame_idx:
+        @return:
+        """
+        pos = np.searchsorted(self.keyframes, frame_idx, side='right') - 1
+        if pos < 0:
+            return 0
+        return int(self.keyframes[pos])
+
+    def nearest(self, timestamps):
+        """
+        Finds frames closest by presentation time to each of the timestamps
+        @param timestamps: sequence of timestamps, in seconds
+        @return: Tuple[array of frame indexes, array of absolute timestamp differences]
+        """
+        return nearest(self.pts, timestamps)
@@ -0,0 +1,123 @@
+"""
+Shared memory storage of video frames, for passing frames between processes without serialization
+"""
+import logging
+from collections import deque
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+logger = logging.getLogger()
+
+
+class FrameRing:
+    """
+    Fixed number of preallocated uint8 frame slots in a shared memory block.
+    Slots are handed out and reference counted by the process that created the ring. Other processes attach to the block by name
+    (FrameRing objects are pickled that way) and read or write the slots they were given, frames never go through pipes.
+    A slot returns to the pool of free slots when its last reference is released, so that e.g. source frames stay in place
+    while any rendition is compared against them.
+    """
+
+    def __init__(self, slots: int, frame_shape, name: str = None):
+        """
+
+        @param slots: number of frame slots
+        @param frame_shape: shape of every frame, e.g. (height, width, 3)
+        @param name: name of existing shared memory block to attach to. If None, a new block is created and owned by this object.
+        """
+        if shared_memory is None:
+            raise Exception('Shared memory frame transport requires Python 3.8 or newer')
+        self.slots = slots
+        self.frame_shape = tuple(frame_shape)
+        frame_bytes = int(np.prod(self.frame_shape))
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(1, slots * frame_bytes))
+            self.refcounts = np.zeros(slots, dtype=np.int32)
+            self.free_slots = deque(range(slots))
+            logger.info(f'Allocated {slots} shared frame slots of shape {self.frame_shape} in {self.shm.name}')
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.refcounts = None
+            self.free_slots = None
+        self.frames = np.ndarray((slots,) + self.frame_shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    def __getstate__(self):
+        return {'name': self.shm.name, 'slots': self.slots, 'frame_shape': self.frame_shape}
+
+    def __setstate__(self, state):
+        self.__init__(state['slots'], state['frame_shape'], state['name'])
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def free(self) -> int:
+        return len(self.free_slots)
+
+    def acquire(self, count: int) -> list:
+        """
+        Takes free slots, each with a single reference
+        @param count: number of slots
+        @return: list of slot indexes
+        """
+        self._check_owner()
+        if count > len(self.free_slots):
+            raise Exception(f'Frame ring {self.name} is full: {count} slots requested, {len(self.free_slots)} free')
+        slots = [self.free_slots.popleft() for _ in range(count)]
+        self.refcounts[slots] = 1
+        return slots
+
+    def retain(self, slots):
+        """
+        Adds reference to each of the slots
+        @param slots:
+        @return:
+        """
+        self._check_owner()
+        np.add.at(self.refcounts, list(slots), 1)
+
+    def release(self, slots):
+        """
+        Drops reference to each of the slots, slots without references become free
+        @param slots:
+        @return:
+        """
+        self._check_owner()
+        for slot in slots:
+            if self.refcounts[slot] <= 0:
+                raise Exception(f'Slot {slot} of frame ring {self.name} is not in use')
+            self.refcounts[slot] -= 1
+            if self.refcounts[slot] == 0:
+                self.free_slots.append(slot)
+
+    def write(self, slot: int, frame: np.ndarray):
+        self.frames[slot] = frame
+
+    def frame(self, slot: int) -> np.ndarray:
+        """
+        Returns frame stored in the slot, without copying it. The view is only valid while slot is referenced.
+        @param slot:
+        @return:
+        """
+        return self.frames[slot]
+
+    def close(self):
+        """
+        Detaches from shared memory, and frees it if this object is the owner
+        @return:
+        """
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def _check_owner(self):
+        if not self.owner:
+            raise Exception('Frame ring slots can only be managed by the process that created the ring')
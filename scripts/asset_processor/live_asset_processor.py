@@ -0,0 +1,313 @@
+"""
+Incremental processing of source and renditions that are still being written, e.g. streaming segments or pipes
+"""
+import threading
+import logging
+import numpy as np
+from .video_asset_processor import VideoAssetProcessor
+from .video_capture import VideoCapture
+from .video_metrics import VideoMetrics
+
+logger = logging.getLogger()
+
+
+class SampleSchedule:
+    """
+    Sample timestamps shared by the source and renditions. Time is split into windows of equal length and one sample is taken at a random offset
+    within each window, so total frame count is never needed. To keep memory bounded on long streams, windows are retained with reservoir sampling:
+    the first max_samples windows are kept, each next window k replaces a random retained one with probability max_samples / (k + 1).
+    Decisions are drawn from a seeded generator in window order, so all videos agree on the retained windows whichever reads ahead.
+    """
+
+    def __init__(self, interval: float, max_samples: int, seed=None):
+        """
+
+        @param interval: window length, seconds
+        @param max_samples: max number of retained windows
+        @param seed: random generator seed
+        """
+        self.interval = interval
+        self.max_samples = max_samples
+        self.random = np.random.RandomState(seed)
+        # sample offset within each window, as a fraction of interval
+        self.offsets = []
+        self.retained = []
+        self.evicted = set()
+        self.lock = threading.Lock()
+
+    def _extend(self, window):
+        with self.lock:
+            while len(self.offsets) <= window:
+                k = len(self.offsets)
+                self.offsets.append(self.random.uniform())
+                if len(self.retained) < self.max_samples:
+                    self.retained.append(k)
+                else:
+                    j = self.random.randint(0, k + 1)
+                    if j < self.max_samples:
+                        self.evicted.add(self.retained[j])
+                        self.retained[j] = k
+                    else:
+                        self.evicted.add(k)
+
+    def window(self, timestamp: float) -> int:
+        return int(timestamp // self.interval)
+
+    def timestamp(self, window: int) -> float:
+        """
+        Sample timestamp of a window
+        @param window:
+        @return:
+        """
+        self._extend(window)
+        return (window + self.offsets[window]) * self.interval
+
+    def is_retained(self, window: int) -> bool:
+        self._extend(window)
+        return window not in self.evicted
+
+
+class LiveVideo:
+    """
+    Samples collected from a single video by its reader thread
+    """
+
+    def __init__(self, path, capture: VideoCapture, tolerance: float, keep_candidates: bool):
+        """
+
+        @param path:
+        @param capture:
+        @param tolerance: max difference between window sample timestamp and frames collected for it
+        @param keep_candidates: keep all frames within tolerance, rather than only the closest one
+        """
+        self.path = path
+        self.capture = capture
+        self.tolerance = tolerance
+        self.keep_candidates = keep_candidates
+        # frames collected for each window
+        self.samples = {}
+        self.last_timestamp = -np.inf
+        self.finished = False
+        self.thread = None
+
+    def is_complete(self, schedule: SampleSchedule, window: int) -> bool:
+        """
+        Checks whether reader has passed all frames that could be collected for a window
+        """
+        return self.finished or self.last_timestamp > schedule.timestamp(window) + self.tolerance
+
+
+class LiveAssetProcessor(VideoAssetProcessor):
+    """
+    Incremental counterpart of VideoAssetProcessor for growing files and pipes. Each video is decoded by its own thread as data arrives,
+    samples are taken on SampleSchedule windows instead of random frame indexes, and process() can be called at any time
+    to aggregate metrics of samples collected so far into provisional features.
+    """
+
+    def __init__(self, original, renditions, metrics_list, features_list=None, max_samples=60, sample_interval=1.0, idle_timeout=10.0,
+                 luminance_plane='hsv_v', seed=None):
+        """
+
+        @param original: source dict, with 'path' key
+        @param renditions: list of rendition dicts, with 'path' key
+        @param metrics_list:
+        @param features_list:
+        @param max_samples: max number of samples kept per video, older samples are evicted at random as new ones arrive
+        @param sample_interval: seconds between consecutive samples, on average
+        @param idle_timeout: seconds to wait for a video to grow before treating it as complete
+        @param luminance_plane: see VideoAssetProcessor
+        @param seed: sampling random generator seed
+        """
+        if luminance_plane not in ['hsv_v', 'y']:
+            raise ValueError(f'Unknown luminance plane {luminance_plane}')
+        self.original_path = original['path']
+        self.renditions_list = renditions
+        self.metrics_list = metrics_list
+        self.features_list = features_list
+        self.max_samples = max_samples
+        self.idle_timeout = idle_timeout
+        self.luminance_plane = luminance_plane
+        self.image_pair_callback = None
+        self.debug_frames = False
+        self.use_gpu = False
+        self.video_reader = 'pyav'
+        self.do_process = True
+        self.make_hd_list = 'temporal_ssim' in metrics_list or 'temporal_psnr' in metrics_list
+        self.make_color_list = (luminance_plane == 'hsv_v' or self.make_hd_list or any(m in self.COLOR_METRICS for m in metrics_list))
+        self.schedule = SampleSchedule(sample_interval, max_samples, seed)
+        self.condition = threading.Condition()
+        self.stopping = False
+        # metrics of (rendition path, window, next window) pairs, computed once
+        self.pair_metrics = {}
+        self.metrics = {}
+        self.videos = []
+        try:
+            source_capture = self.open_capture(self.original_path)
+            self.fps = source_capture.fps
+            self.height = source_capture.width
+            self.width = source_capture.height
+            self.videos.append(LiveVideo(self.original_path, source_capture, 1 / self.fps, False))
+            for rendition in renditions:
+                capture = self.open_capture(rendition['path'])
+                rendition['fps'] = capture.fps
+                rendition['width'] = capture.width
+                rendition['height'] = capture.height
+                self.videos.append(LiveVideo(rendition['path'], capture, 1 / self.fps + 1 / capture.fps, True))
+        except Exception:
+            self.release()
+            raise
+        self.video_metrics = VideoMetrics(self.metrics_list, 16, int(self.height), None, False)
+
+    def open_capture(self, path):
+        keep_hd = self.make_hd_list
+        return VideoCapture(path, video_reader='pyav', frame_size=self.FRAME_SIZE, keep_hd=keep_hd, color=self.make_color_list,
+                            luma=self.luminance_plane == 'y', live=True, idle_timeout=self.idle_timeout)
+
+    def start(self):
+        """
+        Starts reader threads
+        @return:
+        """
+        for video in self.videos:
+            video.thread = threading.Thread(target=self._read, args=(video,), daemon=True)
+            video.thread.start()
+
+    def _read(self, video: LiveVideo):
+        """
+        Reader thread, collects frames close to sample timestamps
+        @param video:
+        @return:
+        """
+        try:
+            while not self.stopping:
+                frame_data = video.capture.read(grab=True)
+                if frame_data is None:
+                    break
+                ts = frame_data.timestamp
+                window = self.schedule.window(ts)
+                retrieved = None
+                # sample timestamp of adjacent window may be closer than the one of frame's own window
+                for w in [window - 1, window, window + 1]:
+                    if w < 0 or not self.schedule.is_retained(w) or abs(ts - self.schedule.timestamp(w)) > video.tolerance:
+                        continue
+                    candidates = video.samples.get(w, [])
+                    if not video.keep_candidates and candidates and abs(candidates[0].timestamp - self.schedule.timestamp(w)) <= abs(ts - self.schedule.timestamp(w)):
+                        continue
+                    if retrieved is None:
+                        retrieved = video.capture.retrieve()
+                    with self.condition:
+                        video.samples[w] = candidates + [retrieved] if video.keep_candidates else [retrieved]
+                with self.condition:
+                    video.last_timestamp = ts
+                    for w in [w for w in video.samples if not self.schedule.is_retained(w)]:
+                        del video.samples[w]
+                    self.condition.notify_all()
+        except Exception:
+            logger.exception(f'Unable to read live video {video.path}')
+        finally:
+            with self.condition:
+                video.finished = True
+                self.condition.notify_all()
+            logger.info(f'Finished reading live video {video.path}')
+
+    @property
+    def running(self) -> bool:
+        return any(not video.finished for video in self.videos)
+
+    def wait(self, timeout=None) -> bool:
+        """
+        Waits for readers to make progress
+        @param timeout: seconds
+        @return: False if all videos were read to the end
+        """
+        with self.condition:
+            if self.running:
+                self.condition.wait(timeout)
+            return self.running
+
+    def _complete_samples(self, video: LiveVideo) -> dict:
+        with self.condition:
+            return {w: list(frames) for w, frames in video.samples.items()
+                    if video.is_complete(self.schedule, w) and self.schedule.is_retained(w)}
+
+    def _match(self, source_samples, rendition: LiveVideo):
+        """
+        Picks rendition candidate closest to source sample for each complete window, with the same tolerance as VideoAssetProcessor
+        @return: dict of window: (source frame, rendition frame)
+        """
+        max_diff = min(1 / (2 * rendition.capture.fps), 1 / (2 * self.fps))
+        pairs = {}
+        for w, candidates in self._complete_samples(rendition).items():
+            if w not in source_samples:
+                continue
+            source_frame = source_samples[w][0]
+            frame = min(candidates, key=lambda f: abs(f.timestamp - source_frame.timestamp))
+            if abs(frame.timestamp - source_frame.timestamp) < max_diff:
+                pairs[w] = (source_frame, frame)
+        return pairs
+
+    @property
+    def sample_count(self) -> int:
+        """
+        Number of complete samples matched in every rendition
+        """
+        source_samples = self._complete_samples(self.videos[0])
+        return min([len(self._match(source_samples, video)) for video in self.videos[1:]] or [0])
+
+    def _compare(self, pair, next_pair):
+        rendition_frame, reference_frame = pair[1], pair[0]
+        next_rendition_frame, next_reference_frame = next_pair[1], next_pair[0]
+        planes = None
+        if self.luminance_plane == 'y':
+            planes = (rendition_frame.luma, next_rendition_frame.luma, reference_frame.luma, next_reference_frame.luma)
+        hd_frames = [None, None]
+        if self.make_hd_list:
+            hd_frames = [f.frame_hd if f.frame_hd is not None else f.frame for f in [rendition_frame, reference_frame]]
+        return self.video_metrics.compute_metrics(rendition_frame.frame,
+                                                  next_rendition_frame.frame,
+                                                  reference_frame.frame,
+                                                  next_reference_frame.frame,
+                                                  *hd_frames,
+                                                  planes=planes)
+
+    def process(self):
+        """
+        Aggregates metrics of samples collected so far
+        @return: same as VideoAssetProcessor.process(), or None if there are less than two matched samples for some rendition
+        """
+        source_samples = self._complete_samples(self.videos[0])
+        source_pairs = {w: (frames[0], frames[0]) for w, frames in source_samples.items()}
+        self.metrics = {}
+        for video, pairs in [(self.videos[0], source_pairs)] + [(video, self._match(source_samples, video)) for video in self.videos[1:]]:
+            windows = sorted(pairs)
+            if len(windows) < 2:
+                return None
+            dimensions = '{}:{}'.format(int(video.capture.height), int(video.capture.width))
+            pixels = video.capture.width * video.capture.height * len(windows)
+            video_metrics = {}
+            for i in range(len(windows) - 1):
+                key = (video.path, windows[i], windows[i + 1])
+                if key not in self.pair_metrics:
+                    self.pair_metrics[key] = self._compare(pairs[windows[i]], pairs[windows[i + 1]])
+                frame_metrics = dict(self.pair_metrics[key])
+                frame_metrics['dimensions'] = dimensions
+                frame_metrics['pixels'] = pixels
+                frame_metrics['ID'] = self.original_path
+                video_metrics[f'{i}'] = frame_metrics
+            self.metrics[video.path] = video_metrics
+        # drop metrics of evicted samples
+        self.pair_metrics = {k: v for k, v in self.pair_metrics.items() if self.schedule.is_retained(k[1]) and self.schedule.is_retained(k[2])}
+        return self.aggregate(self.metrics)
+
+    def release(self):
+        """
+        Stops readers and releases decoders
+        @return:
+        """
+        self.stopping = True
+        for video in self.videos:
+            video.capture.stop()
+        for video in self.videos:
+            if video.thread is not None:
+                video.thread.join()
+            video.capture.release()
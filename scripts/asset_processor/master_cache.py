@@ -0,0 +1,85 @@
+"""
+In-process cache of source video samples and metrics, shared by verifications of the same source
+"""
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+from .frame_index import FrameIndex
+
+logger = logging.getLogger()
+
+
+class MasterSampleCache:
+    """
+    LRU cache of decoded source samples, their timestamps and source-vs-source metrics, bounded by total size of cached arrays.
+    Entries are keyed by source content, sample plan (number of samples, decoding options) and set of metrics,
+    so that repeated verifications of the same source against different renditions only decode renditions.
+    Cached arrays are read-only and shared between VideoAssetProcessor instances.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+
+        @param max_bytes: max total size of cached arrays
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(path, sample_plan: tuple, metrics_list) -> tuple:
+        """
+        Builds cache key
+        @param path: source video path
+        @param sample_plan: hashable description of how samples are taken
+        @param metrics_list:
+        @return:
+        """
+        return FrameIndex.content_key(path), sample_plan, tuple(sorted(set(metrics_list)))
+
+    @staticmethod
+    def _size(entry: dict) -> int:
+        return sum(v.nbytes for v in entry.values() if isinstance(v, np.ndarray))
+
+    def get(self, key):
+        """
+        Returns cached entry, marking it as recently used
+        @param key:
+        @return: dict of cached values or None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry: dict):
+        """
+        Stores entry, evicting least recently used entries to fit into the size limit. Entries larger than the limit are not stored.
+        @param key:
+        @param entry: dict of values, numpy arrays among them are made read-only
+        @return:
+        """
+        size = self._size(entry)
+        if size > self.max_bytes:
+            logger.info(f'Source samples of {size} bytes exceed cache size of {self.max_bytes} bytes')
+            return
+        for value in entry.values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self._size(self.entries.pop(key))
+            while self.entries and self.bytes + size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= self._size(evicted)
+            self.entries[key] = entry
+            self.bytes += size
+        logger.info(f'Cached {size} bytes of source samples, cache size is {self.bytes} bytes in {len(self.entries)} entries')
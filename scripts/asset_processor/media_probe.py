@@ -0,0 +1,212 @@
+"""
+Container and stream metadata of media files, read once per file
+"""
+import os
+import json
+import subprocess
+import logging
+from fractions import Fraction
+from .frame_index import FrameIndex, parse_compact_line
+from .container_parser import ContainerParser, guess_frame_rate
+
+logger = logging.getLogger()
+
+
+class MediaProbe:
+    """
+    Metadata of a media file: video stream properties, container duration and size, and list of streams.
+    Values are read with a single ffprobe call and follow OpenCV conventions, e.g. frame count is estimated from duration when the container
+    doesn't store it. Pre-verification may instead ask for values parsed from MP4 or MPEG-TS headers in pure Python (headers=True). Those are
+    only good for rejecting renditions early: readers take decode geometry from ffprobe, and replace header probes they find in the dict.
+    Probes are memoized in a dict passed around for the time of a request and, optionally, persisted as JSON sidecars keyed by file content.
+    """
+    # directory for probe sidecar files, None disables persistence
+    CACHE_DIR = None
+    FIELDS = ['filename', 'fps', 'frame_count', 'width', 'height', 'duration', 'size', 'bit_rate', 'start_time', 'streams']
+
+    def __init__(self, filename: str, fps: float, frame_count: int, width: int, height: int, duration: float, size: int, bit_rate: int = 0,
+                 start_time: float = 0.0, streams: list = None, headers: bool = False):
+        """
+
+        @param filename:
+        @param fps: video frame rate
+        @param frame_count: number of video frames
+        @param width: video width
+        @param height: video height
+        @param duration: container duration, seconds
+        @param size: file size, bytes
+        @param bit_rate: container bit rate, bits per second, 0 if unknown
+        @param start_time: container start time, seconds
+        @param streams: list of dicts with 'index', 'codec_type' and 'codec_name' of each stream
+        @param headers: True if values were parsed from container headers instead of ffprobe
+        """
+        self.filename = filename
+        self.fps = fps
+        self.frame_count = frame_count
+        self.width = width
+        self.height = height
+        self.duration = duration
+        self.size = size
+        self.bit_rate = bit_rate
+        self.start_time = start_time
+        self.streams = streams or []
+        self.headers = headers
+
+    @property
+    def has_audio(self) -> bool:
+        return any(s['codec_type'] == 'audio' for s in self.streams)
+
+    @property
+    def has_video(self) -> bool:
+        return any(s['codec_type'] == 'video' for s in self.streams)
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def get(cls, filename: str, probes: dict = None, headers: bool = False):
+        """
+        Returns probe of the file, memoized in probes dict
+        @param filename:
+        @param probes: dict of already probed files, keyed by absolute path
+        @param headers: accept values parsed from container headers, see read()
+        @return: MediaProbe instance
+        """
+        if probes is None:
+            return cls.load(filename, headers=headers)
+        key = cls.key(filename)
+        probe = probes.get(key)
+        if probe is None or (probe.headers and not headers):
+            probe = cls.load(filename, headers=headers)
+            probes[key] = probe
+        return probe
+
+    @staticmethod
+    def key(filename: str) -> str:
+        """
+        Returns key of the file in dict of probes
+        @param filename: local path or URL
+        @return:
+        """
+        return filename if filename.lower().startswith('http') else os.path.abspath(filename)
+
+    @classmethod
+    def load(cls, filename: str, cache_dir: str = None, headers: bool = False):
+        """
+        Returns probe of the file, reading it from sidecar file if the same content was probed before
+        @param filename:
+        @param cache_dir: sidecar directory, defaults to MediaProbe.CACHE_DIR
+        @param headers: accept values parsed from container headers, see read()
+        @return: MediaProbe instance
+        """
+        cache_dir = cache_dir or cls.CACHE_DIR
+        if not cache_dir or filename.lower().startswith('http'):
+            return cls.read(filename, headers)
+        sidecar = os.path.join(cache_dir, f'{FrameIndex.content_key(filename)}{".headers" if headers else ""}.probe.json')
+        try:
+            if os.path.exists(sidecar):
+                with open(sidecar) as f:
+                    values = json.load(f)
+                values['filename'] = filename
+                return cls(**values)
+        except Exception:
+            logger.exception(f'Unable to read media probe sidecar {sidecar}, probing again')
+        probe = cls.read(filename, headers)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_name = f'{sidecar}.{os.getpid()}.tmp'
+            with open(tmp_name, 'w') as f:
+                json.dump(dict(probe.to_dict(), headers=probe.headers), f)
+            os.replace(tmp_name, sidecar)
+        except Exception:
+            logger.exception(f'Unable to write media probe sidecar {sidecar}')
+        return probe
+
+    @classmethod
+    def read(cls, filename: str, headers: bool = False):
+        """
+        Reads metadata with ffprobe or, if headers is set, from container headers, falling back to ffprobe if the format is not supported by ContainerParser.
+        Header values are neither decoded nor cross-checked, so they are meant for pre-verification only.
+        @param filename: local path or URL
+        @param headers: parse container headers without ffprobe
+        @return: MediaProbe instance
+        """
+        if headers:
+            fields = ContainerParser.parse_file(filename)
+            if fields is not None:
+                return cls(**fields, headers=True)
+        return cls.probe(filename)
+
+    @classmethod
+    def probe(cls, filename: str):
+        """
+        Reads metadata with ffprobe
+        @param filename:
+        @return: MediaProbe instance
+        """
+        ffprobe_cmd = ['ffprobe', '-v', 'error',
+                       '-show_entries', 'format=start_time,duration,size,bit_rate:stream=index,codec_type,codec_name,width,height,r_frame_rate,avg_frame_rate,nb_frames,duration',
+                       '-of', 'compact', filename]
+        ffprobe = subprocess.Popen(ffprobe_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = ffprobe.communicate()
+        if ffprobe.returncode:
+            raise Exception(f'Unable to probe media file {filename}: {stderr.decode("ascii", "ignore")}')
+        return cls._parse_compact(filename, stdout.decode('ascii', 'ignore').splitlines())
+
+    @staticmethod
+    def _number(values: dict, key: str, default=0.0, parse=float):
+        value = values.get(key, 'N/A')
+        try:
+            return parse(value)
+        except (ValueError, ZeroDivisionError):
+            return default
+
+    @classmethod
+    def _parse_compact(cls, filename, lines):
+        streams = []
+        video = None
+        container = {}
+        for line in lines:
+            section, values = parse_compact_line(line)
+            if section == 'stream':
+                streams.append({'index': int(cls._number(values, 'index', -1)),
+                                'codec_type': values.get('codec_type', 'unknown'),
+                                'codec_name': values.get('codec_name', 'unknown')})
+                if video is None and values.get('codec_type') == 'video':
+                    video = values
+            elif section == 'format':
+                container = values
+        if video is None:
+            raise Exception(f'No video stream in {filename}')
+        fps = cls._frame_rate(video)
+        duration = cls._number(container, 'duration')
+        if duration <= 0:
+            duration = cls._number(video, 'duration')
+        frame_count = int(cls._number(video, 'nb_frames', 0, int))
+        if frame_count <= 0:
+            frame_count = int(duration * fps + 0.5)
+        return cls(filename, fps, frame_count, int(cls._number(video, 'width', 0, int)), int(cls._number(video, 'height', 0, int)), duration,
+                   int(cls._number(container, 'size', 0, int)) or cls._file_size(filename), int(cls._number(container, 'bit_rate', 0, int)),
+                   cls._number(container, 'start_time'), streams)
+
+    @staticmethod
+    def _file_size(filename: str) -> int:
+        return 0 if filename.lower().startswith('http') else os.path.getsize(filename)
+
+    @classmethod
+    def _frame_rate(cls, video: dict) -> float:
+        r_frame_rate = cls._number(video, 'r_frame_rate', 0.0, lambda v: float(Fraction(v)))
+        avg_frame_rate = cls._number(video, 'avg_frame_rate', 0.0, lambda v: float(Fraction(v)))
+        return guess_frame_rate(r_frame_rate, avg_frame_rate)
+
+    def video_metadata(self) -> dict:
+        """
+        Video properties checked by pre-verification
+        @return: dict of frame_rate, resolution, pixels, duration and bitrate
+        """
+        duration = self.frame_count / self.fps
+        return {'frame_rate': self.fps,
+                'resolution': {'width': float(self.width), 'height': float(self.height)},
+                'pixels': float(self.width * self.height * self.frame_count),
+                'duration': duration,
+                'bitrate': self.size / duration}
@@ -0,0 +1,273 @@
+"""
+Execution of pairwise metrics in threads or processes
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import timeit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from .frame_ring import shared_memory
+from .video_metrics import VideoMetrics
+
+logger = logging.getLogger()
+
+
+class SharedFrames:
+    """
+    Named frame stacks copied to a single shared memory block. Objects are pickled by block name and layout,
+    so that worker processes read frames in place, without serializing them.
+    """
+
+    def __init__(self, arrays: dict = None, name: str = None, layout: list = None):
+        """
+
+        @param arrays: dict of numpy arrays to copy to a new block, None values are skipped
+        @param name: name of existing block to attach to
+        @param layout: list of (key, shape, dtype, offset) of arrays in the existing block
+        """
+        if shared_memory is None:
+            raise Exception('Shared memory frame transport requires Python 3.8 or newer')
+        self.owner = name is None
+        if self.owner:
+            arrays = {key: np.ascontiguousarray(value) for key, value in arrays.items() if value is not None}
+            layout = []
+            offset = 0
+            for key, value in arrays.items():
+                layout.append((key, value.shape, value.dtype.str, offset))
+                offset += value.nbytes
+            self.shm = shared_memory.SharedMemory(create=True, size=max(1, offset))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.layout = layout
+        self.arrays = {key: np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset) for key, shape, dtype, offset in layout}
+        if self.owner:
+            for key, value in arrays.items():
+                self.arrays[key][...] = value
+
+    def __getstate__(self):
+        return {'name': self.shm.name, 'layout': self.layout}
+
+    def __setstate__(self, state):
+        self.__init__(name=state['name'], layout=state['layout'])
+
+    def get(self, key):
+        return self.arrays.get(key)
+
+    def close(self):
+        """
+        Detaches from shared memory, and frees it if this object is the owner
+        @return:
+        """
+        self.arrays = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class MetricExecutor:
+    """
+    Long-lived pools metrics are computed in, shared by all verifications of a process.
+    Threads suit metrics whose work is done in OpenCV or NumPy calls releasing the GIL. Metrics whose function or features
+    hold the GIL (see Metric.gil and Feature.gil) don't scale with threads, so they may run in processes reading frames from shared memory,
+    provided their estimated cost is large enough to pay for copying frames and starting tasks.
+    Thread jobs go through a bounded queue: submitting blocks while the queue is full, so that concurrent requests don't pile up work,
+    and queue depth and utilization counters tell how loaded the pool is.
+    """
+    MODES = ['threads', 'processes', 'auto']
+    # min estimated time of GIL-bound work of a rendition worth sending to processes, ms
+    PROCESS_MIN_COST = 100.0
+    # process-wide executor, see default()
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, mode: str = 'threads', max_workers: int = None, threads: int = None, max_queue: int = 0):
+        """
+
+        @param mode: 'threads' or 'processes' to compute all metrics in threads or processes,
+                     'auto' to compute GIL-bound metrics in processes if it pays off, see split()
+        @param max_workers: number of worker processes, CPUs per server process by default, see cpu_share()
+        @param threads: number of threads, CPUs per server process by default, see cpu_share()
+        @param max_queue: max number of thread jobs waiting for a thread, 0 means no limit
+        """
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown metric executor mode {mode}')
+        if mode != 'threads' and shared_memory is None:
+            logger.warning('Metric computation in processes requires Python 3.8 or newer, using threads')
+            mode = 'threads'
+        self.mode = mode
+        self.max_workers = max_workers or self.cpu_share()
+        self.executor = None
+        self.threads = threads or self.cpu_share()
+        self.max_queue = max_queue
+        self.thread_executor = None
+        self.slots = threading.BoundedSemaphore(self.threads + max_queue) if max_queue else None
+        self.lock = threading.Lock()
+        self.start_time = timeit.default_timer()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.busy_time = 0.0
+        self.process_jobs = 0
+
+    @staticmethod
+    def cpu_share() -> int:
+        """
+        Number of CPUs of the host divided among server processes, so that pools of all of them together don't oversubscribe it.
+        Number of processes is read from WEB_CONCURRENCY environment variable, which gunicorn also takes its number of workers from.
+        @return: at least 1
+        """
+        try:
+            processes = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+        except ValueError:
+            processes = 1
+        return max(1, multiprocessing.cpu_count() // processes)
+
+    @classmethod
+    def default(cls):
+        """
+        Returns process-wide executor, created on first use with default settings unless set by set_default()
+        @return:
+        """
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    @classmethod
+    def set_default(cls, executor):
+        """
+        Replaces process-wide executor, shutting down the previous one
+        @param executor: MetricExecutor
+        @return:
+        """
+        with cls._default_lock:
+            previous, cls._default = cls._default, executor
+        if previous is not None and previous is not executor:
+            previous.shutdown()
+
+    def split(self, metrics_list, pairs: int, backends=()) -> tuple:
+        """
+        Splits metrics to those computed in threads and those computed in processes
+        @param metrics_list: metric names
+        @param pairs: number of frame pairs to compute metrics for
+        @param backends: names of VideoMetrics.BACKENDS metrics are computed with
+        @return: (thread metrics, process metrics)
+        """
+        if self.mode == 'threads':
+            return list(metrics_list), []
+        plan = VideoMetrics.plan(metrics_list, backends)
+        if self.mode == 'processes':
+            return [], list(plan.metrics)
+        process_metrics = [name for name in plan.metrics if self.holds_gil(name, backends)]
+        gil_cost = VideoMetrics.plan(process_metrics, backends).cost * pairs
+        if self.max_workers < 2 or gil_cost < self.PROCESS_MIN_COST:
+            process_metrics = []
+        thread_metrics = [name for name in metrics_list if name not in process_metrics]
+        return thread_metrics, process_metrics
+
+    @staticmethod
+    def holds_gil(metric_name, backends=()) -> bool:
+        """
+        Tells whether computing a metric, including its features, mostly holds the GIL
+        @param metric_name:
+        @param backends: names of VideoMetrics.BACKENDS the metric is computed with
+        @return:
+        """
+        plan = VideoMetrics.plan([metric_name], backends)
+        _, features = VideoMetrics.declarations(backends)
+        return any(metric.gil for metric in plan.metrics.values()) or any(features[feature].gil for _, feature in plan.features)
+
+    def submit_thread(self, fn, *args):
+        """
+        Schedules a job in the thread pool, waiting for room in the queue if it is bounded
+        @param fn: function
+        @param args: function arguments
+        @return: Future
+        """
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            with self.lock:
+                if self.thread_executor is None:
+                    self.thread_executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='metrics')
+                    logger.info(f'Started {self.threads} metric threads')
+                self.queued += 1
+                return self.thread_executor.submit(self._run, fn, args)
+        except Exception:
+            if self.slots is not None:
+                self.slots.release()
+            raise
+
+    def _run(self, fn, args):
+        start = timeit.default_timer()
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                self.busy_time += timeit.default_timer() - start
+            if self.slots is not None:
+                self.slots.release()
+
+    def submit_process(self, fn, *args):
+        """
+        Schedules a job in the process pool, starting the pool on first use
+        @param fn: picklable function
+        @param args: picklable arguments
+        @return: Future
+        """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                logger.info(f'Started {self.max_workers} metric worker processes')
+            self.process_jobs += 1
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self._process_job_done)
+        return future
+
+    def _process_job_done(self, future):
+        with self.lock:
+            self.process_jobs -= 1
+
+    def stats(self) -> dict:
+        """
+        Load counters
+        @return: dict of number of threads, thread jobs waiting in the queue and running, completed thread jobs,
+                 thread utilization since the executor was created, and process jobs not completed yet
+        """
+        with self.lock:
+            elapsed = timeit.default_timer() - self.start_time
+            busy_time = self.busy_time
+            return {'threads': self.threads,
+                    'queued': self.queued,
+                    'running': self.running,
+                    'completed': self.completed,
+                    'utilization': busy_time / (elapsed * self.threads) if elapsed > 0 else 0.0,
+                    'process_jobs': self.process_jobs}
+
+    def chunks(self, count: int) -> list:
+        """
+        Splits range of pair indexes into contiguous chunks, one per worker, so that features of consecutive frames are reused within a chunk
+        @param count: number of pairs
+        @return: list of lists of indexes
+        """
+        return [chunk.tolist() for chunk in np.array_split(np.arange(count), min(count, self.max_workers)) if len(chunk)]
+
+    def shutdown(self):
+        """
+        Waits for submitted jobs and stops pools. Pools are started again on the next submission.
+        @return:
+        """
+        with self.lock:
+            executor, self.executor = self.executor, None
+            thread_executor, self.thread_executor = self.thread_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if thread_executor is not None:
+            thread_executor.shutdown(wait=True)
@@ -0,0 +1,96 @@
+"""
+Declarations of pairwise metrics and frame features they depend on, and execution plans built from them
+"""
+from collections import OrderedDict
+
+# frames of a comparison metrics take their inputs from
+FRAMES = ['rendition', 'next_rendition', 'reference', 'next_reference', 'rendition_hd', 'reference_hd']
+
+
+class Feature:
+    """
+    Declaration of a unary frame feature: function computing it from another feature of the same frame and estimated cost
+    """
+
+    def __init__(self, function, source: str = 'plane', cost: float = 0.0, gil: bool = False):
+        """
+
+        @param function: name of VideoMetrics method, or a function, taking the source feature
+        @param source: feature the function is applied to, 'frame' for the decoded frame itself
+        @param cost: estimated time to compute the feature of a sample frame, ms
+        @param gil: the function holds the GIL for most of its time, so it doesn't run in parallel threads
+        """
+        self.function = function
+        self.source = source
+        self.cost = cost
+        self.gil = gil
+
+
+class Metric:
+    """
+    Declaration of a pairwise metric: function computing it, frame features passed to it and estimated cost
+    """
+
+    def __init__(self, function, inputs: dict, cost: float = 0.0, params: dict = None, gil: bool = False):
+        """
+
+        @param function: name of VideoMetrics method, or a function, computing the metric. None if the metric is the value of its only input.
+        @param inputs: dict of keyword arguments of the function to (frame, feature) tuples, frame being one of FRAMES
+                       and feature one of VideoMetrics.FEATURES or 'frame' for the decoded frame itself
+        @param cost: estimated time to compute the metric of a pair of sample frames once its inputs are ready, ms
+        @param params: constant keyword arguments of the function
+        @param gil: the function holds the GIL for most of its time, so it doesn't run in parallel threads
+        """
+        self.function = function
+        self.inputs = inputs
+        self.cost = cost
+        self.params = params or {}
+        self.gil = gil
+
+
+class MetricPlan:
+    """
+    Execution plan of a list of metrics: metrics to compute, without duplicates,
+    and frame features they need, in dependency order, each listed once
+    """
+
+    def __init__(self, metrics: OrderedDict, features: list, cost: float):
+        """
+
+        @param metrics: dict of metric name to Metric
+        @param features: list of (frame, feature) tuples, features are listed after features they are computed from
+        @param cost: estimated time to compute all features and metrics of a sample pair, ms
+        """
+        self.metrics = metrics
+        self.features = features
+        self.cost = cost
+
+    @classmethod
+    def build(cls, metrics_list, metrics: dict, features: dict):
+        """
+        Selects declared metrics of the list and resolves features they depend on
+        @param metrics_list: names of metrics, unknown names (computed elsewhere, e.g. audio metrics) are ignored
+        @param metrics: dict of metric name to Metric
+        @param features: dict of feature name to Feature
+        @return: MetricPlan
+        """
+        selected = OrderedDict((name, metrics[name]) for name in metrics_list if name in metrics)
+        required = []
+
+        def require(frame, feature, path=()):
+            if feature == 'frame' or (frame, feature) in required:
+                return
+            if feature in path:
+                raise ValueError(f'Circular dependency of frame feature {feature}')
+            require(frame, features[feature].source, path + (feature,))
+            required.append((frame, feature))
+
+        for metric in selected.values():
+            for frame, feature in metric.inputs.values():
+                require(frame, feature)
+        cost = sum(metric.cost for metric in selected.values()) + sum(features[feature].cost for _, feature in required)
+        return cls(selected, required, cost)
+
+    def __repr__(self):
+        features = ', '.join(f'{frame}.{feature}' for frame, feature in self.features)
+        return f'MetricPlan(metrics=[{", ".join(self.metrics)}], features=[{features}], cost={self.cost:.1f}ms)'
@@ -0,0 +1,150 @@
+"""
+Streaming source of frame presentation timestamps for readers that decode with an external ffmpeg process
+"""
+import heapq
+import subprocess
+import threading
+import logging
+import numpy as np
+from .frame_index import parse_compact_line
+
+logger = logging.getLogger()
+
+
+class PacketTimestamps:
+    """
+    Presentation timestamps of video frames, read from a demux-only ffprobe pass running alongside the decoder.
+    Packets arrive in decoding order, while frames leave the decoder in presentation order. Since pts of a packet is never less than its dts
+    and dts only grows, a pending pts that is not greater than the last seen dts can't be preceded by any later packet, so timestamps are
+    released in presentation order as soon as they are final, with a heap, and appended to a typed array.
+    Readers block on a condition variable until the timestamp of the frame they hold is released.
+    """
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, filename: str):
+        """
+
+        @param filename: video file
+        """
+        self.filename = filename
+        # container start time, subtracted from packet timestamps
+        self.start_time = None
+        self.values = np.empty(self.INITIAL_CAPACITY, dtype=np.float64)
+        self.count = 0
+        self.finished = False
+        self.error = None
+        self.pending = []
+        self.condition = threading.Condition()
+        self.process = None
+        self.thread = None
+        self.stopping = False
+
+    def start(self):
+        """
+        Starts ffprobe and the thread reading its output
+        @return:
+        """
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _probe(self, entries: str) -> subprocess.Popen:
+        ffprobe_cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', entries, '-of', 'compact', self.filename]
+        return subprocess.Popen(ffprobe_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def _run(self):
+        # ffprobe prints format section after all packets, so start time is read by a separate header-only call
+        try:
+            stdout, _ = self._probe('format=start_time').communicate()
+            start_time = 0.0
+            for line in stdout.decode('ascii', 'ignore').splitlines():
+                section, values = parse_compact_line(line)
+                if section == 'format' and values.get('start_time', 'N/A') != 'N/A':
+                    start_time = float(values['start_time'])
+            self.start_time = start_time
+            logger.info(f'Video start offset is: {start_time}')
+            self.process = self._probe('packet=pts_time,dts_time')
+            if self.stopping:
+                self.process.terminate()
+            for line in self.process.stdout:
+                section, values = parse_compact_line(line.decode('ascii', 'ignore'))
+                if section == 'packet':
+                    self.feed(values.get('pts_time', 'N/A'), values.get('dts_time', 'N/A'))
+            if self.process.wait() and not self.stopping:
+                raise Exception(f'Unable to read timestamps of {self.filename}')
+        except Exception as e:
+            if not self.stopping:
+                logger.exception(f'Unable to read timestamps of {self.filename}')
+                self.error = e
+        finally:
+            self.finish()
+
+    def feed(self, pts_time: str, dts_time: str):
+        """
+        Adds a packet, in decoding order, and releases timestamps that became final
+        @param pts_time: packet pts in seconds, as printed by ffprobe
+        @param dts_time: packet dts in seconds, as printed by ffprobe
+        @return:
+        """
+        if pts_time == 'N/A':
+            # some containers don't store pts for every packet, dts is a good enough estimate then
+            pts_time = dts_time
+        if pts_time == 'N/A':
+            return
+        heapq.heappush(self.pending, float(pts_time))
+        if dts_time != 'N/A':
+            self._release(float(dts_time))
+
+    def finish(self):
+        """
+        Releases remaining timestamps after the last packet
+        @return:
+        """
+        self._release(np.inf)
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+
+    def _release(self, dts: float):
+        released = []
+        while self.pending and self.pending[0] <= dts:
+            released.append(heapq.heappop(self.pending))
+        if not released:
+            return
+        released = np.array(released) - (self.start_time or 0.0)
+        if np.any(released < 0):
+            logger.warning('Unknown behavior: pkt_pts_time is expected to be greater than stream start offset')
+            released = np.maximum(released, 0)
+        with self.condition:
+            if self.count + len(released) > len(self.values):
+                values = np.empty(max(2 * len(self.values), self.count + len(released)), dtype=np.float64)
+                values[:self.count] = self.values[:self.count]
+                self.values = values
+            self.values[self.count:self.count + len(released)] = released
+            self.count += len(released)
+            self.condition.notify_all()
+
+    def __len__(self):
+        return self.count
+
+    def get(self, frame_idx: int) -> float:
+        """
+        Returns timestamp of a frame, waiting for it to be released
+        @param frame_idx: frame index in presentation order
+        @return: timestamp in seconds, relative to container start
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.count > frame_idx or self.finished)
+            if self.count <= frame_idx:
+                raise Exception(f'Error reading video timestamps: {self.error or "no timestamp for frame " + str(frame_idx)}')
+            return float(self.values[frame_idx])
+
+    def stop(self):
+        """
+        Terminates ffprobe and waits for the reader thread
+        @return:
+        """
+        self.stopping = True
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+        if self.thread is not None:
+            self.thread.join()
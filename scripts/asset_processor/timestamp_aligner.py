@@ -0,0 +1,79 @@
+"""
+Matching of video frames to master samples by presentation timestamps
+"""
+import numpy as np
+
+
+def nearest(sorted_values: np.ndarray, queries):
+    """
+    Finds elements of sorted array closest to each of the queries. Ties are resolved in favour of the lower index.
+    @param sorted_values: ascending array
+    @param queries: scalar or array of values to look up
+    @return: Tuple[array of indexes into sorted_values, array of absolute differences]
+    """
+    queries = np.asarray(queries, dtype=np.float64)
+    right = np.clip(np.searchsorted(sorted_values, queries), 0, len(sorted_values) - 1)
+    left = np.clip(right - 1, 0, len(sorted_values) - 1)
+    use_left = np.abs(queries - sorted_values[left]) <= np.abs(queries - sorted_values[right])
+    indexes = np.where(use_left, left, right)
+    return indexes, np.abs(queries - sorted_values[indexes])
+
+
+class TimestampAligner:
+    """
+    Matches frame timestamps of a video to master sample timestamps. A frame is a candidate for the closest master sample,
+    provided it is within the sample tolerance window. Of all candidates of a sample, the closest one wins, the earliest one on ties.
+    Samples are kept sorted, so lookups are logarithmic in the number of samples instead of scanning all of them for every frame.
+    """
+
+    def __init__(self, timestamps, tolerance):
+        """
+
+        @param timestamps: master sample timestamps, in any order
+        @param tolerance: max timestamp difference of a matching frame, either scalar or one value per sample
+        """
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.tolerance = np.broadcast_to(np.asarray(tolerance, dtype=np.float64), self.timestamps.shape)
+        self.order = np.argsort(self.timestamps, kind='stable')
+        self.sorted_timestamps = self.timestamps[self.order]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def match(self, timestamps):
+        """
+        Finds master sample each of the frames is a candidate for
+        @param timestamps: frame timestamps
+        @return: Tuple[array of sample indexes, -1 where frame is out of tolerance window of the closest sample, array of absolute timestamp differences]
+        """
+        positions, diffs = nearest(self.sorted_timestamps, timestamps)
+        samples = self.order[positions]
+        return np.where(diffs < self.tolerance[samples], samples, -1), diffs
+
+    def match_one(self, timestamp: float):
+        """
+        Scalar version of match(), for frames coming one by one from decoder
+        @param timestamp:
+        @return: Tuple[sample index or -1, absolute timestamp difference]
+        """
+        samples, diffs = self.match(timestamp)
+        return int(samples), float(diffs)
+
+    def align(self, pts):
+        """
+        Computes the whole sample to frame mapping at once, from timestamps of all frames, e.g. taken from a packet index.
+        Gives the same result as feeding frames to match_one() in decoding order and keeping the best candidate of each sample.
+        @param pts: frame timestamps in decoding order
+        @return: Tuple[array of frame indexes for each sample, -1 if no frame is within tolerance window, array of timestamp differences, inf if not matched]
+        """
+        samples, diffs = self.match(pts)
+        frames = np.full(len(self), -1, dtype=np.int64)
+        sample_diffs = np.full(len(self), np.inf)
+        matched = np.flatnonzero(samples >= 0)
+        if len(matched):
+            # order candidates by sample, then by difference, then by position, so that the first candidate of each sample is the winner
+            ranked = matched[np.lexsort((matched, diffs[matched], samples[matched]))]
+            winners = ranked[np.r_[True, samples[ranked][1:] != samples[ranked][:-1]]]
+            frames[samples[winners]] = winners
+            sample_diffs[samples[winners]] = diffs[winners]
+        return frames, sample_diffs
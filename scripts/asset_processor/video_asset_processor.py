@@ -5,9 +5,8 @@ Module for management and parallelization of verification jobs.
 import os
 import shutil
 import timeit
-from concurrent.futures.thread import ThreadPoolExecutor
 from collections import deque
-import multiprocessing
+import threading
 from random import seed
 from random import random
 
@@ -19,6 +18,13 @@ import math
 from scipy.spatial import distance
 from .video_metrics import VideoMetrics
 from .video_capture import VideoCapture
+from .timestamp_aligner import TimestampAligner
+from .decode_scheduler import DecodeScheduler
+from .frame_ring import FrameRing, shared_memory
+from .master_cache import MasterSampleCache
+from .media_probe import MediaProbe
+from .frame_features import FrameFeatures, FrameFeatureCache
+from .metric_executor import MetricExecutor, SharedFrames
 
 logger = logging.getLogger()
 
@@ -29,9 +35,16 @@ class VideoAssetProcessor:
     It is instantiated as part of the data creation as well
     as in the inference, both in the CLI as in the notebooks.
     """
+    # (width, height) of frames most metrics are computed on
+    FRAME_SIZE = (480, 270)
+    # metrics that need all color channels, the rest are computed on a luminance plane
+    COLOR_METRICS = ['temporal_histogram_distance', 'temporal_brisque', 'hash_euclidean', 'hash_hamming', 'hash_cosine']
 
     def __init__(self, original, renditions, metrics_list,
-                 do_profiling=False, max_samples=-1, features_list=None, debug_frames=False, use_gpu=False, channel=-1, image_pair_callback=None):
+                 do_profiling=False, max_samples=-1, features_list=None, debug_frames=False, use_gpu=False, channel=-1, image_pair_callback=None,
+                 sparse_decoding=False, video_reader='opencv', luminance_plane='hsv_v', decode_workers=1, decode_processes=False,
+                 master_cache: MasterSampleCache = None, frame_memory_budget=0, probes: dict = None, batch_metrics=False,
+                 metric_executor: MetricExecutor = None, metric_backends: list = None, qoe_luma=False, qoe_scale=1):
         """
 
         @param use_gpu:
@@ -44,6 +57,29 @@ class VideoAssetProcessor:
         @param debug_frames: dump frames selected for metric extraction on disk, decreases performance
         @param channel: which HSV channel (0-3) to use for metric computation, -1 = all
         @param image_pair_callback: function to call when image pair is created
+        @param sparse_decoding: seek to the keyframe preceding each sample instead of decoding whole videos. Decoding cost then depends on the number of samples rather than video length.
+        @param video_reader: VideoCapture backend used to decode source and renditions
+        @param luminance_plane: plane single channel metrics are computed on. 'hsv_v' - V channel of HSV-converted BGR frames, which is what the models were trained on,
+                                'y' - luminance plane taken from decoder output, skips BGR and HSV conversions for frames color metrics don't need.
+                                'y' is experimental and not supported with the shipped models: on color footage its metrics differ widely from hsv_v ones,
+                                and unlike V=max(B,G,R), Y mostly ignores saturation changes, hiding color tampering.
+        @param decode_workers: max number of renditions decoded concurrently. With sparse decoding renditions are also decoded concurrently with the source. 1 = decode sequentially
+        @param decode_processes: decode in a process pool instead of threads. Not supported with image_pair_callback, which needs source frames.
+                                 Sample frames are passed from decoding processes through shared memory, if available
+        @param master_cache: cache to reuse source samples and metrics from, if the same source was processed before with the same settings
+        @param frame_memory_budget: bytes of full resolution samples QoE metrics may keep, 0 = unlimited. Rendition samples are never kept at higher resolution than the source,
+                                    since metrics downscale frame pairs to the smaller of the two anyway. If source samples don't fit the budget,
+                                    they are downscaled to the largest rendition resolution, which slightly changes QoE metrics of smaller renditions.
+        @param probes: dict of MediaProbe objects of already probed files, see MediaProbe.get(). Files probed here are added to it.
+        @param batch_metrics: compute metrics having batch kernels for all samples of a video at once, see VideoMetrics.compute_metrics_batch(),
+                              the rest of metrics are computed per sample pair
+        @param metric_executor: runs metrics in its long-lived thread and process pools, see MetricExecutor. Process-wide MetricExecutor.default() by default.
+                                Processes are not used with debug_frames or do_profiling.
+        @param metric_backends: names of VideoMetrics.BACKENDS to compute metrics with instead of default implementations,
+                                e.g. 'opencv_qoe' for float32 OpenCV SSIM and PSNR, which reuse source frame statistics across renditions,
+                                'opencv_gaussian' for float32 OpenCV Gaussian filter of gaussian_* metrics
+        @param qoe_luma: 'opencv_qoe' SSIM and PSNR are computed on luma only, instead of averaging them over BGR channels
+        @param qoe_scale: 'opencv_qoe' SSIM and PSNR are computed on frame pairs downscaled by this factor
         """
         # ************************************************************************
         # Initialize global variables
@@ -53,6 +89,25 @@ class VideoAssetProcessor:
         self.channel = [channel] if channel > -1 else [0, 1, 2]
         self.debug_frames = debug_frames
         self.use_gpu = use_gpu
+        self.sparse_decoding = sparse_decoding
+        self.video_reader = video_reader
+        if luminance_plane not in ['hsv_v', 'y']:
+            raise ValueError(f'Unknown luminance plane {luminance_plane}')
+        if luminance_plane == 'y':
+            logger.warning('Luminance plane y is experimental, metrics computed on it are not comparable with those models were trained on')
+        self.luminance_plane = luminance_plane
+        self.probes = probes if probes is not None else {}
+        self.batch_metrics = batch_metrics
+        # unary features of sample frames, source ones are shared by all renditions
+        self.frame_features = FrameFeatureCache()
+        self.metric_executor = metric_executor if metric_executor is not None else MetricExecutor.default()
+        self.metric_backends = tuple(metric_backends or ())
+        self.qoe_luma = qoe_luma
+        self.qoe_scale = qoe_scale
+        # bytes of sample frames currently held, and the max of it during the request
+        self.frame_buffer_bytes = 0
+        self.peak_frame_buffer_bytes = 0
+        self.frame_buffer_lock = threading.Lock()
         # init debug dirs
         if self.debug_frames:
             self.frame_dir_name = type(self).__name__
@@ -61,7 +116,17 @@ class VideoAssetProcessor:
         if os.path.exists(original['path']):
             self.do_process = True
             self.original_path = original['path']
-            self.master_capture = VideoCapture(self.original_path, use_gpu=use_gpu)
+            # Check if HD list is necessary
+            if 'temporal_ssim' in metrics_list or 'temporal_psnr' in metrics_list:
+                self.make_hd_list = True
+            else:
+                self.make_hd_list = False
+            # Check if BGR frames are necessary
+            self.make_color_list = (self.luminance_plane == 'hsv_v' or self.make_hd_list or self.debug_frames or image_pair_callback is not None
+                                    or any(m in self.COLOR_METRICS for m in metrics_list))
+            self.master_capture = self.open_capture(self.original_path)
+            # (width, height) of the source, rendition samples are kept at most at this resolution
+            self.master_size = (self.master_capture.width, self.master_capture.height)
             # Frames Per Second of the original asset
             self.fps = self.master_capture.fps
             # Obtains number of frames of the original
@@ -85,11 +150,6 @@ class VideoAssetProcessor:
                 self.cpu_profiler = None
             self.do_profiling = do_profiling
 
-            # Check if HD list is necessary
-            if 'temporal_ssim' in self.metrics_list or 'temporal_psnr' in self.metrics_list:
-                self.make_hd_list = True
-            else:
-                self.make_hd_list = False
             # read renditions metadata like fps
             self.read_renditions_metadata()
             # Maximum number of frames to random sample
@@ -103,126 +163,553 @@ class VideoAssetProcessor:
             # Convert OpenCV video captures of original to list
             # of numpy arrays for better performance of numerical computations
             self.master_indexes = []
-            self.markup_master_frames = True
-            master_idx_map, self.master_samples, self.master_samples_hd, self.master_pixels, self.height, self.width = self.capture_to_array(self.master_capture)
-            self.master_capture.release()
-            self.markup_master_frames = False
-            # Instance of the video_metrics class
-            self.video_metrics = VideoMetrics(self.metrics_list,
-                                              self.hash_size,
-                                              int(self.height),
-                                              self.cpu_profiler,
-                                              self.do_profiling)
-            # Collects both dimensional values in a string
-            self.dimensions = '{}:{}'.format(int(self.width), int(self.height))
-            # Compute its features
-            # Disable debug output for
-            debug = self.debug_frames
-            self.debug_frames = False
-            self.metrics[self.original_path] = self.compute(master_idx_map,
-                                                            self.master_samples,
-                                                            self.master_samples_hd,
-                                                            self.original_path,
-                                                            self.dimensions,
-                                                            self.master_pixels)
-            self.debug_frames = debug
+            self.master_timestamps = []
+            if decode_processes and image_pair_callback is not None:
+                logger.warning('Image pair callback needs source frames, decoding in threads')
+                decode_processes = False
+            self.decode_scheduler = DecodeScheduler(decode_workers, decode_processes)
+            self.master_hd_size = self.plan_hd_size(frame_memory_budget) if self.make_hd_list else None
+            self.master_capture.hd_size = self.master_hd_size
+            # shared memory frame slots, for each kind of samples, and slots taken by samples of each video
+            self.frame_rings = {}
+            self.sample_slots = {}
+            try:
+                if decode_processes and self.decode_scheduler.concurrent:
+                    self.create_frame_rings()
+                self.master_cache = master_cache
+                master_cache_key = None
+                if master_cache is not None and not self.debug_frames and image_pair_callback is None:
+                    master_cache_key = master_cache.key(self.original_path, self.sample_plan, metrics_list)
+                    if self.load_master_samples(master_cache.get(master_cache_key)):
+                        self.master_capture.release()
+                        if self.decode_scheduler.concurrent:
+                            self.schedule_decoding()
+                        return
+                if self.sparse_decoding and self.decode_scheduler.concurrent and self.master_capture.can_seek and not self.debug_frames:
+                    # source samples are picked from packet index, so renditions don't have to wait for source pixels
+                    self.pick_master_samples(self.master_capture.frame_index)
+                    self.schedule_decoding()
+                master_idx_map, self.master_samples, self.master_samples_hd, self.master_samples_luma, self.master_pixels, self.height, self.width = self.capture_to_array(self.master_capture, True)
+                self.master_capture.release()
+                if master_cache_key is not None:
+                    # arrays are copied before they are possibly moved to shared memory, which is freed after processing
+                    master_cache_entry = self.master_cache_entry(master_idx_map)
+                if self.frame_rings:
+                    # source samples stay in shared memory for as long as any rendition is compared against them
+                    slots = self.acquire_sample_slots(self.original_path)
+                    self.store_shared_samples(slots, self.master_samples, self.master_samples_luma)
+                    self.track_frame_buffers(-self.buffer_bytes(self.master_samples, self.master_samples_luma))
+                    self.master_samples, self.master_samples_luma = self.load_shared_samples(slots, len(master_idx_map))
+                # Instance of the video_metrics class
+                self.video_metrics = self.create_video_metrics()
+                # Collects both dimensional values in a string
+                self.dimensions = '{}:{}'.format(int(self.width), int(self.height))
+                # Compute its features
+                # Disable debug output for
+                debug = self.debug_frames
+                self.debug_frames = False
+                self.metrics[self.original_path] = self.compute(master_idx_map,
+                                                                self.master_samples,
+                                                                self.master_samples_hd,
+                                                                self.original_path,
+                                                                self.dimensions,
+                                                                self.master_pixels,
+                                                                self.master_samples_luma)
+                self.debug_frames = debug
+                if master_cache_key is not None:
+                    master_cache_entry['metrics'] = self.metrics[self.original_path]
+                    master_cache.put(master_cache_key, master_cache_entry)
+            except BaseException:
+                # decoding jobs and shared memory must not outlive a failed request
+                self.close()
+                raise
         else:
             logger.error(f'Aborting, path does not exist: {original["path"]}')
             self.do_process = False
 
-    def capture_to_array(self, capture):
+    @property
+    def sample_plan(self) -> tuple:
+        """
+        Settings source samples and metrics depend on
+        """
+        return (self.max_samples, self.sparse_decoding, self.video_reader, self.luminance_plane, self.FRAME_SIZE,
+                self.make_hd_list, self.master_hd_size, self.make_color_list, self.metric_backends, self.qoe_luma, self.qoe_scale)
+
+    def create_video_metrics(self) -> VideoMetrics:
+        """
+        Creates VideoMetrics instance computing metrics of the request
+        @return:
+        """
+        return VideoMetrics(self.metrics_list,
+                            self.hash_size,
+                            int(self.height),
+                            self.cpu_profiler,
+                            self.do_profiling,
+                            self.metric_backends,
+                            self.qoe_luma,
+                            self.qoe_scale)
+
+    def master_cache_entry(self, master_idx_map) -> dict:
+        """
+        Copies source samples to master cache entry. Source metrics are added to the entry once computed.
+        @param master_idx_map:
+        @return:
+        """
+        return {'indexes': np.array(self.master_indexes),
+                'timestamps': np.array(self.master_timestamps),
+                'idx_map': np.array(master_idx_map),
+                'samples': np.array(self.master_samples),
+                'samples_hd': np.array(self.master_samples_hd),
+                'samples_luma': np.array(self.master_samples_luma),
+                'pixels': self.master_pixels,
+                'height': self.height,
+                'width': self.width,
+                'metrics': None}
+
+    def load_master_samples(self, entry) -> bool:
+        """
+        Restores source samples and metrics from master cache entry
+        @param entry: master cache entry or None
+        @return: True if source state was restored
+        """
+        if entry is None:
+            return False
+        self.master_indexes = entry['indexes']
+        self.master_timestamps = list(entry['timestamps'])
+        self.master_samples = entry['samples']
+        self.master_samples_hd = entry['samples_hd']
+        self.master_samples_luma = entry['samples_luma']
+        self.master_pixels = entry['pixels']
+        self.height = entry['height']
+        self.width = entry['width']
+        self.track_frame_buffers(self.buffer_bytes(self.master_samples, self.master_samples_hd, self.master_samples_luma))
+        self.metrics[self.original_path] = {k: dict(v) for k, v in entry['metrics'].items()}
+        self.video_metrics = self.create_video_metrics()
+        self.dimensions = '{}:{}'.format(int(self.width), int(self.height))
+        logger.info(f'Source samples of {self.original_path} loaded from cache')
+        return True
+
+    def open_capture(self, path, hd_size=None):
+        """
+        Opens video reader producing frames at analysis resolution.
+        Full resolution frames are kept only if QoE metrics or image pair callback need them.
+        @param path:
+        @param hd_size: max (width, height) of full resolution frames
+        @return: VideoCapture instance
+        """
+        keep_hd = self.make_hd_list or self.image_pair_callback is not None
+        return VideoCapture(path, use_gpu=self.use_gpu, video_reader=self.video_reader, frame_size=self.FRAME_SIZE, keep_hd=keep_hd,
+                            color=self.make_color_list, luma=self.luminance_plane == 'y', hd_size=hd_size, probe=self.probes.get(MediaProbe.key(path)))
+
+    def probe(self, path) -> MediaProbe:
+        """
+        Returns metadata of a video, probing it only once
+        @param path:
+        @return:
+        """
+        return MediaProbe.get(path, self.probes)
+
+    def plan_hd_size(self, frame_memory_budget):
+        """
+        Picks resolution of full resolution source samples, so that samples of the source and renditions held at the same time fit the budget
+        @param frame_memory_budget: bytes, 0 = unlimited
+        @return: max (width, height) of source samples, or None if they are kept at original resolution
+        """
+        if not frame_memory_budget:
+            return None
+
+        def hd_bytes(size, max_size):
+            return self.max_samples * min(size[0], max_size[0]) * min(size[1], max_size[1]) * 3
+
+        # renditions decoded concurrently are held until compared
+        renditions_bytes = [hd_bytes((r['width'], r['height']), self.master_size) for r in self.renditions_list]
+        renditions_bytes = sum(renditions_bytes) if self.decode_scheduler.concurrent else max(renditions_bytes, default=0)
+        if hd_bytes(self.master_size, self.master_size) + renditions_bytes <= frame_memory_budget:
+            return None
+        hd_size = (max([r['width'] for r in self.renditions_list], default=self.master_size[0]),
+                   max([r['height'] for r in self.renditions_list], default=self.master_size[1]))
+        total_bytes = hd_bytes(hd_size, self.master_size) + renditions_bytes
+        if total_bytes > frame_memory_budget:
+            logger.warning(f'Full resolution samples take {total_bytes} bytes, exceeding frame memory budget of {frame_memory_budget} bytes')
+        logger.info(f'Source samples are downscaled to {hd_size} to fit frame memory budget')
+        return hd_size
+
+    @staticmethod
+    def buffer_bytes(*arrays) -> int:
+        """
+        Total size of sample arrays, skipping missing ones
+        """
+        return int(sum(a.nbytes for a in arrays if isinstance(a, np.ndarray)))
+
+    def frame_data_bytes(self, frame_data) -> int:
+        if frame_data is None:
+            return 0
+        return self.buffer_bytes(frame_data.frame, frame_data.frame_hd, frame_data.luma)
+
+    def track_frame_buffers(self, delta):
+        """
+        Accounts for sample frames being allocated or freed
+        @param delta: bytes
+        @return:
+        """
+        with self.frame_buffer_lock:
+            self.frame_buffer_bytes += delta
+            self.peak_frame_buffer_bytes = max(self.peak_frame_buffer_bytes, self.frame_buffer_bytes)
+
+    def __getstate__(self):
+        # only what's needed to decode samples is sent to decoding processes
+        state = self.__dict__.copy()
+        for key in ['master_capture', 'video_metrics', 'cpu_profiler', 'decode_scheduler', 'master_cache', 'metrics', 'sample_slots',
+                    'master_samples', 'master_samples_hd', 'master_samples_luma', 'capture_to_array', 'compare_renditions_instant',
+                    'frame_features', 'metric_executor']:
+            state.pop(key, None)
+        state['image_pair_callback'] = None
+        state['frame_buffer_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.frame_buffer_lock = threading.Lock()
+
+    def pick_master_samples(self, index):
+        """
+        Picks random source frames to compute metrics at, using packet index of the source video
+        @param index: FrameIndex of the source
+        @return:
+        """
+        self.master_indexes = np.sort(np.random.choice(min(self.total_frames, len(index)), self.max_samples, False))
+        self.master_timestamps = list(index.pts[self.master_indexes])
+
+    def schedule_decoding(self):
+        """
+        Schedules decoding of renditions samples, to be collected by process()
+        @return:
+        """
+        for rendition in self.renditions_list:
+            path = rendition['path']
+            if os.path.exists(path) and path not in self.decode_scheduler.jobs:
+                slots = self.acquire_sample_slots(path) if self.frame_rings else None
+                self.decode_scheduler.submit(path, decode_samples, self, path, slots)
+
+    def create_frame_rings(self):
+        """
+        Allocates shared memory for source and renditions samples, for decoding processes to pass frames without pickling them
+        @return:
+        """
+        if shared_memory is None:
+            logger.warning('Shared memory is not available, frames will be pickled')
+            return
+        slots = (len(self.renditions_list) + 1) * self.max_samples
+        width, height = self.FRAME_SIZE
+        if self.make_color_list:
+            self.frame_rings['frame'] = FrameRing(slots, (height, width, 3))
+        if self.luminance_plane == 'y':
+            self.frame_rings['luma'] = FrameRing(slots, (height, width))
+        self.track_frame_buffers(self.buffer_bytes(*[ring.frames for ring in self.frame_rings.values()]))
+
+    def close_frame_rings(self):
+        if not self.frame_rings:
+            return
+        # source samples outlive shared memory, unless they weren't loaded because of an error
+        for name in ['master_samples', 'master_samples_luma']:
+            if isinstance(getattr(self, name, None), list):
+                setattr(self, name, np.array(getattr(self, name)))
+        self.track_frame_buffers(self.buffer_bytes(getattr(self, 'master_samples', None), getattr(self, 'master_samples_luma', None))
+                                 - self.buffer_bytes(*[ring.frames for ring in self.frame_rings.values()]))
+        for ring in self.frame_rings.values():
+            ring.close()
+        self.frame_rings = {}
+        self.sample_slots = {}
+
+    def close(self):
+        """
+        Stops decoding jobs and frees shared memory frame rings. Done by process(), and on errors in the constructor,
+        the processor may also be used as a context manager to make sure of it.
+        @return:
+        """
+        if getattr(self, 'decode_scheduler', None) is not None:
+            self.decode_scheduler.shutdown()
+        if getattr(self, 'frame_rings', None):
+            self.close_frame_rings()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def acquire_sample_slots(self, path):
+        """
+        Takes shared memory slots for samples of a video
+        @param path: video path
+        @return: dict of slot lists, by kind of samples
+        """
+        slots = {key: ring.acquire(self.max_samples) for key, ring in self.frame_rings.items()}
+        self.sample_slots[path] = slots
+        return slots
+
+    def retain_sample_slots(self, path):
+        for key, slots in self.sample_slots.get(path, {}).items():
+            self.frame_rings[key].retain(slots)
+
+    def release_sample_slots(self, path, forget=True):
+        """
+        Drops reference to shared memory slots of video samples
+        @param path: video path
+        @param forget: samples won't be used anymore, slots are released for the last time
+        @return:
+        """
+        slots = self.sample_slots.pop(path, {}) if forget else self.sample_slots.get(path, {})
+        for key, key_slots in slots.items():
+            self.frame_rings[key].release(key_slots)
+
+    def store_shared_samples(self, slots, frame_list, luma_list):
+        """
+        Copies sample frames to shared memory slots
+        @param slots: dict of slot lists, by kind of samples
+        @param frame_list: BGR samples
+        @param luma_list: luminance samples
+        @return:
+        """
+        for key, samples in [('frame', frame_list), ('luma', luma_list)]:
+            if key in slots:
+                for slot, sample in zip(slots[key], samples):
+                    self.frame_rings[key].write(slot, sample)
+
+    def load_shared_samples(self, slots, count):
+        """
+        Returns views of samples stored in shared memory slots
+        @param slots: dict of slot lists, by kind of samples
+        @param count: number of samples
+        @return: Tuple[BGR samples, luminance samples], empty arrays for kinds of samples that weren't stored
+        """
+        samples = []
+        for key in ['frame', 'luma']:
+            if key in slots:
+                samples.append([self.frame_rings[key].frame(slot) for slot in slots[key][:count]])
+            else:
+                samples.append(np.array([]))
+        return tuple(samples)
+
+    def capture_to_array(self, capture, markup_master_frames=False):
         """
         Function to convert OpenCV video capture to a list of
         numpy arrays for faster processing and analysis.
         @rtype: Tuple[list, np.ndarray, np.ndarray, int, int, int]
         @param capture:
+        @param markup_master_frames: capture is the source video, samples are picked from it rather than matched to source samples
         @return:  A tuple:
                     - list mapping indexes in returned sample frames to corresponding master samples
                     - sample frames
                     - sample frames HD
+                    - sample frames luminance planes, if luminance_plane is 'y'
                     - total sample pixels count
                     - original sample height
                     - original sample width
         """
+        if self.sparse_decoding and capture.can_seek:
+            try:
+                return self.capture_to_array_sparse(capture, markup_master_frames)
+            except Exception:
+                logger.exception(f'Sparse decoding failed for {capture.filename}, falling back to sequential decoding')
+                capture.release()
+                capture = self.open_capture(capture.filename, capture.hd_size)
         # Create list of random timestamps in video file to calculate metrics at
-        if self.markup_master_frames:
-            self.master_indexes = np.sort(np.random.choice(self.total_frames, self.max_samples, False))
-            self.master_timestamps = []
+        master_timestamps = self.master_timestamps
+        if markup_master_frames:
+            if not len(self.master_indexes):
+                self.master_indexes = np.sort(np.random.choice(self.total_frames, self.max_samples, False))
+            master_timestamps = []
 
         # difference between master timestamp and best matching frame timestamp of current video
         master_timestamp_diffs = [np.inf] * len(self.master_indexes)
         # currently selected frames
         candidate_frames = [None] * len(self.master_indexes)
-        # maps selected rendition sample to master sample
-        debug_index_mapping = {}
-        master_idx_map = []
-        frame_list = []
-        frame_list_hd = []
+        master_index_set = set(self.master_indexes)
+        # max theoretical timestamp difference between 'matching' frames would be 1/(2*fps) + max(jitter)
+        # don't consider frames that are too far, otherwise the algorithm will be linear on memory vs video length
+        aligner = None if markup_master_frames else TimestampAligner(master_timestamps, 1 / (2 * capture.fps))
         frames_read = 0
-        pixels = 0
-        height = 0
-        width = 0
-        timestamps_selected = []
         # Iterate through each frame in the video
         while True:
             # Read the frame from the capture
             frame_data = capture.read(grab=True)
             if frame_data is not None:
                 frames_read += 1
-                if self.markup_master_frames:
-                    if frame_data.index in self.master_indexes:
-                        self.master_timestamps.append(frame_data.timestamp)
+                if markup_master_frames:
+                    if frame_data.index in master_index_set:
+                        # master samples are matched to themselves
+                        best_match_idx = len(master_timestamps)
+                        best_match = 0
+                        master_timestamps.append(frame_data.timestamp)
                     else:
                         continue
+                else:
+                    best_match_idx, best_match = aligner.match_one(frame_data.timestamp)
                 # update candidate frames
-                ts_diffs = [abs(frame_data.timestamp - mts) for mts in self.master_timestamps]
-                best_match_idx = int(np.argmin(ts_diffs))
-                best_match = np.min(ts_diffs)
-                # max theoretical timestamp difference between 'matching' frames would be 1/(2*fps) + max(jitter)
-                # don't consider frames that are too far, otherwise the algorithm will be linear on memory vs video length
-                if best_match < 1 / (2 * capture.fps) and master_timestamp_diffs[best_match_idx] > best_match:
+                if best_match_idx >= 0 and master_timestamp_diffs[best_match_idx] > best_match:
                     master_timestamp_diffs[best_match_idx] = best_match
                     frame_data = capture.retrieve()
+                    self.track_frame_buffers(self.frame_data_bytes(frame_data) - self.frame_data_bytes(candidate_frames[best_match_idx]))
                     candidate_frames[best_match_idx] = frame_data
             # Break the loop when frames cannot be taken from original
             else:
                 break
+        if markup_master_frames:
+            # renditions may be already matching against timestamps, so the list is replaced rather than updated in place
+            self.master_timestamps = master_timestamps
 
+        return self._collect_samples(capture, candidate_frames, master_timestamp_diffs, markup_master_frames)
+
+    def capture_to_array_sparse(self, capture, markup_master_frames=False):
+        """
+        Seek-based alternative to capture_to_array. Uses packet index of the video to find the keyframe preceding each sample,
+        seeks to it and decodes only frames between the keyframe and the sample.
+        @param capture:
+        @param markup_master_frames:
+        @return: same as capture_to_array
+        """
+        index = capture.frame_index
+        if markup_master_frames and not len(self.master_indexes):
+            self.pick_master_samples(index)
+
+        master_timestamp_diffs = [np.inf] * len(self.master_indexes)
+        candidate_frames = [None] * len(self.master_indexes)
+        max_ts_diff = 1 / (2 * capture.fps)
+        aligner = TimestampAligner(self.master_timestamps, max_ts_diff)
+        # frames of current video expected to be the best matches for master samples, mapped before decoding anything
+        target_indexes, _ = aligner.align(index.pts)
+        last_ts = -np.inf
+        frames_decoded = 0
+        for i in aligner.order:
+            if target_indexes[i] < 0:
+                # no frame of this video falls into the sample matching window
+                continue
+            if self.master_timestamps[i] + max_ts_diff < last_ts:
+                # whole matching window was already decoded on the way to previous sample
+                continue
+            keyframe_idx = index.keyframe_before(target_indexes[i])
+            # keep decoding if the keyframe is behind current position, otherwise skip the rest of the GOP
+            if index.pts[keyframe_idx] > last_ts:
+                capture.seek(keyframe_idx)
+            while True:
+                frame_data = capture.read(grab=True)
+                if frame_data is None:
+                    break
+                frames_decoded += 1
+                last_ts = frame_data.timestamp
+                best_match_idx, best_match = aligner.match_one(frame_data.timestamp)
+                if best_match_idx >= 0 and master_timestamp_diffs[best_match_idx] > best_match:
+                    master_timestamp_diffs[best_match_idx] = best_match
+                    frame_data = capture.retrieve()
+                    self.track_frame_buffers(self.frame_data_bytes(frame_data) - self.frame_data_bytes(candidate_frames[best_match_idx]))
+                    candidate_frames[best_match_idx] = frame_data
+                if frame_data.timestamp > self.master_timestamps[i] + max_ts_diff:
+                    break
+            if frame_data is None:
+                break
+        logger.info(f'Sparse decoding of {capture.filename}: {frames_decoded} of {len(index)} frames decoded')
+        return self._collect_samples(capture, candidate_frames, master_timestamp_diffs, markup_master_frames)
+
+    def _collect_samples(self, capture, candidate_frames, master_timestamp_diffs, markup_master_frames):
+        """
+        Converts frames picked from the video to sample arrays
+        @param capture:
+        @param candidate_frames: list of FrameData objects matched to each master sample, or None if no match was found
+        @param master_timestamp_diffs: timestamp differences between master samples and matched frames
+        @param markup_master_frames:
+        @return: same as capture_to_array
+        """
+        # maps selected rendition sample to master sample
+        debug_index_mapping = {}
+        master_idx_map = []
+        # sample arrays are allocated once the number of good matches is known, and filled as candidates are dropped, so that frames are never held twice
+        selected = [i for i in range(len(candidate_frames))
+                    if candidate_frames[i] is not None and master_timestamp_diffs[i] <= 1 / (2 * self.fps)]
+        frame_list = None
+        frame_list_hd = None
+        luma_list = None
+        frame_count = 0
+        pixels = 0
+        height = 0
+        width = 0
+        timestamps_selected = []
         # process picked frames
-        for i in range(len(candidate_frames)):
+        for i in selected:
             frame_data = candidate_frames[i]
+            candidate_frames[i] = None
             ts_diff = master_timestamp_diffs[i]
-            if frame_data is None or ts_diff > 1 / (2 * self.fps):
-                # no good matching candidate frame
-                continue
             if self.debug_frames:
-                cv2.imwrite(f'{self.frame_dir_name}/{i:04}_{"m" if self.markup_master_frames else ""}_{frame_data.index}_{frame_data.timestamp:.4}.png', self._convert_debug_frame(frame_data.frame))
+                cv2.imwrite(f'{self.frame_dir_name}/{i:04}_{"m" if markup_master_frames else ""}_{frame_data.index}_{frame_data.timestamp:.4}.png', self._convert_debug_frame(frame_data.frame))
             timestamps_selected.append(frame_data.timestamp)
             master_idx_map.append(i)
             debug_index_mapping[self.master_indexes[i]] = frame_data.index
-            # Count the number of pixels
-            height = frame_data.frame.shape[1]
-            width = frame_data.frame.shape[0]
+            # Count the number of pixels of the original, not downscaled, frame
+            height = capture.width
+            width = capture.height
             pixels += height * width
 
-            if not self.markup_master_frames and self.image_pair_callback is not None:
-                self.image_pair_callback(self.master_samples_hd[i], frame_data.frame, len(frame_list), ts_diff, self.original_path, capture.filename)
-            frame_list_hd.append(frame_data.frame)
-            # Change color space to have only luminance
-            frame = cv2.resize(frame_data.frame, (480, 270), interpolation=cv2.INTER_LINEAR)
-            frame_list.append(frame)
+            frame_hd = frame_data.frame_hd if frame_data.frame_hd is not None else frame_data.frame
+            if not markup_master_frames and self.image_pair_callback is not None:
+                self.image_pair_callback(self.master_samples_hd[i], frame_hd, frame_count, ts_diff, self.original_path, capture.filename)
+            if self.make_hd_list or self.image_pair_callback is not None:
+                frame_list_hd = self._store_sample(frame_list_hd, len(master_idx_map) - 1, len(selected), frame_hd)
+            if frame_data.luma is not None:
+                luma_list = self._store_sample(luma_list, len(master_idx_map) - 1, len(selected), frame_data.luma)
+            frame = frame_data.frame
+            self.track_frame_buffers(-self.frame_data_bytes(frame_data))
+            if frame is None:
+                continue
+            if (frame.shape[1], frame.shape[0]) != self.FRAME_SIZE:
+                frame = cv2.resize(frame, self.FRAME_SIZE, interpolation=cv2.INTER_LINEAR)
+            frame_list = self._store_sample(frame_list, frame_count, len(selected), frame)
+            frame_count += 1
+        # frames too far from source samples
+        for i, frame_data in enumerate(candidate_frames):
+            self.track_frame_buffers(-self.frame_data_bytes(frame_data))
+            candidate_frames[i] = None
+        frame_list = frame_list if frame_list is not None else np.array([])
+        frame_list_hd = frame_list_hd if frame_list_hd is not None else np.array([])
+        luma_list = luma_list if luma_list is not None else np.array([])
 
         # Clean up memory
         capture.release()
         logger.info(f'Mean master-rendition timestamp diff, sec: {np.mean(list(filter(lambda x: not np.isinf(x), master_timestamp_diffs)))} SD: {np.std(list(filter(lambda x: not np.isinf(x), master_timestamp_diffs)))}')
         logger.info(f'Master frame index mapping for {capture.filename}: \n {debug_index_mapping}')
-        return master_idx_map, np.array(frame_list), np.array(frame_list_hd), pixels, height, width
+        return master_idx_map, frame_list, frame_list_hd, luma_list, pixels, height, width
+
+    def _store_sample(self, samples, idx, count, frame):
+        """
+        Copies frame to sample array, allocating the array for count samples on first use.
+        Frames of a different size, e.g. full resolution ones after a resolution change mid-stream, are resized to the size of the first one.
+        """
+        if samples is None:
+            samples = np.empty((count,) + frame.shape, dtype=frame.dtype)
+            self.track_frame_buffers(samples.nbytes)
+        elif frame.shape != samples.shape[1:]:
+            if frame.shape[2:] != samples.shape[3:] or frame.dtype != samples.dtype:
+                raise ValueError(f'Sample {idx} of shape {frame.shape} and type {frame.dtype} does not match previous samples of shape {samples.shape[1:]} '
+                                 f'and type {samples.dtype}')
+            logger.warning(f'Sample {idx} of size {frame.shape[1]}x{frame.shape[0]} resized to {samples.shape[2]}x{samples.shape[1]} of previous samples')
+            frame = cv2.resize(frame, (samples.shape[2], samples.shape[1]), interpolation=cv2.INTER_LINEAR)
+        samples[idx] = frame
+        return samples
+
+    @staticmethod
+    def _get_sample(samples, idx):
+        """
+        Returns sample frame by index, or None if frames weren't captured
+        """
+        if len(samples) == 0:
+            return None
+        return samples[idx]
 
     @staticmethod
     def _convert_debug_frame(frame):
         return cv2.resize(frame, (1920, 1080), cv2.INTER_CUBIC)
 
-    def compare_renditions_instant(self, rendition_sample_idx, master_sample_idx_map, frame_list, frame_list_hd, dimensions, pixels, path):
+    def compare_renditions_instant(self, rendition_sample_idx, master_sample_idx_map, frame_list, frame_list_hd, dimensions, pixels, path, luma_list=None,
+                                   metrics_list=None):
         """
         Function to compare pairs of numpy arrays extracting their corresponding metrics.
         It basically takes the global original frame at frame_pos and its subsequent to
@@ -236,19 +723,33 @@ class VideoAssetProcessor:
         @param dimensions:
         @param pixels:
         @param path:
+        @param luma_list: rendition luminance planes, used instead of V channel of frames if luminance_plane is 'y'
+        @param metrics_list: metrics to compute, all by default
         @return:
         """
 
         # Dictionary of metrics
         frame_metrics = {}
         # Original frame to compare against (downscaled for performance)
-        reference_frame = self.master_samples[master_sample_idx_map[rendition_sample_idx]]
+        reference_frame = self._get_sample(self.master_samples, master_sample_idx_map[rendition_sample_idx])
         # Original's subsequent frame (downscaled for performance)
-        next_reference_frame = self.master_samples[master_sample_idx_map[rendition_sample_idx + 1]]
+        next_reference_frame = self._get_sample(self.master_samples, master_sample_idx_map[rendition_sample_idx + 1])
         # Rendition frame (downscaled for performance)
-        rendition_frame = frame_list[rendition_sample_idx]
+        rendition_frame = self._get_sample(frame_list, rendition_sample_idx)
         # Rendition's subsequent frame (downscaled for performance)
-        next_rendition_frame = frame_list[rendition_sample_idx + 1]
+        next_rendition_frame = self._get_sample(frame_list, rendition_sample_idx + 1)
+        # Luminance planes, in the same order as frames above
+        planes = (None, None, None, None)
+        if self.luminance_plane == 'y':
+            planes = (luma_list[rendition_sample_idx],
+                      luma_list[rendition_sample_idx + 1],
+                      self.master_samples_luma[master_sample_idx_map[rendition_sample_idx]],
+                      self.master_samples_luma[master_sample_idx_map[rendition_sample_idx + 1]])
+        # Features of frames are cached by (file, sample index), so each frame is transformed once per request
+        features = (self.frame_features.frame(path, rendition_sample_idx, rendition_frame, planes[0]),
+                    self.frame_features.frame(path, rendition_sample_idx + 1, next_rendition_frame, planes[1]),
+                    self.frame_features.frame(self.original_path, master_sample_idx_map[rendition_sample_idx], reference_frame, planes[2]),
+                    self.frame_features.frame(self.original_path, master_sample_idx_map[rendition_sample_idx + 1], next_reference_frame, planes[3]))
         if self.debug_frames:
             cv2.imwrite(f'{self.frame_dir_name}/CRI_{rendition_sample_idx:04}_ref.png', self._convert_debug_frame(reference_frame))
             cv2.imwrite(f'{self.frame_dir_name}/CRI_{rendition_sample_idx:04}_next_ref.png', self._convert_debug_frame(next_reference_frame))
@@ -260,6 +761,9 @@ class VideoAssetProcessor:
             reference_frame_hd = self.master_samples_hd[rendition_sample_idx]
             # Rendition frame (HD for QoE metrics)
             rendition_frame_hd = frame_list_hd[rendition_sample_idx]
+            # Statistics of full resolution source samples are shared by renditions too
+            features += (FrameFeatures(rendition_frame_hd),
+                         self.frame_features.frame((self.original_path, 'hd'), rendition_sample_idx, reference_frame_hd))
 
             # Compute the metrics defined in the global metrics_list.
             # Uses the global instance of video_metrics
@@ -271,12 +775,16 @@ class VideoAssetProcessor:
                                                                    reference_frame,
                                                                    next_reference_frame,
                                                                    rendition_frame_hd,
-                                                                   reference_frame_hd)
+                                                                   reference_frame_hd,
+                                                                   metrics_list=metrics_list,
+                                                                   features=features)
         else:
             rendition_metrics = self.video_metrics.compute_metrics(rendition_frame,
                                                                    next_rendition_frame,
                                                                    reference_frame,
-                                                                   next_reference_frame)
+                                                                   next_reference_frame,
+                                                                   metrics_list=metrics_list,
+                                                                   features=features)
 
         # Retrieve rendition dimensions for further evaluation
         rendition_metrics['dimensions'] = dimensions
@@ -291,16 +799,16 @@ class VideoAssetProcessor:
         frame_metrics[path] = rendition_metrics
 
         # Return the metrics, together with the position of the frame
-        # frame_pos is needed for the ThreadPoolExecutor optimizations
+        # frame_pos is needed for the thread pool optimizations
         return rendition_metrics, rendition_sample_idx
 
-    def compute(self, master_sample_idx_map, frame_list, frame_list_hd, path, dimensions, pixels):
+    def compute(self, master_sample_idx_map, frame_list, frame_list_hd, path, dimensions, pixels, luma_list=None):
         """
         Function to compare lists of numpy arrays extracting their corresponding metrics.
         It basically takes the global original list of frames and the input frame_list
         of numpy arrrays to extract the metrics defined in the constructor.
         frame_pos establishes the index of the frames to be compared.
-        It is optimized by means of the ThreadPoolExecutor of Python's concurrent package
+        It is optimized by means of the long-lived thread pool of MetricExecutor
         for better parallel performance.
         @param master_sample_idx_map: Mapping from rendition sample index to master sample index. If Nframes is different between master and rendition, the index mapping is not 1:1
         @param frame_list:
@@ -308,6 +816,7 @@ class VideoAssetProcessor:
         @param path:
         @param dimensions:
         @param pixels:
+        @param luma_list:
         @return:
         """
         start = timeit.default_timer()
@@ -315,21 +824,37 @@ class VideoAssetProcessor:
         # Dictionary of metrics
         rendition_metrics = {}
         future_list = []
-        # Execute computations in parallel using as many processors as possible
+        batch_values = {}
+        pair_metrics = self.metrics_list
+        if self.batch_metrics and len(master_sample_idx_map) > 1 and not self.debug_frames:
+            batch_values = self.compute_batch(master_sample_idx_map, frame_list, frame_list_hd, luma_list)
+            pair_metrics = [metric for metric in self.metrics_list if metric not in batch_values]
+        # Metrics holding the GIL may be computed in worker processes meanwhile
+        process_metrics = []
+        if not self.debug_frames and not self.do_profiling and len(master_sample_idx_map) > 1:
+            pair_metrics, process_metrics = self.metric_executor.split(pair_metrics, len(master_sample_idx_map) - 1, self.metric_backends)
+        shared_frames, process_futures = None, []
+        if process_metrics:
+            shared_frames, process_futures = self.submit_process_metrics(process_metrics, master_sample_idx_map, frame_list, frame_list_hd, luma_list)
+        # Execute computations in parallel in threads shared by all requests of the process
         # future_list is a dictionary storing all computed values from each thread
-        with ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
-            # Compare the original asset against its renditions
-            for i in range(len(frame_list) - 1):
-                key = f'{i}'
-                future = executor.submit(self.compare_renditions_instant,
-                                         i,
-                                         master_sample_idx_map,
-                                         frame_list,
-                                         frame_list_hd,
-                                         dimensions,
-                                         pixels,
-                                         path)
-                future_list.append((key, future))
+        # Compare the original asset against its renditions
+        for i in range(len(master_sample_idx_map) - 1):
+            key = f'{i}'
+            if not pair_metrics:
+                rendition_metrics[key] = {'dimensions': dimensions, 'pixels': pixels, 'ID': self.original_path}
+                continue
+            future = self.metric_executor.submit_thread(self.compare_renditions_instant,
+                                                        i,
+                                                        master_sample_idx_map,
+                                                        frame_list,
+                                                        frame_list_hd,
+                                                        dimensions,
+                                                        pixels,
+                                                        path,
+                                                        luma_list,
+                                                        pair_metrics)
+            future_list.append((key, future))
 
         # Once all frames in frame_list have been iterated, we can retrieve their values
         for key, future in future_list:
@@ -337,6 +862,16 @@ class VideoAssetProcessor:
             result_rendition_metrics, frame_pos = future.result()
             # The computed values at a given frame
             rendition_metrics[key] = result_rendition_metrics
+        try:
+            for future in process_futures:
+                for i, values in future.result().items():
+                    rendition_metrics[f'{i}'].update(values)
+        finally:
+            if shared_frames is not None:
+                shared_frames.close()
+        for metric, values in batch_values.items():
+            for i, value in enumerate(values):
+                rendition_metrics[f'{i}'][metric] = float(value)
 
         time_spent = timeit.default_timer() - start
         logger.info(f'Metrics compute took: {time_spent}')
@@ -344,6 +879,81 @@ class VideoAssetProcessor:
         # Return the metrics for the currently processed rendition
         return rendition_metrics
 
+    def submit_process_metrics(self, metrics_list, master_sample_idx_map, frame_list, frame_list_hd, luma_list=None) -> tuple:
+        """
+        Schedules computation of metrics in worker processes, in chunks of consecutive sample pairs.
+        Samples are copied to shared memory once for all chunks.
+        @param metrics_list: metrics to compute
+        @param master_sample_idx_map: Mapping from rendition sample index to master sample index
+        @param frame_list:
+        @param frame_list_hd:
+        @param luma_list:
+        @return: (SharedFrames, list of futures returning dicts of metric values by sample index). SharedFrames have to be closed once futures are done.
+        """
+        arrays = {'frames': frame_list, 'master': self.master_samples}
+        if self.luminance_plane == 'y':
+            arrays.update({'luma': luma_list, 'master_luma': self.master_samples_luma})
+        if self.make_hd_list:
+            arrays.update({'frames_hd': frame_list_hd, 'master_hd': self.master_samples_hd})
+        shared_frames = SharedFrames({key: np.asarray(value) for key, value in arrays.items() if value is not None and len(value)})
+        futures = []
+        try:
+            for chunk in self.metric_executor.chunks(len(master_sample_idx_map) - 1):
+                futures.append(self.metric_executor.submit_process(compute_samples, self.video_metrics, shared_frames, metrics_list,
+                                                                   list(master_sample_idx_map), chunk))
+        except Exception:
+            shared_frames.close()
+            raise
+        return shared_frames, futures
+
+    @staticmethod
+    def _take_samples(samples, indexes):
+        # samples in shared memory are lists of per-slot views, which can't be indexed by an array
+        if isinstance(samples, np.ndarray):
+            return samples[indexes]
+        return np.stack([samples[i] for i in indexes])
+
+    def compute_batch(self, master_sample_idx_map, frame_list, frame_list_hd, luma_list=None):
+        """
+        Computes metrics having batch kernels for all sample pairs of a video at once, on stacks of samples
+        @param master_sample_idx_map: Mapping from rendition sample index to master sample index
+        @param frame_list:
+        @param frame_list_hd:
+        @param luma_list:
+        @return: dict of arrays of metric values, one per sample pair
+        """
+        idx_map = np.asarray(master_sample_idx_map)
+        count = len(idx_map) - 1
+        if self.luminance_plane == 'y':
+            planes = np.asarray(luma_list[:count + 1])
+            reference_planes = self._take_samples(self.master_samples_luma, idx_map)
+        else:
+            planes = VideoMetrics.hsv_v_batch(np.asarray(frame_list[:count + 1]))
+            reference_planes = VideoMetrics.hsv_v_batch(self._take_samples(self.master_samples, idx_map))
+        rendition_frames = reference_frames = None
+        if len(frame_list) and len(self.master_samples):
+            rendition_frames = np.asarray(frame_list[:count])
+            reference_frames = self._take_samples(self.master_samples, idx_map[:-1])
+        rendition_frames_hd = reference_frames_hd = None
+        if self.make_hd_list:
+            rendition_frames_hd = np.asarray(frame_list_hd[:count])
+            reference_frames_hd = np.asarray(self.master_samples_hd[:count])
+        reference_histograms = None
+        if 'temporal_histogram_distance' in self.metrics_list and reference_frames is not None:
+            # histograms of source samples are computed for the first rendition only, and shared with per-pair metrics
+            reference_histograms = np.stack([self.frame_features.get((self.original_path, i, 'histogram'),
+                                                                     lambda i=i: VideoMetrics.histogram(self.master_samples[i]))
+                                             for i in map(int, idx_map[:-1])])
+        return self.video_metrics.compute_metrics_batch(planes[:-1],
+                                                        planes[1:],
+                                                        reference_planes[:-1],
+                                                        reference_planes[1:],
+                                                        rendition_frames,
+                                                        reference_frames,
+                                                        rendition_frames_hd,
+                                                        reference_frames_hd,
+                                                        reference_histograms)
+
     def aggregate(self, metrics):
         """
         Function to aggregate computed values of metrics and renditions into a
@@ -440,6 +1050,8 @@ class VideoAssetProcessor:
         metrics_df = pd.concat(dict_of_df, axis=1).transpose().reset_index(inplace=False)
 
         pixels_df = metrics_df['pixels']
+        # one row per rendition, in the same order as pixels
+        dimensions_df = metrics_df['dimension_y'].astype(str) + ':' + metrics_df['dimension_x'].astype(str)
 
         # Compute a size/dimension ratio column for better accuracy
         metrics_df['size_dimension_ratio'] = metrics_df['size'] / (metrics_df['dimension_y'] * metrics_df['dimension_x'])
@@ -516,30 +1128,51 @@ class VideoAssetProcessor:
             if self.do_profiling:
                 self.capture_to_array = self.cpu_profiler(self.capture_to_array)
                 self.compare_renditions_instant = self.cpu_profiler(self.compare_renditions_instant)
-            # Iterate through renditions
-            for rendition in self.renditions_list:
-                path = rendition['path']
-                capture = None
-                try:
-                    if os.path.exists(path):
-                        capture = VideoCapture(path, use_gpu=self.use_gpu)
-                        # Turn openCV capture to a list of numpy arrays
-                        master_idx_map, frame_list, frame_list_hd, pixels, height, width = self.capture_to_array(capture)
-                        dimensions = '{}:{}'.format(int(width), int(height))
-                        # Compute the metrics for the rendition
-                        self.metrics[path] = self.compute(master_idx_map,
-                                                          frame_list,
-                                                          frame_list_hd,
-                                                          path,
-                                                          dimensions,
-                                                          pixels)
-                    else:
-                        logger.error(f'Unable to find rendition file: {path}')
-                except Exception as err:
-                    logger.exception('Unable to compute metrics for {}'.format(path))
-                finally:
-                    if capture is not None:
-                        capture.release()
+            try:
+                self.schedule_decoding()
+                # Iterate through renditions
+                for rendition in self.renditions_list:
+                    path = rendition['path']
+                    shared = path in self.sample_slots
+                    if shared:
+                        # source samples are referenced for the time of comparison
+                        self.retain_sample_slots(self.original_path)
+                    held_bytes = 0
+                    try:
+                        if os.path.exists(path):
+                            # Turn openCV capture to a list of numpy arrays
+                            master_idx_map, frame_list, frame_list_hd, luma_list, pixels, height, width = self.decode_scheduler.result(path)
+                            held_bytes = self.buffer_bytes(frame_list, frame_list_hd, luma_list)
+                            if self.decode_scheduler.use_processes and self.decode_scheduler.concurrent:
+                                # samples decoded in other processes weren't accounted for yet
+                                self.track_frame_buffers(held_bytes)
+                            if shared:
+                                frame_list, luma_list = self.load_shared_samples(self.sample_slots[path], len(master_idx_map))
+                            dimensions = '{}:{}'.format(int(width), int(height))
+                            # Compute the metrics for the rendition
+                            self.metrics[path] = self.compute(master_idx_map,
+                                                              frame_list,
+                                                              frame_list_hd,
+                                                              path,
+                                                              dimensions,
+                                                              pixels,
+                                                              luma_list)
+                        else:
+                            logger.error(f'Unable to find rendition file: {path}')
+                    except Exception as err:
+                        logger.exception('Unable to compute metrics for {}'.format(path))
+                    finally:
+                        # rendition samples are not used after comparison
+                        self.track_frame_buffers(-held_bytes)
+                        self.frame_features.evict(path)
+                        if shared:
+                            self.release_sample_slots(self.original_path, forget=False)
+                            self.release_sample_slots(path)
+            finally:
+                self.close()
+            logger.info(f'Peak frame buffers size: {self.peak_frame_buffer_bytes} bytes')
+            logger.info(f'Frame features computed: {self.frame_features.misses}, reused: {self.frame_features.hits}')
+            self.frame_features.clear()
 
             if self.do_profiling:
                 self.cpu_profiler.print_stats()
@@ -569,18 +1202,74 @@ class VideoAssetProcessor:
         last_rendition_fps = None
         for rendition in self.renditions_list:
             path = rendition['path']
-            try:
-                if os.path.exists(path):
-                    capture = VideoCapture(path, use_gpu=False)
-                    # Get framerate
-                    fps = capture.fps
-                    # Validate frame rates, only renditions with same FPS (though not necessarily equal to source video) are currently supported in a single instance
-                    if last_rendition_fps is not None and last_rendition_fps != fps:
-                        raise Exception(f'Rendition has frame rate incompatible with other renditions: {fps}')
-                    rendition['fps'] = fps
-                    rendition['width'] = capture.width
-                    rendition['height'] = capture.height
-                else:
-                    raise Exception(f'Rendition not found: {path}')
-            finally:
-                capture.release()
+            if os.path.exists(path):
+                probe = self.probe(path)
+                # Get framerate
+                fps = probe.fps
+                # Validate frame rates, only renditions with same FPS (though not necessarily equal to source video) are currently supported in a single instance
+                if last_rendition_fps is not None and last_rendition_fps != fps:
+                    raise Exception(f'Rendition has frame rate incompatible with other renditions: {fps}')
+                rendition['fps'] = fps
+                rendition['width'] = probe.width
+                rendition['height'] = probe.height
+            else:
+                raise Exception(f'Rendition not found: {path}')
+
+
+def decode_samples(processor: VideoAssetProcessor, path, slots=None):
+    """
+    Decodes samples of a rendition matching source samples, a decoding job for DecodeScheduler
+    @param processor:
+    @param path: rendition path
+    @param slots: shared memory slots to store samples in, by kind of samples. Stored samples are not returned.
+    @return: same as VideoAssetProcessor.capture_to_array
+    """
+    capture = processor.open_capture(path, processor.master_size)
+    try:
+        master_idx_map, frame_list, frame_list_hd, luma_list, pixels, height, width = processor.capture_to_array(capture)
+    finally:
+        capture.release()
+    if slots:
+        processor.store_shared_samples(slots, frame_list, luma_list)
+        frame_list, luma_list = None, None
+    return master_idx_map, frame_list, frame_list_hd, luma_list, pixels, height, width
+
+
+def compute_samples(video_metrics: VideoMetrics, shared_frames: SharedFrames, metrics_list, master_sample_idx_map, sample_indexes):
+    """
+    Computes metrics of sample pairs from samples in shared memory, a job for MetricExecutor processes
+    @param video_metrics:
+    @param shared_frames: samples, see VideoAssetProcessor.submit_process_metrics()
+    @param metrics_list: metrics to compute
+    @param master_sample_idx_map: Mapping from rendition sample index to master sample index
+    @param sample_indexes: indexes of rendition samples to compare with their next samples
+    @return: dict of metric values by sample index
+    """
+    try:
+        return _compute_samples(video_metrics, shared_frames, metrics_list, master_sample_idx_map, sample_indexes)
+    finally:
+        # views of shared memory are released when the function above returns
+        shared_frames.close()
+
+
+def _compute_samples(video_metrics, shared_frames, metrics_list, master_sample_idx_map, sample_indexes):
+    frame_features = FrameFeatureCache()
+
+    def sample(key, idx):
+        samples = shared_frames.get(key)
+        return None if samples is None else samples[idx]
+
+    def features(idx, master_idx):
+        return (frame_features.frame('rendition', idx, sample('frames', idx), sample('luma', idx)),
+                frame_features.frame('master', master_idx, sample('master', master_idx), sample('master_luma', master_idx)))
+
+    results = {}
+    for i in sample_indexes:
+        rendition, reference = features(i, master_sample_idx_map[i])
+        next_rendition, next_reference = features(i + 1, master_sample_idx_map[i + 1])
+        hd_features = (FrameFeatures(sample('frames_hd', i)), FrameFeatures(sample('master_hd', i)))
+        results[i] = video_metrics.compute_metrics(None, None, None, None,
+                                                   metrics_list=metrics_list,
+                                                   features=(rendition, next_rendition, reference, next_reference) + hd_features)
+    frame_features.clear()
+    return results
@@ -1,16 +1,18 @@
 """
 Ffmpeg-based video file reader with timestamp support and optional GPU decoding
 """
+import io
 import os
-import re
+import stat
 import time
 import cv2
 from typing import Union, Tuple
 import numpy as np
-import bisect
 import subprocess
-import threading
 import logging
+from .frame_index import FrameIndex
+from .packet_timestamps import PacketTimestamps
+from .media_probe import MediaProbe
 
 logger = logging.getLogger()
 
@@ -37,22 +39,56 @@ class YUV2RGB_GPU():
 		return results.astype(np.uint8)
 
 
+class GrowingFile(io.RawIOBase):
+	"""
+	Read-only file object for a file that is still being written. At the end of file reads wait for more data,
+	until the file stops growing for idle_timeout seconds or reading is stopped from another thread.
+	"""
+	POLL_INTERVAL = 0.05
+
+	def __init__(self, filename: str, idle_timeout: float):
+		super().__init__()
+		self.file = open(filename, 'rb')
+		self.idle_timeout = idle_timeout
+		self.stopping = False
+
+	def readable(self):
+		return True
+
+	def readinto(self, buffer):
+		idle_since = time.time()
+		while True:
+			n = self.file.readinto(buffer)
+			if n or self.stopping or time.time() - idle_since > self.idle_timeout:
+				return n
+			time.sleep(self.POLL_INTERVAL)
+
+	def stop(self):
+		self.stopping = True
+
+	def close(self):
+		self.file.close()
+		super().close()
+
+
 class VideoCapture:
-	# how many times to poll for timestamp availability before generating error
-	MAX_TIMESTAMP_WAIT = 100
-	TIMESTAMP_POLL_INTERVAL = 0.01
 
 	class FrameData:
 		"""
 		Object holding pixel data and metadata
 		"""
 
-		def __init__(self, index: int, timestamp: float, frame: np.ndarray):
+		def __init__(self, index: int, timestamp: float, frame: np.ndarray, frame_hd: np.ndarray = None, luma: np.ndarray = None):
 			self.frame = frame
+			# full resolution frame, available only if reader downscales frames and is asked to keep originals
+			self.frame_hd = frame_hd
+			# luminance plane of the frame, available only if reader is asked for it
+			self.luma = luma
 			self.index = index
 			self.timestamp = timestamp
 
-	def __init__(self, filename: str, use_gpu=False, video_reader: str = 'opencv'):
+	def __init__(self, filename: str, use_gpu=False, video_reader: str = 'opencv', use_index=False, frame_size: Tuple[int, int] = None, keep_hd=True, color=True, luma=False,
+				 live=False, idle_timeout=10.0, hd_size: Tuple[int, int] = None, probe: MediaProbe = None):
 		"""
 
 		@param filename:
@@ -60,28 +96,62 @@ class VideoCapture:
 		@param video_reader: 'ffmpeg_bgr' - read video with ffmpeg bgr24 output, warning: Ffmpeg has some color conversion issue which adds irregular noise to pixel data
 							 'ffmpeg_yuv' - read video with ffmpeg yuv420p output, slower, requires tensorflow
 							 'opencv' - read video with opencv, and use ffmpeg only for reading timestamps, fastest, but scans video 2 times
+							 'pyav' - decode in-process with PyAV, timestamps are taken from decoded frames, requires av package
+		@param use_index: take frame count and timestamps from the persistent frame index instead of scanning the video (ffmpeg readers only, OpenCV reports timestamps itself)
+		@param frame_size: (width, height) to scale frames to. PyAV and ffmpeg_bgr readers scale during decoding, so full resolution BGR frames are never produced, other readers resize decoded frames
+		@param keep_hd: if frame_size is set, also return full resolution frames in FrameData.frame_hd
+		@param color: return BGR frames in FrameData.frame
+		@param luma: return full range luminance plane in FrameData.luma. Without color, PyAV and ffmpeg readers output luminance only and skip YUV to BGR conversion altogether.
+		@param live: file is still being written or is a named pipe (PyAV reader only). Frame count is unknown then, and seeking is not possible. The container format has to be streamable, e.g. MPEG-TS.
+		@param idle_timeout: for live files, seconds to wait for file to grow before treating it as complete
+		@param hd_size: max (width, height) of frames in FrameData.frame_hd, dimensions exceeding it are downscaled on retrieve
+		@param probe: metadata of the file, if it was already probed. Ffmpeg readers take video properties from it, probing the file if it's not given, OpenCV and PyAV readers read them from their own decoders.
 		"""
 		if not os.path.exists(filename):
 			raise ValueError(f'File {filename} doesn\'t exist')
-		if video_reader not in ['ffmpeg_bgr', 'ffmpeg_yuv', 'opencv']:
+		if video_reader not in ['ffmpeg_bgr', 'ffmpeg_yuv', 'opencv', 'pyav']:
 			raise ValueError(f'Unknown video reader type {video_reader}')
 		logger.info(f'Video reader is: {video_reader}')
-		if video_reader == 'ffmpeg_yuv':
+		if video_reader == 'ffmpeg_yuv' and color:
 			global tf
 			import tensorflow as tf
 			self.pixel_converter = YUV2RGB_GPU(self.width, self.height)
+		if video_reader == 'pyav':
+			global av
+			import av
+		if live and video_reader != 'pyav':
+			raise ValueError('Live files can only be read with PyAV reader')
 		self.video_reader = video_reader
-		self.ts_reader_thread: threading.Thread
 		self.filename = filename
 		self.started = False
 		self.stopping = False
 		self.timestamps = []
 		self.frame_idx = -1
-		self.stream_data_read = False
+		# frame timestamps of ffmpeg readers, either from the frame index or streamed by ffprobe
+		self.packet_timestamps = None
 		self.ffmpeg_decoder = ''
 		self.offset = 0
 		self.opencv_capture = None
 		self.last_frame_data = None
+		self.av_container = None
+		self.av_stream = None
+		self.av_frames = None
+		self.av_frame = None
+		# PyAV frames without timestamps follow the previous one, unless the reader was repositioned in between
+		self.seeked = False
+		self.live = live
+		self.idle_timeout = idle_timeout
+		self.live_file = None
+		self._frame_index = None
+		self.use_index = use_index
+		self.frame_size = tuple(frame_size) if frame_size is not None else None
+		self.keep_hd = keep_hd
+		self.hd_size = tuple(hd_size) if hd_size is not None else None
+		self.probe = probe
+		self.color = color
+		self.luma = luma
+		if not color and not luma:
+			raise ValueError('Either color or luma output should be enabled')
 		if use_gpu:
 			# Nvcodec sometimes duplicates frames producing more frames than it\'s actually in the video. In tests, it happened only at the end of the video, but potentially it can corrupt timestamps
 			self.ffmpeg_decoder = '-hwaccel nvdec -c:v h264_cuvid'
@@ -89,6 +159,8 @@ class VideoCapture:
 			if 'opencv' in video_reader:
 				os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = 'video_codec;h264_cuvid'
 				logger.warning('For OpenCV+Ffmpeg GPU acceleration to work, config environment variable must be set before the first cv2 import')
+			if video_reader == 'pyav':
+				logger.warning('GPU decoding is not supported by PyAV reader, using CPU')
 		if 'opencv' in video_reader:
 			if not (cv2.getVersionMajor() >= 4 and cv2.getVersionMinor() >= 2):
 				raise Exception('Can\'t use OpenCV to read video - minimum required version of opencv-python is 4.2')
@@ -100,6 +172,20 @@ class VideoCapture:
 		Reads video properties and fills corresponding fields
 		@return:
 		"""
+		if self.video_reader == 'pyav':
+			self._read_metadata_pyav()
+			return
+		if self.video_reader != 'opencv':
+			# decoding happens in ffmpeg process, there is no need to open the file here
+			# values parsed from container headers aren't trusted for decode geometry
+			if self.probe is None or self.probe.headers:
+				self.probe = MediaProbe.load(self.filename)
+			self.fps = self.probe.fps
+			self.width = self.probe.width
+			self.height = self.probe.height
+			self.frame_count = len(self.frame_index) if self.use_index else self.probe.frame_count
+			logger.info(f'Video file opened {self.filename}, {self.width}x{self.height}, {self.fps} FPS')
+			return
 		cap = None
 		try:
 			cap = cv2.VideoCapture(self.filename, cv2.CAP_FFMPEG)
@@ -107,15 +193,88 @@ class VideoCapture:
 			self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
 			self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 			self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-			if self.video_reader == 'opencv':
-				self.opencv_capture = cap
+			if self.use_index:
+				self.frame_count = len(self.frame_index)
+			self.opencv_capture = cap
 			logger.info(f'Video file opened {self.filename}, {self.width}x{self.height}, {self.fps} FPS')
-		finally:
-			if cap is not None and self.video_reader != 'opencv':
+		except Exception:
+			if cap is not None:
 				cap.release()
+			raise
+
+	def _read_metadata_pyav(self):
+		"""
+		Opens the container that is later used for decoding, so the file is parsed only once
+		@return:
+		"""
+		if self.live and not stat.S_ISFIFO(os.stat(self.filename).st_mode):
+			self.live_file = GrowingFile(self.filename, self.idle_timeout)
+			self.av_container = av.open(self.live_file)
+		else:
+			# pipes block on their own until data arrives
+			self.av_container = av.open(self.filename)
+		self.av_stream = self.av_container.streams.video[0]
+		# let decoder use frame and slice threading
+		self.av_stream.thread_type = 'AUTO'
+		self.fps = float(self.av_stream.average_rate or self.av_stream.guessed_rate or 0)
+		self.width = self.av_stream.codec_context.width
+		self.height = self.av_stream.codec_context.height
+		self.frame_count = self.av_stream.frames
+		if self.live:
+			self.frame_count = 0
+		elif self.use_index or self.frame_count == 0:
+			self.frame_count = len(self.frame_index)
+		# express timestamps relative to container start, the same way other readers do
+		if self.av_container.start_time is not None:
+			self.offset = self.av_container.start_time / av.time_base
+		logger.info(f'Video file opened {self.filename}, {self.width}x{self.height}, {self.fps} FPS')
+
+	@property
+	def frame_index(self) -> FrameIndex:
+		"""
+		Packet index of the video, built on first access
+		@return:
+		"""
+		if self._frame_index is None:
+			self._frame_index = FrameIndex.load(self.filename)
+		return self._frame_index
+
+	@property
+	def can_seek(self) -> bool:
+		return self.video_reader in ['opencv', 'pyav'] and not self.live
+
+	def seek(self, frame_idx: int):
+		"""
+		Positions the reader so that next read() returns the frame with given index (or the closest preceding one, if the decoder can't land on it exactly).
+		Intended to be used with keyframe indexes from frame_index, so that decoder doesn't have to decode frames before the keyframe.
+		@param frame_idx: frame index in presentation order
+		@return:
+		"""
+		if not self.can_seek:
+			raise NotImplementedError(f'Seeking is not supported by {self.video_reader} reader')
+		if not self.started:
+			self.start()
+		if self.video_reader == 'pyav':
+			# seek lands on the closest keyframe at or before the target
+			target_pts = int(round((self.frame_index.pts[frame_idx] + self.frame_index.start_time) / self.av_stream.time_base))
+			self.av_container.seek(target_pts, stream=self.av_stream, backward=True, any_frame=False)
+			self.av_frames = self.av_container.decode(self.av_stream)
+			self.frame_idx = frame_idx - 1
+			self.seeked = True
+		else:
+			self.opencv_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+			# decoder may land on a different frame, trust its own position
+			self.frame_idx = int(self.opencv_capture.get(cv2.CAP_PROP_POS_FRAMES)) - 1
+		logger.debug(f'Seek to frame {frame_idx}')
 
 	def _read_next_frame(self, grab=False):
-		if self.video_reader == 'ffmpeg_yuv':
+		if self._ffmpeg_pix_fmt() == 'gray':
+			width, height = self._ffmpeg_output_size()
+			bytes = self.video_capture.stdout.read(int(height * width))
+			if len(bytes) == 0:
+				return None
+			return np.frombuffer(bytes, np.uint8).reshape([height, width])
+		elif self.video_reader == 'ffmpeg_yuv':
 			# get raw frame from stdout and convert it to numpy array
 			bytes = self.video_capture.stdout.read(int(self.height * self.width * 6 // 4))
 			if len(bytes) == 0:
@@ -128,20 +287,29 @@ class VideoCapture:
 			v = np.reshape(cv2.resize(np.expand_dims(v, -1), (self.width, self.height)), (self.height, self.width))
 			return self.pixel_converter.convert([y], [u], [v])[0]
 		elif self.video_reader == 'ffmpeg_bgr':
-			bytes = self.video_capture.stdout.read(int(self.height * self.width * 3))
+			width, height = self._ffmpeg_output_size()
+			bytes = self.video_capture.stdout.read(int(height * width * 3))
 			if len(bytes) == 0:
 				return None
-			return np.frombuffer(bytes, np.uint8).reshape([self.height, self.width, 3])
+			return np.frombuffer(bytes, np.uint8).reshape([height, width, 3])
 		elif self.video_reader == 'opencv':
 			if not grab:
 				return self.opencv_capture.read()[1]
 			else:
 				return self.opencv_capture.grab()
+		elif self.video_reader == 'pyav':
+			self.av_frame = next(self.av_frames, None)
+			if self.av_frame is None:
+				return None
+			if grab:
+				# pixel format conversion is deferred until retrieve()
+				return True
+			return self.av_frame
 
 	def read(self, grab=False) -> Union[FrameData, None]:
 		"""
 		Reads next frame from video.
-		@param grab: Works for OpenCV reader only. If true, doesn't decode the frame, it will be empty in FrameData object. Use retrieve() to get frame data.
+		@param grab: Works for OpenCV and PyAV readers only. If true, doesn't decode (convert, for PyAV) the frame, it will be empty in FrameData object. Use retrieve() to get frame data.
 		@return:
 		@return: Tuple[frame_index, frame_timestamp, frame] or [None, None, None] if end of video
 		"""
@@ -158,90 +326,165 @@ class VideoCapture:
 		timestamp = self._get_timestamp_for_frame(self.frame_idx)
 		logger.debug(f'Read frame {self.frame_idx} at PTS_TIME {timestamp}')
 		self.last_frame_data = VideoCapture.FrameData(self.frame_idx, timestamp, frame)
+		if not grab:
+			self._set_pixels(self.last_frame_data, frame)
 		return self.last_frame_data
 
 	def retrieve(self):
 		if self.video_reader == 'opencv':
-			self.last_frame_data.frame = self.opencv_capture.retrieve()[1]
+			self._set_pixels(self.last_frame_data, self.opencv_capture.retrieve()[1])
+		elif self.video_reader == 'pyav':
+			self._set_pixels(self.last_frame_data, self.av_frame)
+		else:
+			# ffmpeg readers can't skip reading pixels, only convert them
+			self._set_pixels(self.last_frame_data, self.last_frame_data.frame)
 		return self.last_frame_data
 
+	def _set_pixels(self, frame_data: FrameData, frame):
+		"""
+		Converts decoded frame to BGR and/or luminance arrays of requested size and stores them in frame data
+		@param frame_data:
+		@param frame: either numpy array (BGR or luminance) or PyAV frame
+		@return:
+		"""
+		if self.video_reader == 'pyav':
+			size = {} if self.frame_size is None else dict(width=self.frame_size[0], height=self.frame_size[1], interpolation='BILINEAR')
+			frame_data.frame = None
+			if self.color:
+				if self.keep_hd and self.frame_size is not None:
+					frame_data.frame_hd = self._resize_hd(frame.to_ndarray(format='bgr24'))
+				# scale and convert pixel format in one pass, straight from decoder output
+				frame_data.frame = frame.to_ndarray(format='bgr24', **size)
+			if self.luma:
+				# gray conversion only touches Y plane and expands it to full range
+				frame_data.luma = frame.to_ndarray(format='gray', **size)
+			return
+		if frame.ndim == 2:
+			# reader produced luminance only
+			frame_data.frame = None
+			frame_data.luma = self._resize(frame)
+			return
+		if self.frame_size is None or (frame.shape[1], frame.shape[0]) == self.frame_size:
+			frame_data.frame = frame
+		else:
+			if self.keep_hd:
+				frame_data.frame_hd = self._resize_hd(frame)
+			frame_data.frame = self._resize(frame)
+		if self.luma:
+			frame_data.luma = cv2.cvtColor(frame_data.frame, cv2.COLOR_BGR2GRAY)
+		if not self.color:
+			frame_data.frame = None
+
+	def _resize(self, frame):
+		if self.frame_size is None or (frame.shape[1], frame.shape[0]) == self.frame_size:
+			return frame
+		return cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_LINEAR)
+
+	def _resize_hd(self, frame):
+		if self.hd_size is None:
+			return frame
+		# each dimension is limited separately, the same way metrics rescale frame pairs
+		size = (min(frame.shape[1], self.hd_size[0]), min(frame.shape[0], self.hd_size[1]))
+		if size == (frame.shape[1], frame.shape[0]):
+			return frame
+		return cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+
+	def _ffmpeg_pix_fmt(self) -> str:
+		"""
+		Pixel format of ffmpeg process output, empty for readers not using ffmpeg for decoding
+		@return:
+		"""
+		if self.video_reader not in ['ffmpeg_bgr', 'ffmpeg_yuv']:
+			return ''
+		if self.luma and not self.color:
+			return 'gray'
+		return 'yuv420p' if self.video_reader == 'ffmpeg_yuv' else 'bgr24'
+
+	def _ffmpeg_output_size(self) -> Tuple[int, int]:
+		"""
+		Size of frames produced by ffmpeg process, ffmpeg scales frames itself unless full resolution frames have to be kept
+		@return: (width, height)
+		"""
+		if self.frame_size is not None and (self._ffmpeg_pix_fmt() == 'gray' or (self.video_reader == 'ffmpeg_bgr' and not self.keep_hd)):
+			return self.frame_size
+		return self.width, self.height
+
 	def _get_timestamp_for_frame(self, frame_idx) -> float:
 		if self.video_reader == 'opencv':
 			# opencv handles offset internally
 			opencv_ts = self.opencv_capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
 			self.timestamps.append(opencv_ts)
-		else:
-			# wait for timestamp record to be available, normally it available before frame is read
-			waits = 0
-			while frame_idx > len(self.timestamps) - 1:
-				time.sleep(VideoCapture.TIMESTAMP_POLL_INTERVAL)
-				waits += 1
-				if waits > VideoCapture.MAX_TIMESTAMP_WAIT:
-					raise Exception('Error reading video timestamps')
-			if waits > 0:
-				logger.debug(f'Waited for frame timestamp for {VideoCapture.TIMESTAMP_POLL_INTERVAL * waits} sec')
+			# after seek, list positions no longer correspond to frame indexes
+			return opencv_ts
+		elif self.video_reader == 'pyav':
+			if self.av_frame.pts is not None:
+				pyav_ts = float(self.av_frame.pts * self.av_stream.time_base) - self.offset
+			elif self.timestamps and self.fps and not self.seeked:
+				# frame without timestamp, e.g. of raw H.264 stream, follows the previous one by frame duration
+				pyav_ts = self.timestamps[-1] + 1 / self.fps
+			else:
+				# first frame or first one after seek
+				pyav_ts = frame_idx / self.fps if self.fps else 0.0
+			self.seeked = False
+			self.timestamps.append(pyav_ts)
+			return pyav_ts
+		elif self.packet_timestamps is not None:
+			# blocks until ffprobe has read far enough, normally the timestamp is available before the frame is decoded
+			ffmpeg_ts = self.packet_timestamps.get(frame_idx)
+			self.timestamps.append(ffmpeg_ts)
+			return ffmpeg_ts
 		return self.timestamps[frame_idx]
 
 	def start(self):
-		if self.video_reader != 'opencv':
+		if self.video_reader == 'pyav':
+			self.av_frames = self.av_container.decode(self.av_stream)
+		elif self.video_reader != 'opencv':
 			format = 'null'
-			pix_fmt = 'yuv420p' if self.video_reader == 'ffmpeg_yuv' else ('bgr24' if self.video_reader == 'ffmpeg_bgr' else '')
+			pix_fmt = self._ffmpeg_pix_fmt()
 			if pix_fmt:
 				pix_fmt = f'-pix_fmt {pix_fmt}'
 				format = 'rawvideo'
+			if self._ffmpeg_output_size() != (self.width, self.height):
+				pix_fmt = f'-vf scale={self.frame_size[0]}:{self.frame_size[1]}:flags=bilinear {pix_fmt}'
 			output = 'pipe:' if self.video_reader != 'opencv' else '-'
-			# start ffmpeg process
-			ffmpeg_cmd = f"ffmpeg -y -debug_ts -hide_banner {self.ffmpeg_decoder} -i {self.filename} -copyts -f {format} {pix_fmt} {output}"
-			self.video_capture = subprocess.Popen(ffmpeg_cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-			# stderr and stdout are not synchronized, read timestamp data in separate thread
-			self.ts_reader_thread = threading.Thread(target=self.stream_reader, args=[self.video_capture.stderr])
-			self.ts_reader_thread.start()
-			# wait for stream reader thread to fill timestamp list
-			time.sleep(0.05)
+			if self.use_index:
+				# timestamps are known upfront
+				self.timestamps = list(self.frame_index.pts)
+				self.offset = self.frame_index.start_time
+			else:
+				# read timestamps with a demux-only pass alongside decoding
+				self.packet_timestamps = PacketTimestamps(self.filename)
+				self.packet_timestamps.start()
+			ffmpeg_cmd = f"ffmpeg -y -loglevel error -hide_banner {self.ffmpeg_decoder} -i {self.filename} -copyts -f {format} {pix_fmt} {output}"
+			self.video_capture = subprocess.Popen(ffmpeg_cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
 		self.started = True
 
-	def stream_reader(self, stream):
-		while not self.stopping:
-			try:
-				last_line = stream.readline().decode('ascii')
-				if not last_line:
-					break
-				if not self.stream_data_read:
-					# read stream offset
-					m = re.match('.+Duration:.+start: (?P<start>\d*\.?\d*)', last_line)
-					if m:
-						self.offset = float(m.group('start'))
-						logger.info(f'Video start offset is: {self.offset}')
-						self.stream_data_read = True
-				m = re.match('^demuxer\+ffmpeg -> ist_index:[0-9].+type:video.+pkt_pts_time:(?P<pkt_pts_time>\d*\.?\d*)', last_line)
-				if m:
-					timestamp = float(m.group('pkt_pts_time'))
-					if timestamp < self.offset:
-						logger.warning('Unknown behavior: pkt_pts_time is expected to be greater than stream start offset')
-						timestamp = self.offset
-					# Some frames are out-of-order by PTS, but returned to output in proper order. This may fail if corresponding debug record wasn't yet fetched when frame was read, but such behavior never observed during testing.
-					bisect.insort(self.timestamps, timestamp - self.offset)
-					if 2 < len(self.timestamps) < self.frame_idx + 3:
-						logger.warning('Don\'t have enough timestamp records to account for out-of-order frames')
-					self.timestamps = list(sorted(self.timestamps))
-					if not self.stream_data_read:
-						# stream data wasn't parsed, no point in searching for it
-						logger.warning('Unable to parse stream data, start offset set to 0')
-						self.stream_data_read = True
-			except:
-				if not self.stopping:
-					raise
+	def stop(self):
+		"""
+		Makes reading of a live file end at currently available data. Unlike release(), can be called from another thread.
+		@return:
+		"""
+		if self.live_file is not None:
+			self.live_file.stop()
 
 	def release(self):
 		"""
-		Stop Ffmpeg instance
+		Stop Ffmpeg instance and release decoders
 		@return:
 		"""
 		try:
-			if self.started:
-				self.stopping = True
+			self.stopping = True
+			if self.av_container is not None:
+				self.av_container.close()
+				self.av_container = None
+			if self.live_file is not None:
+				self.live_file.close()
+				self.live_file = None
+			if self.opencv_capture is not None:
+				self.opencv_capture.release()
+			if self.started and self.video_reader not in ['opencv', 'pyav']:
 				self.video_capture.terminate()
-				if self.opencv_capture is not None:
-					self.opencv_capture.release()
+			if self.packet_timestamps is not None:
+				self.packet_timestamps.stop()
 		except:
 			pass
@@ -5,6 +5,7 @@ import math
 import sys
 import cv2
 import numpy as np
+import scipy.fft
 from scipy.spatial import distance
 from sklearn.metrics import mean_squared_error
 from skimage.metrics import structural_similarity
@@ -13,6 +14,8 @@ from skimage.feature import local_binary_pattern as LBP
 from skimage.feature import greycomatrix
 from skimage.feature import greycoprops
 from skimage.filters import gaussian
+from .frame_features import FrameFeatures
+from .metric_registry import Feature, Metric, MetricPlan
 
 
 class VideoMetrics:
@@ -21,14 +24,125 @@ class VideoMetrics:
     It wraps up different machine learning and Computer Vision techniques that serve
     to evaluate and extract characteristics of frames of two videos.
     """
+    # metrics having batch kernels, computed for stacks of frame pairs by compute_metrics_batch()
+    BATCH_METRICS = ['temporal_dct', 'temporal_gaussian_mse', 'temporal_gaussian_difference', 'temporal_threshold_gaussian_difference',
+                     'temporal_difference', 'temporal_mse', 'temporal_psnr', 'temporal_histogram_distance', 'temporal_match']
+    GAUSSIAN_SIGMA = 4
+    # separable kernel of the same size as skimage.filters.gaussian(sigma=GAUSSIAN_SIGMA), which truncates at 4 sigma, see gaussian_filter_fast()
+    GAUSSIAN_KERNEL = cv2.getGaussianKernel(2 * int(4 * GAUSSIAN_SIGMA + 0.5) + 1, GAUSSIAN_SIGMA, cv2.CV_32F)
+    MATCH_THRESHOLD = 10
+    # unary features of frames, see feature(). Costs are for 480x270 frames. Functions implemented in Python rather than in native calls hold the GIL.
+    FEATURES = {
+        'plane': Feature('hsv_v', 'frame', 0.2),
+        'gaussian': Feature('gaussian_filter', cost=5.0),
+        'canny': Feature('canny_edges', cost=0.7),
+        'dct': Feature('dct_transform', cost=1.7),
+        'lbp': Feature('lbp_transform', cost=57.0),
+        'texture': Feature('texture', cost=28.0, gil=True),
+        'entropy': Feature(shannon_entropy, cost=7.0, gil=True),
+        'spatial_complexity': Feature('spatial_complexity', cost=2.5),
+        'histogram': Feature('histogram', 'frame', 0.4),
+        'dhash': Feature('dhash', 'frame', 0.1, gil=True),
+        'qoe_statistics': Feature('qoe_statistics', 'frame'),
+    }
+    # pairwise metrics, see compute_metrics(). Costs exclude features and are for 480x270 frames, HD ones for 1080p.
+    METRICS = {
+        'temporal_brisque': Metric('brisque_features', {'reference_frame': ('rendition', 'frame')}, 30.0),
+        'temporal_histogram_distance': Metric('histogram_distance', {'reference_frame': ('reference', 'frame'), 'rendition_frame': ('rendition', 'frame'),
+                                                                     'hist_a': ('reference', 'histogram'), 'hist_b': ('rendition', 'histogram')},
+                                              0.02),
+        'temporal_difference': Metric('difference', {'current_frame': ('rendition', 'plane'), 'next_frame': ('next_rendition', 'plane')}, 0.5),
+        'temporal_orb': Metric('orb', {'reference_frame': ('reference', 'plane'), 'rendition_frame': ('rendition', 'plane')}, 17.0),
+        'temporal_psnr': Metric('psnr', {'reference_frame': ('reference_hd', 'frame'), 'rendition_frame': ('rendition_hd', 'frame')}, 9.0),
+        'temporal_ssim': Metric('ssim', {'reference_frame': ('reference_hd', 'frame'), 'rendition_frame': ('rendition_hd', 'frame')}, 400.0,
+                                gil=True),
+        'temporal_mse': Metric('mse', {'reference_frame': ('reference', 'plane'), 'rendition_frame': ('rendition', 'plane')}, 0.4),
+        'temporal_canny': Metric('difference_canny', {'reference_frame': ('reference', 'plane'), 'rendition_frame': ('rendition', 'plane'),
+                                                      'reference_edges': ('reference', 'canny'), 'rendition_edges': ('rendition', 'canny')},
+                                 0.1),
+        'temporal_cross_correlation': Metric('cross_correlation', {'reference_frame': ('reference', 'plane'), 'rendition_frame': ('rendition', 'plane')},
+                                             1.6),
+        'temporal_dct': Metric('dct', {'reference_frame': ('reference', 'plane'), 'rendition_frame': ('rendition', 'plane'),
+                                       'reference_dct': ('reference', 'dct'), 'rendition_dct': ('rendition', 'dct')}, 0.1),
+        'temporal_gaussian_mse': Metric('gaussian_mse', {'gauss_reference_frame': ('reference', 'gaussian'),
+                                                         'gauss_rendition_frame': ('rendition', 'gaussian')}, 0.3),
+        'temporal_gaussian_difference': Metric('gaussian_difference', {'gauss_reference_frame': ('reference', 'gaussian'),
+                                                                       'gauss_rendition_frame': ('rendition', 'gaussian')}, 0.3),
+        'temporal_threshold_gaussian_difference': Metric('gaussian_difference_threshold', {'gauss_reference_frame': ('reference', 'gaussian'),
+                                                                                           'gauss_rendition_frame': ('rendition', 'gaussian'),
+                                                                                           'rendition_frame': ('rendition', 'plane'),
+                                                                                           'next_reference_frame': ('next_reference', 'plane')},
+                                                         1.4),
+        'temporal_spatial_complexity': Metric(None, {'value': ('reference', 'spatial_complexity')}),
+        'temporal_texture': Metric('texture_instant', {'reference_frame': ('reference', 'plane'), 'rendition_frame': ('rendition', 'plane'),
+                                                       'reference_texture': ('reference', 'texture'), 'rendition_texture': ('rendition', 'texture')},
+                                   0.2),
+        'temporal_match': Metric('image_match_instant', {'pixelsA': ('reference', 'plane'), 'pixelsB': ('rendition', 'plane')}, 0.4,
+                                 params={'v': MATCH_THRESHOLD}),
+        'temporal_entropy': Metric('entropy', {'reference_frame': ('reference', 'plane'), 'rendition_frame': ('rendition', 'plane'),
+                                               'reference_entropy': ('reference', 'entropy'), 'rendition_entropy': ('rendition', 'entropy')}),
+        'temporal_lbp': Metric('lbp', {'reference_frame': ('reference', 'plane'), 'rendition_frame': ('rendition', 'plane'),
+                                       'lbp_reference': ('reference', 'lbp'), 'lbp_rendition': ('rendition', 'lbp')}, 0.5),
+        'hash_euclidean': Metric(distance.euclidean, {'u': ('reference', 'dhash'), 'v': ('rendition', 'dhash')}),
+        'hash_hamming': Metric(distance.hamming, {'u': ('reference', 'dhash'), 'v': ('rendition', 'dhash')}),
+        'hash_cosine': Metric(distance.cosine, {'u': ('reference', 'dhash'), 'v': ('rendition', 'dhash')}),
+    }
+    # alternative implementations of metrics and features, selected per instance. Their values are close to, but not the same as default ones,
+    # so models trained on default values have to be checked before switching.
+    BACKENDS = {
+        # SSIM and PSNR in float32 OpenCV filters, with statistics of source frames reused by all renditions, see ssim_fast()
+        'opencv_qoe': {
+            'metrics': {
+                'temporal_psnr': Metric('psnr_fast', {'reference_frame': ('reference_hd', 'frame'), 'rendition_frame': ('rendition_hd', 'frame'),
+                                                      'reference_statistics': ('reference_hd', 'qoe_statistics')}, 1.5),
+                'temporal_ssim': Metric('ssim_fast', {'reference_frame': ('reference_hd', 'frame'), 'rendition_frame': ('rendition_hd', 'frame'),
+                                                      'reference_statistics': ('reference_hd', 'qoe_statistics')}, 150.0),
+            },
+        },
+        # Gaussian filter of gaussian_* metrics in float32 OpenCV calls, see gaussian_filter_fast()
+        'opencv_gaussian': {
+            'features': {
+                'gaussian': Feature('gaussian_filter_fast', cost=0.7),
+            },
+        },
+    }
+    # SSIM window and constants, same as defaults of skimage.metrics.structural_similarity for 8-bit frames
+    SSIM_WINDOW = 7
+    SSIM_C1 = (0.01 * 255) ** 2
+    SSIM_C2 = (0.03 * 255) ** 2
+    # execution plans of metric lists, shared by instances
+    plans = {}
+
+    def __init__(self, metrics_list, hash_size, dimension, cpu_profiler, do_profiling, backends=None, qoe_luma=False, qoe_scale=1):
+        """
 
-    def __init__(self, metrics_list, hash_size, dimension, cpu_profiler, do_profiling):
+        @param metrics_list:
+        @param hash_size:
+        @param dimension:
+        @param cpu_profiler:
+        @param do_profiling:
+        @param backends: names of BACKENDS replacing default implementations of their metrics and features
+        @param qoe_luma: fast QoE metrics are computed on luma only, instead of averaging them over BGR channels
+        @param qoe_scale: fast QoE metrics are computed on frame pairs downscaled by this factor
+        """
         self.hash_size = hash_size
         self.metrics_list = metrics_list
         self.dimension = dimension
         self.profiling = do_profiling
         if do_profiling:
             self.cpu_profiler = cpu_profiler
+        self.backends = tuple(backends or ())
+        for backend in self.backends:
+            if backend not in self.BACKENDS:
+                raise ValueError(f'Unknown metric backend {backend}')
+        if int(qoe_scale) < 1:
+            raise ValueError(f'Invalid QoE downscaling factor {qoe_scale}')
+        self.qoe_luma = qoe_luma
+        self.qoe_scale = int(qoe_scale)
+        # declarations of features used by the instance
+        _, self.features = self.declarations(self.backends)
+        # metrics having other implementations than default ones
+        self.backend_metrics = [metric for backend in self.backends for metric in self.BACKENDS[backend].get('metrics', {})]
 
     @staticmethod
     def rescale_pair(reference_frame, rendition_frame):
@@ -179,31 +293,46 @@ class VideoMetrics:
         return difference_ratio.round(decimals=5)
 
     @staticmethod
-    def entropy(reference_frame, rendition_frame):
+    def entropy(reference_frame, rendition_frame, reference_entropy=None, rendition_entropy=None):
         """
         Function that computes the difference in Shannon entropy between
         two images
+        Entropies of frames may be given if they are already computed.
         """
+        if reference_entropy is None:
+            reference_entropy = shannon_entropy(reference_frame)
+        if rendition_entropy is None:
+            rendition_entropy = shannon_entropy(rendition_frame)
 
-        entropy_difference = shannon_entropy(reference_frame) - shannon_entropy(rendition_frame)
+        entropy_difference = reference_entropy - rendition_entropy
 
         return entropy_difference
 
     @staticmethod
-    def lbp(reference_frame, rendition_frame):
+    def lbp_transform(frame):
         """
-        Function that computes the difference in Local Binary patterns between
-        two images
+        Computes uniform Local Binary Patterns of a frame
         """
         # Settings for LBP
         radius = 3
         n_points = 8 * radius
         method = 'uniform'
 
+        return LBP(frame, n_points, radius, method)
+
+    @staticmethod
+    def lbp(reference_frame, rendition_frame, lbp_reference=None, lbp_rendition=None):
+        """
+        Function that computes the difference in Local Binary patterns between
+        two images
+        Patterns of frames may be given if they are already computed.
+        """
         total_pixels = reference_frame.shape[0] * reference_frame.shape[1]
 
-        lbp_reference = LBP(reference_frame, n_points, radius, method)
-        lbp_rendition = LBP(rendition_frame, n_points, radius, method)
+        if lbp_reference is None:
+            lbp_reference = VideoMetrics.lbp_transform(reference_frame)
+        if lbp_rendition is None:
+            lbp_rendition = VideoMetrics.lbp_transform(rendition_frame)
         lbp_difference = lbp_reference - lbp_rendition
 
         return np.count_nonzero(lbp_difference) / total_pixels
@@ -220,18 +349,25 @@ class VideoMetrics:
         return np.mean(np.sqrt(sobel_x ** 2 + sobel_y ** 2))
 
     @staticmethod
-    def dct(reference_frame, rendition_frame):
+    def dct_transform(frame):
+        """
+        Computes Discrete Cosine Transform of a frame scaled to [0, 1]
+        """
+        frame_float = np.float32(frame) / 255.0  # float conversion/scale
+        return cv2.dct(frame_float)  # the dct
+
+    @staticmethod
+    def dct(reference_frame, rendition_frame, reference_dct=None, rendition_dct=None):
         """
         # Function that computes the Discrete Cosine Transform
         # function included in OpenCV and outputs the
         # Maximum value
+        # Transforms of frames may be given if they are already computed.
         """
-
-        reference_frame_float = np.float32(reference_frame) / 255.0  # float conversion/scale
-        reference_dct = cv2.dct(reference_frame_float)  # the dct
-
-        rendition_frame_float = np.float32(rendition_frame) / 255.0  # float conversion/scale
-        rendition_dct = cv2.dct(rendition_frame_float)  # the dct
+        if reference_dct is None:
+            reference_dct = VideoMetrics.dct_transform(reference_frame)
+        if rendition_dct is None:
+            rendition_dct = VideoMetrics.dct_transform(rendition_frame)
 
         _, max_val, _, _ = cv2.minMaxLoc(reference_dct - rendition_dct)
 
@@ -250,19 +386,29 @@ class VideoMetrics:
 
         return max_val
 
-    def difference_canny(self, reference_frame, rendition_frame):
+    @staticmethod
+    def canny_edges(frame):
+        """
+        Computes Canny edges of a frame
+        """
+        lower = 100
+        upper = 200
+
+        return cv2.Canny(frame, lower, upper)
+
+    def difference_canny(self, reference_frame, rendition_frame, reference_edges=None, rendition_edges=None):
         """
         # Function to compute the instantaneous difference between a frame
         # and its subsequent, applying a Canny filter
+        # Edges of frames may be given if they are already computed.
         """
 
         # Compute the Canny edges for the reference frame,
         # its next frame and the next frame of the rendition
-        lower = 100
-        upper = 200
-
-        reference_edges = cv2.Canny(reference_frame, lower, upper)
-        rendition_edges = cv2.Canny(rendition_frame, lower, upper)
+        if reference_edges is None:
+            reference_edges = self.canny_edges(reference_frame)
+        if rendition_edges is None:
+            rendition_edges = self.canny_edges(rendition_frame)
 
         return self.mse(reference_edges, rendition_edges)
 
@@ -277,7 +423,123 @@ class VideoMetrics:
                                      rendition_frame)
 
     @staticmethod
-    def histogram_distance(reference_frame, rendition_frame, bins=None, eps=1e-10):
+    def qoe_statistics(frame):
+        """
+        Returns container of statistics of a full resolution source frame, filled by psnr_fast() and ssim_fast()
+        for each size the frame is compared at, so that renditions of the same size share them
+        """
+        return {}
+
+    def qoe_plane(self, frame, size):
+        """
+        Converts a full resolution frame to the plane fast QoE metrics are computed on
+        @param frame: BGR frame
+        @param size: (width, height) frames of the pair are compared at, before downscaling by qoe_scale
+        @return: 8-bit gray or BGR frame
+        """
+        if self.qoe_luma and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scaled_size = (max(1, size[0] // self.qoe_scale), max(1, size[1] // self.qoe_scale))
+        if (frame.shape[1], frame.shape[0]) != scaled_size:
+            interpolation = cv2.INTER_AREA if self.qoe_scale > 1 else cv2.INTER_LINEAR
+            frame = cv2.resize(frame, scaled_size, interpolation=interpolation)
+        return frame
+
+    def _ssim_mean(self, plane):
+        return cv2.boxFilter(plane, -1, (self.SSIM_WINDOW, self.SSIM_WINDOW), borderType=cv2.BORDER_REFLECT)
+
+    def qoe_reference(self, reference_frame, size, reference_statistics=None, ssim=False):
+        """
+        Returns statistics of a source frame compared at a given size, computing them on first use
+        @param reference_frame: BGR frame
+        @param size: (width, height) the pair is compared at
+        @param reference_statistics: container returned by qoe_statistics(), None to compute statistics without keeping them
+        @param ssim: include float32 plane, local means and local variances needed by SSIM
+        @return: (plane, float32 plane, local means, local variances), the last three are None unless ssim is set
+        """
+        if reference_statistics is None:
+            reference_statistics = {}
+        plane = reference_statistics.get((size, 'plane'))
+        if plane is None:
+            plane = reference_statistics.setdefault((size, 'plane'), self.qoe_plane(reference_frame, size))
+        if not ssim:
+            return plane, None, None, None
+        moments = reference_statistics.get((size, 'moments'))
+        if moments is None:
+            x = plane.astype(np.float32)
+            mu = self._ssim_mean(x)
+            sigma_sq = self._ssim_mean(x * x)
+            sigma_sq -= mu * mu
+            moments = reference_statistics.setdefault((size, 'moments'), (x, mu, sigma_sq))
+        return (plane,) + moments
+
+    @staticmethod
+    def _pair_size(reference_frame, rendition_frame):
+        # same as rescale_pair(), the larger frame is downscaled to the smaller one
+        return (min(reference_frame.shape[1], rendition_frame.shape[1]),
+                min(reference_frame.shape[0], rendition_frame.shape[0]))
+
+    def psnr_fast(self, reference_frame, rendition_frame, reference_statistics=None):
+        """
+        PSNR of full resolution frames, within numerical tolerance of skimage.metrics.peak_signal_noise_ratio.
+        Unlike psnr(), pixel differences don't wrap around at 8 bits.
+        @param reference_frame: BGR frame
+        @param rendition_frame: BGR frame
+        @param reference_statistics: statistics of reference frame shared by renditions, see qoe_statistics()
+        @return:
+        """
+        size = self._pair_size(reference_frame, rendition_frame)
+        reference_plane, _, _, _ = self.qoe_reference(reference_frame, size, reference_statistics)
+        rendition_plane = self.qoe_plane(rendition_frame, size)
+        mse = cv2.norm(reference_plane, rendition_plane, cv2.NORM_L2SQR) / reference_plane.size
+        if mse == 0:
+            return 100
+        return 10 * math.log10(255.0 ** 2 / mse)
+
+    def ssim_fast(self, reference_frame, rendition_frame, reference_statistics=None):
+        """
+        SSIM of full resolution frames with local statistics computed by separable float32 box filters, within numerical tolerance
+        of skimage.metrics.structural_similarity with default settings, mean over channels for BGR frames.
+        Local means and variances of the reference frame are computed once and shared by all renditions of the same size.
+        @param reference_frame: BGR frame
+        @param rendition_frame: BGR frame
+        @param reference_statistics: statistics of reference frame shared by renditions, see qoe_statistics()
+        @return:
+        """
+        size = self._pair_size(reference_frame, rendition_frame)
+        _, x, mu_x, sigma_x = self.qoe_reference(reference_frame, size, reference_statistics, ssim=True)
+        y = self.qoe_plane(rendition_frame, size).astype(np.float32)
+        # sample covariance, as skimage does by default
+        covariance_norm = self.SSIM_WINDOW ** 2 / (self.SSIM_WINDOW ** 2 - 1)
+        # maps are updated in place, from local moments to terms of SSIM formula
+        mu_y = self._ssim_mean(y)
+        sigma_y = self._ssim_mean(y * y)
+        sigma_xy = self._ssim_mean(x * y)
+        mu_xy = mu_x * mu_y
+        sigma_xy -= mu_xy
+        mu_y *= mu_y
+        sigma_y -= mu_y
+        # numerator
+        mu_xy *= 2
+        mu_xy += self.SSIM_C1
+        sigma_xy *= 2 * covariance_norm
+        sigma_xy += self.SSIM_C2
+        mu_xy *= sigma_xy
+        # denominator
+        mu_y += mu_x * mu_x
+        mu_y += self.SSIM_C1
+        sigma_y += sigma_x
+        sigma_y *= covariance_norm
+        sigma_y += self.SSIM_C2
+        mu_y *= sigma_y
+        ssim_map = mu_xy
+        ssim_map /= mu_y
+        # border pixels, whose windows are padded, are left out
+        pad = (self.SSIM_WINDOW - 1) // 2
+        return float(ssim_map[pad:-pad, pad:-pad].mean(dtype=np.float64))
+
+    @staticmethod
+    def histogram(frame, bins=None):
         """
         Compute a 3D histogram in the RGB colorspace,
         then normalizes the histogram so that images
@@ -288,20 +550,41 @@ class VideoMetrics:
         if bins is None:
             bins = [8, 8, 8]
 
-        hist_a = cv2.calcHist([reference_frame], [0, 1, 2],
-                              None, bins, [0, 256, 0, 256, 0, 256])
-        hist_a = cv2.normalize(hist_a, hist_a)
-        hist_b = cv2.calcHist([rendition_frame], [0, 1, 2],
-                              None, bins, [0, 256, 0, 256, 0, 256])
-        hist_b = cv2.normalize(hist_b, hist_b)
+        hist = cv2.calcHist([frame], [0, 1, 2],
+                            None, bins, [0, 256, 0, 256, 0, 256])
+        hist = cv2.normalize(hist, hist)
 
         # return out 3D histogram as a flattened array
-        hist_a = hist_a.flatten()
-        hist_b = hist_b.flatten()
+        return hist.flatten()
+
+    @staticmethod
+    def chi_square(hist_a, hist_b, eps=1e-10):
+        """
+        Computes chi squared distance of histograms along the last axis, in one expression for single histograms or stacks of them.
+        Stacks are broadcast against each other, e.g. (N, bins) histograms of source samples against (R, N, bins) histograms
+        of samples of R renditions give (R, N) distances.
+        @param hist_a: float32 histogram or stack of histograms, see histogram()
+        @param hist_b:
+        @param eps: added to denominators, so that empty bins don't divide by zero
+        @return: distance or array of distances
+        """
+        # differences and sums are taken in float32, the rest in float64, as was done bin by bin
+        difference = np.float64(hist_a - hist_b)
+        return 0.5 * np.sum(difference * difference / (np.float64(hist_a + hist_b) + eps), axis=-1)
+
+    @staticmethod
+    def histogram_distance(reference_frame, rendition_frame, bins=None, eps=1e-10, hist_a=None, hist_b=None):
+        """
+        Computes chi squared distance of normalized 3D histograms of frames, see histogram().
+        Histograms of frames may be given if they are already computed.
+        """
+        if hist_a is None:
+            hist_a = VideoMetrics.histogram(reference_frame, bins)
+        if hist_b is None:
+            hist_b = VideoMetrics.histogram(rendition_frame, bins)
 
         # Return the chi squared distance of the histograms
-        chi_dist = 0.5 * np.sum([((a - b) ** 2) / (a + b + eps) for (a, b) in zip(hist_a, hist_b)])
-        return chi_dist
+        return VideoMetrics.chi_square(hist_a, hist_b, eps)
 
     @staticmethod
     def gaussian_mse(gauss_reference_frame, gauss_rendition_frame):
@@ -312,8 +595,8 @@ class VideoMetrics:
         filtered version of the frames.
         """
 
-        mse = mean_squared_error(gauss_reference_frame, gauss_rendition_frame)
-        return mse
+        difference = gauss_reference_frame - gauss_rendition_frame
+        return np.mean(difference * difference, dtype=np.float64)
 
     @staticmethod
     def gaussian_difference(gauss_reference_frame, gauss_rendition_frame):
@@ -355,7 +638,20 @@ class VideoMetrics:
         return sum_th
 
     @staticmethod
-    def texture_instant(reference_frame, rendition_frame):
+    def texture(frame):
+        """
+        Computes properties of grey level co-occurrence matrix of a frame, see texture_instant()
+        """
+        glcm = greycomatrix(frame,
+                            range(4),
+                            np.pi / 4 * np.arange(4),
+                            levels=256,
+                            symmetric=True,
+                            normed=True)
+        return greycoprops(glcm)
+
+    @staticmethod
+    def texture_instant(reference_frame, rendition_frame, reference_texture=None, rendition_texture=None):
         """
         Haralick features date back to as far as 1970s and were one 
         of the first used to classify aerial imagery collected from satellites.
@@ -368,24 +664,13 @@ class VideoMetrics:
         2.- Compute statistics of the matrix like contrast, correlation, variation etc.
         Credit on the above must be given to:
         http://kampta.github.io/Performance-Shootout-mahotas-vs-skimage-vs-opencv-part2/
+        Properties of frames may be given if they are already computed.
         """
-        # 1.- Compute co-occurence matrix from the reference image
-        reference_frame = greycomatrix(reference_frame,
-                                       range(4),
-                                       np.pi / 4 * np.arange(4),
-                                       levels=256,
-                                       symmetric=True,
-                                       normed=True)
-        # 2.- Compute co-occurence matrix from the rendition image
-        rendition_frame = greycomatrix(rendition_frame,
-                                       range(4),
-                                       np.pi / 4 * np.arange(4),
-                                       levels=256,
-                                       symmetric=True,
-                                       normed=True)
-        # 3.- Compute statistics of the matrix like contrast, correlation, variation
-        reference_texture = greycoprops(reference_frame)
-        rendition_texture = greycoprops(rendition_frame)
+        # Compute co-occurence matrices and their statistics, unless already given
+        if reference_texture is None:
+            reference_texture = VideoMetrics.texture(reference_frame)
+        if rendition_texture is None:
+            rendition_texture = VideoMetrics.texture(rendition_frame)
 
         return mean_squared_error(reference_texture, rendition_texture)
 
@@ -437,13 +722,122 @@ class VideoMetrics:
 
         return features
 
+    @staticmethod
+    def hsv_v(frame):
+        """
+        Returns V channel of HSV conversion of a BGR frame
+        """
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)[..., -1]
+
+    def gaussian_filter(self, frame):
+        """
+        Applies Gaussian filter used by gaussian_* metrics
+        """
+        return gaussian(frame, sigma=self.GAUSSIAN_SIGMA)
+
+    def gaussian_filter_fast(self, frame):
+        """
+        Float32 version of gaussian_filter(), within numerical tolerance of it, for 8-bit planes.
+        Filters with precomputed separable kernel, scaling to [0, 1] range in the same pass.
+        """
+        return cv2.sepFilter2D(frame, cv2.CV_32F, self.GAUSSIAN_KERNEL, self.GAUSSIAN_KERNEL / 255, borderType=cv2.BORDER_REPLICATE)
+
+    @classmethod
+    def declarations(cls, backends=()) -> tuple:
+        """
+        Returns declarations of metrics and features, default ones replaced by those of backends
+        @param backends: names of BACKENDS
+        @return: (dict of metric name to Metric, dict of feature name to Feature)
+        """
+        metrics = dict(cls.METRICS)
+        features = dict(cls.FEATURES)
+        for backend in backends:
+            metrics.update(cls.BACKENDS[backend].get('metrics', {}))
+            features.update(cls.BACKENDS[backend].get('features', {}))
+        return metrics, features
+
+    @classmethod
+    def plan(cls, metrics_list, backends=()) -> MetricPlan:
+        """
+        Returns execution plan of metrics, built once per list of metrics and backends
+        @param metrics_list: metric names, e.g. derived from features of a model
+        @param backends: names of BACKENDS
+        @return:
+        """
+        key = (tuple(metrics_list), tuple(backends))
+        plan = cls.plans.get(key)
+        if plan is None:
+            plan = MetricPlan.build(metrics_list, *cls.declarations(backends))
+            cls.plans[key] = plan
+        return plan
+
+    def _function(self, function):
+        # methods are looked up on the instance, so profiled wrappers are used
+        return getattr(self, function) if isinstance(function, str) else function
+
+    def feature(self, frame_features: FrameFeatures, transform: str):
+        """
+        Returns unary feature of a frame, computed on first use and shared by all metrics using it
+        @param frame_features: FrameFeatures of the frame
+        @param transform: one of FEATURES, or 'frame' for the frame itself
+        @return:
+        """
+        if transform == 'frame':
+            return frame_features.frame
+        return frame_features.get(transform, lambda: self.compute_feature(frame_features, transform))
+
+    def compute_feature(self, frame_features: FrameFeatures, transform: str):
+        """
+        Computes unary feature of a frame
+        @param frame_features: FrameFeatures of the frame
+        @param transform: one of FEATURES
+        @return:
+        """
+        if transform == 'plane' and frame_features.plane is not None:
+            # luminance plane was decoded directly
+            return frame_features.plane
+        feature = self.features[transform]
+        return self._function(feature.function)(self.feature(frame_features, feature.source))
+
+    def compute_metric(self, metric: Metric, frames: dict):
+        """
+        Computes a pairwise metric
+        @param metric: Metric declaration
+        @param frames: dict of FrameFeatures by frame name, see metric_registry.FRAMES
+        @return: metric value
+        """
+        args = {arg: self.feature(frames[frame], feature) for arg, (frame, feature) in metric.inputs.items()}
+        if metric.function is None:
+            [value] = args.values()
+            return value
+        return self._function(metric.function)(**args, **metric.params)
+
     def compute_metrics(self,
                         rendition_frame,
                         next_rendition_frame,
                         reference_frame,
                         next_reference_frame,
                         rendition_frame_HD=None,
-                        reference_frame_HD=None):
+                        reference_frame_HD=None,
+                        planes=None,
+                        metrics_list=None,
+                        features=None):
+        """
+        Computes metrics of metrics_list for a rendition frame against reference frame
+        @param rendition_frame: BGR frame, may be None if no color metrics are computed and planes are given
+        @param next_rendition_frame:
+        @param reference_frame:
+        @param next_reference_frame:
+        @param rendition_frame_HD:
+        @param reference_frame_HD:
+        @param planes: single channel planes of (rendition, next rendition, reference, next reference) frames. If given, they are used by luminance metrics instead of V channel of frames.
+        @param metrics_list: metrics to compute, all metrics of the instance by default
+        @param features: FrameFeatures of (rendition, next rendition, reference, next reference) frames, usually backed by a FrameFeatureCache,
+                         optionally followed by those of (rendition HD, reference HD) frames. If given, frames and planes arguments are ignored.
+        @return: dict of metric values
+        """
+        if metrics_list is None:
+            metrics_list = self.metrics_list
 
         if self.profiling:
             self.cross_correlation = self.cpu_profiler(self.cross_correlation)
@@ -453,111 +847,247 @@ class VideoMetrics:
             self.difference_canny = self.cpu_profiler(self.difference_canny)
             self.difference = self.cpu_profiler(self.difference)
             self.spatial_complexity = self.cpu_profiler(self.spatial_complexity)
+            self.gaussian_filter_fast = self.cpu_profiler(self.gaussian_filter_fast)
             self.gaussian_mse = self.cpu_profiler(self.gaussian_mse)
             self.gaussian_difference = self.cpu_profiler(self.gaussian_difference)
             self.gaussian_difference_threshold = self.cpu_profiler(self.gaussian_difference_threshold)
             self.mse = self.cpu_profiler(self.mse)
             self.psnr = self.cpu_profiler(self.psnr)
             self.ssim = self.cpu_profiler(self.ssim)
+            self.psnr_fast = self.cpu_profiler(self.psnr_fast)
+            self.ssim_fast = self.cpu_profiler(self.ssim_fast)
             self.orb = self.cpu_profiler(self.orb)
             self.rescale_pair = self.cpu_profiler(self.rescale_pair)
             self.texture_instant = self.cpu_profiler(self.texture_instant)
             self.image_match_instant = self.cpu_profiler(self.image_match_instant)
             self.brisque_features = self.cpu_profiler(self.brisque_features)
 
+        if features is None:
+            frames = (rendition_frame, next_rendition_frame, reference_frame, next_reference_frame)
+            features = tuple(FrameFeatures(frame, planes[i] if planes is not None else None) for i, frame in enumerate(frames))
+        if len(features) == 4:
+            features = tuple(features) + (FrameFeatures(rendition_frame_HD), FrameFeatures(reference_frame_HD))
+        frames = dict(zip(['rendition', 'next_rendition', 'reference', 'next_reference', 'rendition_hd', 'reference_hd'], features))
+
+        plan = self.plan(metrics_list, self.backends)
+        # Intermediate features are computed in dependency order, each once, only if some metric of the plan needs them
+        for frame, feature in plan.features:
+            self.feature(frames[frame], feature)
+
         rendition_metrics = {}
-        # Some metrics only need the luminance channel
-        reference_frame_v = cv2.cvtColor(reference_frame, cv2.COLOR_BGR2HSV)[..., -1]
-        rendition_frame_v = cv2.cvtColor(rendition_frame, cv2.COLOR_BGR2HSV)[..., -1]
-        next_reference_frame_v = cv2.cvtColor(next_reference_frame, cv2.COLOR_BGR2HSV)[..., -1]
-        next_rendition_frame_v = cv2.cvtColor(next_rendition_frame, cv2.COLOR_BGR2HSV)[..., -1]
+        for name, metric in plan.metrics.items():
+            rendition_metrics[name] = self.compute_metric(metric, frames)
 
-        sigma = 4
-        gauss_reference_frame = gaussian(reference_frame_v, sigma=sigma)
-        gauss_rendition_frame = gaussian(rendition_frame_v, sigma=sigma)
+        return rendition_metrics
 
-        for metric in self.metrics_list:
-            if metric == 'temporal_brisque':
-                rendition_metrics[metric] = self.brisque_features(rendition_frame)
+    # Batch kernels. They take (N, H, W) stacks of single channel planes or (N, H, W, 3) stacks of BGR frames, where N is the number of frame pairs,
+    # possibly of several renditions of the same size, and return arrays of N values equal to those of per-pair functions above.
 
-            if metric == 'temporal_histogram_distance':
-                rendition_metrics[metric] = self.histogram_distance(reference_frame,
-                                                                    rendition_frame)
+    @staticmethod
+    def _flat(stack):
+        # per-frame reductions over a contiguous (N, pixels) view use the same summation order as reductions of single frames
+        return np.ascontiguousarray(stack).reshape(len(stack), -1)
 
-            if metric == 'temporal_difference':
-                rendition_metrics[metric] = self.difference(rendition_frame_v,
-                                                            next_rendition_frame_v)
+    @staticmethod
+    def hsv_v_batch(frames):
+        """
+        Computes V channel of HSV conversion of BGR frames, which is the max of channels
+        @param frames: (N, H, W, 3) uint8 stack
+        @return: (N, H, W) uint8 stack
+        """
+        # elementwise max of channel views is much faster than a reduction over the short last axis
+        return np.maximum(np.maximum(frames[..., 0], frames[..., 1]), frames[..., 2])
 
-            if metric == 'temporal_orb':
-                rendition_metrics[metric] = self.orb(reference_frame_v,
-                                                     rendition_frame_v)
+    @staticmethod
+    def rescale_pair_batch(reference_frames, rendition_frames):
+        """
+        Limits the scale of both stacks to the minimum of the dimensions, like rescale_pair()
+        """
+        height = min(reference_frames.shape[1], rendition_frames.shape[1])
+        width = min(reference_frames.shape[2], rendition_frames.shape[2])
 
-            if metric == 'temporal_psnr':
-                rendition_metrics[metric] = self.psnr(reference_frame_HD,
-                                                      rendition_frame_HD)
+        def rescale(frames):
+            if frames.shape[1:3] == (height, width):
+                return frames
+            # full resolution frames are large enough for per-call overhead not to matter, while stacking them as channels would need transposed copies
+            resized = np.empty((len(frames), height, width) + frames.shape[3:], dtype=frames.dtype)
+            for i, frame in enumerate(frames):
+                resized[i] = cv2.resize(frame, (width, height))
+            return resized
 
-            if metric == 'temporal_ssim':
-                rendition_metrics[metric] = self.ssim(reference_frame_HD,
-                                                      rendition_frame_HD)
+        return rescale(reference_frames), rescale(rendition_frames)
 
-            if metric == 'temporal_mse':
-                rendition_metrics[metric] = self.mse(reference_frame_v,
-                                                     rendition_frame_v)
+    @staticmethod
+    def mse_batch(reference_frames, rendition_frames):
+        """
+        Batch version of mse()
+        """
+        reference_frames, rendition_frames = VideoMetrics.rescale_pair_batch(reference_frames, rendition_frames)
+        return VideoMetrics._flat((reference_frames - rendition_frames) ** 2).mean(axis=1)
 
-            if metric == 'temporal_canny':
-                rendition_metrics[metric] = self.difference_canny(reference_frame_v,
-                                                                  rendition_frame_v)
+    @staticmethod
+    def psnr_batch(reference_frames, rendition_frames):
+        """
+        Batch version of psnr()
+        """
+        mse = VideoMetrics.mse_batch(reference_frames, rendition_frames)
+        pixel_max = 255.0
+        with np.errstate(divide='ignore'):
+            return np.where(mse == 0, 100, 20 * np.log10(pixel_max / np.sqrt(mse)))
 
-            if metric == 'temporal_cross_correlation':
-                rendition_metrics[metric] = self.cross_correlation(reference_frame_v,
-                                                                   rendition_frame_v)
+    @staticmethod
+    def dct_batch(reference_frames, rendition_frames):
+        """
+        Batch version of dct(). The transform is linear, so the difference of frames is transformed instead of each frame.
+        """
+        difference = np.float32(reference_frames) / 255.0 - np.float32(rendition_frames) / 255.0
+        difference_dct = scipy.fft.dctn(difference, type=2, norm='ortho', axes=(1, 2), workers=-1)
+        return VideoMetrics._flat(difference_dct).max(axis=1)
+
+    @staticmethod
+    def gaussian_batch(frames, sigma=GAUSSIAN_SIGMA):
+        """
+        Applies Gaussian filter to each frame of the stack, without mixing frames
+        """
+        return gaussian(frames, sigma=(0, sigma, sigma))
+
+    @staticmethod
+    def gaussian_batch_fast(frames):
+        """
+        Batch version of gaussian_filter_fast()
+        """
+        kernel = VideoMetrics.GAUSSIAN_KERNEL
+        return np.stack([cv2.sepFilter2D(frame, cv2.CV_32F, kernel, kernel / 255, borderType=cv2.BORDER_REPLICATE) for frame in frames])
+
+    @staticmethod
+    def gaussian_mse_batch(gauss_difference):
+        """
+        Batch version of gaussian_mse()
+        @param gauss_difference: stack of differences of gaussian filtered reference and rendition frames
+        """
+        return VideoMetrics._flat(gauss_difference ** 2).mean(axis=1, dtype=np.float64)
+
+    @staticmethod
+    def gaussian_difference_batch(gauss_abs_difference):
+        """
+        Batch version of gaussian_difference()
+        @param gauss_abs_difference: float32 stack of absolute differences of gaussian filtered reference and rendition frames
+        """
+        return VideoMetrics._flat(gauss_abs_difference).sum(axis=1)
+
+    @staticmethod
+    def gaussian_difference_threshold_batch(gauss_abs_difference, rendition_frames, next_reference_frames):
+        """
+        Batch version of gaussian_difference_threshold()
+        @param gauss_abs_difference: float32 stack of absolute differences of gaussian filtered reference and rendition frames
+        @param rendition_frames:
+        @param next_reference_frames:
+        """
+        temporal_difference = np.abs(np.float32((next_reference_frames / 255) - (rendition_frames / 255)))
+        threshold = VideoMetrics._flat(temporal_difference).std(axis=1)
+        return np.count_nonzero(VideoMetrics._flat(gauss_abs_difference) > threshold[:, np.newaxis], axis=1).astype(np.float32)
+
+    @staticmethod
+    def difference_batch(current_frames, next_frames):
+        """
+        Batch version of difference()
+        """
+        total_size = current_frames.shape[1] * current_frames.shape[2]
+        difference = np.abs(np.float32(next_frames) - np.float32(current_frames))
+        return (VideoMetrics._flat(difference).mean(axis=1) / total_size).round(decimals=5)
+
+    @staticmethod
+    def image_match_batch(reference_frames, rendition_frames, v):
+        """
+        Batch version of image_match_instant()
+        """
+        pass_count = np.count_nonzero(VideoMetrics._flat(np.abs(np.float64(reference_frames - rendition_frames)) < v), axis=1)
+        return pass_count / reference_frames[0].size
+
+    @staticmethod
+    def histogram_batch(frames, bins=8):
+        """
+        Computes normalized 3D color histograms of frames, see histogram()
+        @param frames: (N, H, W, 3) uint8 stack
+        @param bins: number of bins per channel
+        @return: (N, bins ** 3) float32 array
+        """
+        hist = np.empty((len(frames), bins ** 3), dtype=np.float32)
+        # counting is done by calcHist frame by frame, it is faster than any single NumPy call over the stack
+        for i, frame in enumerate(frames):
+            hist[i] = VideoMetrics.histogram(frame, [bins] * 3)
+        return hist
+
+    @staticmethod
+    def histogram_distance_batch(reference_frames, rendition_frames, eps=1e-10, hist_a=None, hist_b=None):
+        """
+        Batch version of histogram_distance(). Stacks of histograms may be given if they are already computed,
+        e.g. histograms of source samples shared by all renditions, see chi_square().
+        """
+        if hist_a is None:
+            hist_a = VideoMetrics.histogram_batch(reference_frames)
+        if hist_b is None:
+            hist_b = VideoMetrics.histogram_batch(rendition_frames)
+        return VideoMetrics.chi_square(hist_a, hist_b, eps)
+
+    def compute_metrics_batch(self,
+                              rendition_planes,
+                              next_rendition_planes,
+                              reference_planes,
+                              next_reference_planes,
+                              rendition_frames=None,
+                              reference_frames=None,
+                              rendition_frames_hd=None,
+                              reference_frames_hd=None,
+                              reference_histograms=None):
+        """
+        Computes metrics of metrics_list having batch kernels, for stacks of frame pairs, in a few NumPy and OpenCV calls per metric
+        @param rendition_planes: (N, H, W) stack of single channel planes luminance metrics are computed on, see compute_metrics()
+        @param next_rendition_planes:
+        @param reference_planes:
+        @param next_reference_planes:
+        @param rendition_frames: (N, H, W, 3) stack of BGR frames, needed by color metrics only
+        @param reference_frames:
+        @param rendition_frames_hd: stack of full resolution frames, needed by QoE metrics only
+        @param reference_frames_hd:
+        @param reference_histograms: (N, bins) stack of histograms of reference frames, if they are already computed
+        @return: dict of arrays of metric values, one per pair
+        """
+        # batch kernels compute default implementations of metrics
+        metrics = [metric for metric in self.metrics_list if metric in self.BATCH_METRICS and metric not in self.backend_metrics]
+        rendition_metrics = {}
+        if any(metric in ['temporal_gaussian_mse', 'temporal_gaussian_difference', 'temporal_threshold_gaussian_difference'] for metric in metrics):
+            # differences of filtered frames are shared by gaussian metrics
+            gaussian_batch = self.gaussian_batch_fast if 'opencv_gaussian' in self.backends else self.gaussian_batch
+            gauss_difference = gaussian_batch(reference_planes) - gaussian_batch(rendition_planes)
+            gauss_abs_difference = np.abs(np.float32(gauss_difference))
+
+        for metric in metrics:
+            if metric == 'temporal_histogram_distance':
+                rendition_metrics[metric] = self.histogram_distance_batch(reference_frames, rendition_frames, hist_a=reference_histograms)
+
+            if metric == 'temporal_difference':
+                rendition_metrics[metric] = self.difference_batch(rendition_planes, next_rendition_planes)
+
+            if metric == 'temporal_psnr':
+                rendition_metrics[metric] = self.psnr_batch(reference_frames_hd, rendition_frames_hd)
+
+            if metric == 'temporal_mse':
+                rendition_metrics[metric] = self.mse_batch(reference_planes, rendition_planes)
 
             if metric == 'temporal_dct':
-                rendition_metrics[metric] = self.dct(reference_frame_v,
-                                                     rendition_frame_v)
+                rendition_metrics[metric] = self.dct_batch(reference_planes, rendition_planes)
 
             if metric == 'temporal_gaussian_mse':
-                rendition_metrics[metric] = self.gaussian_mse(gauss_reference_frame,
-                                                              gauss_rendition_frame)
+                rendition_metrics[metric] = self.gaussian_mse_batch(gauss_difference)
 
             if metric == 'temporal_gaussian_difference':
-                rendition_metrics[metric] = self.gaussian_difference(gauss_reference_frame,
-                                                                     gauss_rendition_frame)
+                rendition_metrics[metric] = self.gaussian_difference_batch(gauss_abs_difference)
 
             if metric == 'temporal_threshold_gaussian_difference':
-                rendition_metrics[metric] = self.gaussian_difference_threshold(gauss_reference_frame,
-                                                                               gauss_rendition_frame,
-                                                                               rendition_frame_v,
-                                                                               next_reference_frame_v)
-            if metric == 'temporal_spatial_complexity':
-                rendition_metrics[metric] = self.spatial_complexity(reference_frame_v)
-
-            if metric == 'temporal_texture':
-                rendition_metrics[metric] = self.texture_instant(reference_frame_v, rendition_frame_v)
+                rendition_metrics[metric] = self.gaussian_difference_threshold_batch(gauss_abs_difference, rendition_planes, next_reference_planes)
 
             if metric == 'temporal_match':
-                match_threshold = 10
-                rendition_metrics[metric] = self.image_match_instant(reference_frame_v, rendition_frame_v, match_threshold)
-
-            if metric == 'temporal_entropy':
-                rendition_metrics[metric] = self.entropy(reference_frame_v,
-                                                         rendition_frame_v)
-
-            if metric == 'temporal_lbp':
-                rendition_metrics[metric] = self.lbp(reference_frame_v,
-                                                     rendition_frame_v)
-
-            # Compute the hash of the target frame
-            rendition_hash = self.dhash(rendition_frame)
-            # Extract the dhash for the reference frame
-            reference_hash = self.dhash(reference_frame)
-
-            # Compute different distances with the hash
-            if metric == 'hash_euclidean':
-                rendition_metrics['hash_euclidean'] = distance.euclidean(reference_hash, rendition_hash)
-            if metric == 'hash_hamming':
-                rendition_metrics['hash_hamming'] = distance.hamming(reference_hash, rendition_hash)
-            if metric == 'hash_cosine':
-                rendition_metrics['hash_cosine'] = distance.cosine(reference_hash, rendition_hash)
+                rendition_metrics[metric] = self.image_match_batch(reference_planes, rendition_planes, self.MATCH_THRESHOLD)
 
         return rendition_metrics
@@ -28,6 +28,27 @@ def check_dataset():
         pass
 
 
+@pytest.fixture()
+def stub_model_verifier():
+    """
+    Verifier class predicting rendition file size as ocsvm_dist instead of loading models,
+    to check predictions land on the rendition they were computed for
+    """
+    import pandas as pd
+    from verifier import Verifier
+
+    class StubModelVerifier(Verifier):
+
+        def load_models(self):
+            self.features_ul = ['size', 'temporal_dct-mean']
+            self.features_sl = ['size', 'temporal_dct-mean']
+
+        def predict(self, metrics_df):
+            return pd.DataFrame({'sl_pred_tamper': 0, 'ocsvm_dist': metrics_df['size'].astype(float).values, 'ul_pred_tamper': 0, 'meta_pred_tamper': 0})
+
+    return StubModelVerifier
+
+
 @pytest.fixture()
 def testapp(request):
     from api import APP
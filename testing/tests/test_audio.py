@@ -0,0 +1,48 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+from scripts.asset_processor import AudioReader, AudioComparator
+
+
+class TestAudio:
+
+    @staticmethod
+    def _add_tone(tmp_dir, name, video, frequency):
+        path = os.path.join(tmp_dir, name)
+        subprocess.check_call(['ffmpeg', '-loglevel', 'error', '-i', video, '-f', 'lavfi', '-i', f'sine=frequency={frequency}:duration=4',
+                               '-c:v', 'copy', '-c:a', 'aac', '-shortest', path])
+        return path
+
+    def test_read_windows(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = self._add_tone(tmp_dir, 'master.mp4', 'testing/tests/data/master_4s_1080.mp4', 440)
+            reader = AudioReader(path)
+            audio = reader.read()
+            assert audio.dtype == np.int16
+            assert abs(len(audio) - 4 * AudioReader.SAMPLE_RATE) < AudioReader.SAMPLE_RATE / 10
+            windows = reader.read_windows([1.0, 2.5], 0.5)
+            assert abs(len(windows) - AudioReader.SAMPLE_RATE) < AudioReader.SAMPLE_RATE / 10
+            # decoded windows are the same samples as in the whole track
+            start = int(0.75 * AudioReader.SAMPLE_RATE)
+            corr = np.corrcoef(windows[:1000].astype(np.float64), audio[start:start + 1000].astype(np.float64))[0, 1]
+            assert corr > 0.9
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_compare_with_offset(self):
+        random = np.random.RandomState(0)
+        source = (random.randn(8000 * 20) * 3000).astype(np.int16)
+        comparator = AudioComparator(8000, chunk_samples=10000)
+        # aligned tracks of equal length are compared sample by sample
+        other = (random.randn(len(source)) * 3000).astype(np.int16)
+        assert np.isclose(comparator.compare(source, other), np.linalg.norm(source.astype(np.float64) - other))
+        # delayed and truncated copy only differs by samples without counterpart
+        rendition = np.concatenate([np.zeros(300, np.int16), source[:-1000]])
+        assert comparator.estimate_offset(source, rendition) == 300
+        expected = np.linalg.norm(source[-1000:].astype(np.float64))
+        assert np.isclose(comparator.compare(source, rendition), expected)
+        chunks = lambda samples: [samples[i:i + 777] for i in range(0, len(samples), 777)]
+        assert np.isclose(comparator.compare_streams(chunks(source), chunks(rendition)), expected)
@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+import pytest
+from scripts.asset_processor import VideoAssetProcessor, VideoMetrics, shared_memory
+
+
+class TestBatchMetrics:
+
+    metrics_list = ['temporal_dct', 'temporal_gaussian_mse', 'temporal_gaussian_difference', 'temporal_threshold_gaussian_difference',
+                    'temporal_difference', 'temporal_mse', 'temporal_histogram_distance', 'temporal_match', 'temporal_canny']
+
+    def test_kernels_match_per_pair(self):
+        np.random.seed(11)
+        base = np.random.randint(0, 256, (5, 270, 480, 3), dtype=np.uint8)
+        noise = np.random.randint(-20, 20, base.shape)
+        reference = base
+        rendition = np.uint8(np.clip(base + noise, 0, 255))
+        video_metrics = VideoMetrics(self.metrics_list, 16, 270, None, False)
+        expected = [video_metrics.compute_metrics(rendition[i], rendition[i + 1], reference[i], reference[i + 1]) for i in range(4)]
+
+        reference_v = VideoMetrics.hsv_v_batch(reference)
+        rendition_v = VideoMetrics.hsv_v_batch(rendition)
+        assert np.array_equal(reference_v[0], cv2.cvtColor(reference[0], cv2.COLOR_BGR2HSV)[..., -1])
+        actual = video_metrics.compute_metrics_batch(rendition_v[:-1], rendition_v[1:], reference_v[:-1], reference_v[1:],
+                                                     rendition[:-1], reference[:-1])
+        # only metrics having batch kernels are computed
+        assert set(actual.keys()) == set(self.metrics_list) - {'temporal_canny'}
+        for metric, values in actual.items():
+            assert len(values) == 4
+            assert np.allclose(values, [e[metric] for e in expected], rtol=1e-4), metric
+
+    @pytest.mark.parametrize('luminance_plane', ['hsv_v', 'y'])
+    def test_processor_parity(self, luminance_plane):
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}, {'path': 'testing/tests/data/rend_4s_1080_adv_attack.mp4'}]
+        results = {}
+        for batch_metrics in [False, True]:
+            np.random.seed(123)
+            asset_processor = VideoAssetProcessor(master, renditions, self.metrics_list, max_samples=10, luminance_plane=luminance_plane,
+                                                  batch_metrics=batch_metrics)
+            metrics_df, _, _ = asset_processor.process()
+            results[batch_metrics] = metrics_df
+        for column in results[False].columns:
+            if column.startswith('temporal_') and not column.endswith('-series'):
+                assert np.allclose(results[False][column].astype(np.float64), results[True][column].astype(np.float64), rtol=1e-4,
+                                   equal_nan=True), column
+
+    @pytest.mark.skipif(shared_memory is None, reason='Shared memory is not available')
+    @pytest.mark.parametrize('luminance_plane', ['hsv_v', 'y'])
+    def test_decode_processes(self, luminance_plane):
+        # source samples decoded in processes are lists of shared memory views rather than arrays
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}, {'path': 'testing/tests/data/rend_4s_1080_adv_attack.mp4'}]
+        results = {}
+        for decode_processes in [False, True]:
+            np.random.seed(123)
+            asset_processor = VideoAssetProcessor(master, renditions, self.metrics_list, max_samples=10, luminance_plane=luminance_plane,
+                                                  batch_metrics=True, decode_workers=2, decode_processes=decode_processes)
+            if decode_processes:
+                assert isinstance(asset_processor.master_samples, list)
+            metrics_df, _, _ = asset_processor.process()
+            results[decode_processes] = metrics_df
+        for column in results[False].columns:
+            if column.startswith('temporal_') and not column.endswith('-series'):
+                assert np.allclose(results[False][column].astype(np.float64), results[True][column].astype(np.float64),
+                                   equal_nan=True), column
@@ -0,0 +1,66 @@
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+from scripts.asset_processor import ContainerParser, MediaProbe
+
+
+class TestContainerParser:
+    files = ['testing/tests/data/master_4s_1080.mp4', 'testing/tests/data/rend_4s_720_bw.mp4', 'testing/tests/data/0fIdY5IAnhY_60.mp4']
+
+    @staticmethod
+    def _assert_same(fields, probe):
+        for key, value in probe.to_dict().items():
+            if isinstance(value, float):
+                assert abs(fields[key] - value) < 1e-5, key
+            else:
+                assert fields[key] == value, key
+
+    def test_mp4_headers(self):
+        for path in self.files:
+            parser = ContainerParser(path)
+            try:
+                fields = parser.parse()
+            finally:
+                parser.close()
+            self._assert_same(fields, MediaProbe.probe(path))
+            # only box headers and moov are read
+            assert parser.bytes_read < 64 * 1024
+
+    def test_sample_entry_dimensions_ignored(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'forged.mp4')
+            with open(self.files[1], 'rb') as f:
+                data = bytearray(f.read())
+            # visual sample entry declaring a different size than the coded stream
+            entry = data.find(b'avc1') - 4
+            data[entry + 32:entry + 36] = struct.pack('>HH', 1920, 1080)
+            with open(path, 'wb') as f:
+                f.write(data)
+            fields = ContainerParser.parse_file(path)
+            assert (fields['width'], fields['height']) == (1280, 720)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_ts_headers(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for path in self.files[:2]:
+                ts_path = os.path.join(tmp_dir, os.path.basename(path) + '.ts')
+                subprocess.check_call(['ffmpeg', '-loglevel', 'error', '-i', path, '-c', 'copy', '-f', 'mpegts', ts_path])
+                fields = ContainerParser.parse_file(ts_path)
+                self._assert_same(fields, MediaProbe.probe(ts_path))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_fallback(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'master.mkv')
+            subprocess.check_call(['ffmpeg', '-loglevel', 'error', '-i', self.files[0], '-c', 'copy', path])
+            assert ContainerParser.parse_file(path) is None
+            assert MediaProbe.read(path, headers=True).to_dict() == MediaProbe.probe(path).to_dict()
+        finally:
+            shutil.rmtree(tmp_dir)
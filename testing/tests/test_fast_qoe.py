@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+import pytest
+from skimage.metrics import structural_similarity, peak_signal_noise_ratio
+from scripts.asset_processor import VideoAssetProcessor, VideoMetrics
+
+
+def first_frame(path):
+    capture = cv2.VideoCapture(path)
+    _, frame = capture.read()
+    capture.release()
+    return frame
+
+
+class TestFastQoe:
+
+    master = first_frame('testing/tests/data/master_4s_1080.mp4')
+    rendition = first_frame('testing/tests/data/rend_4s_720_bw.mp4')
+
+    @staticmethod
+    def skimage_ssim(reference, rendition):
+        # mean SSIM of channels, which is what skimage computes for multichannel images
+        if reference.ndim == 2:
+            return structural_similarity(reference, rendition)
+        return np.mean([structural_similarity(reference[..., c], rendition[..., c]) for c in range(reference.shape[2])])
+
+    @pytest.mark.parametrize('qoe_luma', [False, True])
+    def test_within_tolerance_of_skimage(self, qoe_luma):
+        video_metrics = VideoMetrics(['temporal_ssim', 'temporal_psnr'], 16, 270, None, False, ['opencv_qoe'], qoe_luma)
+        master, rendition = self.master, self.rendition
+        if qoe_luma:
+            master, rendition = cv2.cvtColor(master, cv2.COLOR_BGR2GRAY), cv2.cvtColor(rendition, cv2.COLOR_BGR2GRAY)
+        # frames are compared at the size of the smaller one
+        reference, rendition = VideoMetrics.rescale_pair(master, rendition)
+        values = video_metrics.compute_metrics(None, None, None, None, self.rendition, self.master)
+        assert abs(values['temporal_ssim'] - self.skimage_ssim(reference, rendition)) < 1e-5
+        assert abs(values['temporal_psnr'] - peak_signal_noise_ratio(reference, rendition)) < 1e-4
+
+    def test_downscaled(self):
+        video_metrics = VideoMetrics(['temporal_ssim', 'temporal_psnr'], 16, 270, None, False, ['opencv_qoe'], True, 2)
+        size = (self.rendition.shape[1] // 2, self.rendition.shape[0] // 2)
+        reference, rendition = [cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), size, interpolation=cv2.INTER_AREA)
+                                for frame in (self.master, self.rendition)]
+        values = video_metrics.compute_metrics(None, None, None, None, self.rendition, self.master)
+        assert abs(values['temporal_ssim'] - self.skimage_ssim(reference, rendition)) < 1e-5
+        assert abs(values['temporal_psnr'] - peak_signal_noise_ratio(reference, rendition)) < 1e-4
+
+    def test_reference_statistics_reused(self):
+        video_metrics = VideoMetrics(['temporal_ssim'], 16, 270, None, False, ['opencv_qoe'])
+        statistics = VideoMetrics.qoe_statistics(self.master)
+        expected = video_metrics.ssim_fast(self.master, self.rendition)
+        assert video_metrics.ssim_fast(self.master, self.rendition, statistics) == expected
+        cached = dict(statistics)
+        assert video_metrics.ssim_fast(self.master, self.rendition, statistics) == expected
+        # statistics are kept per compared size and computed once
+        assert len(statistics) == 2 and all(statistics[key] is cached[key] for key in cached)
+        with pytest.raises(ValueError):
+            VideoMetrics(['temporal_ssim'], 16, 270, None, False, ['gpu'])
+
+    def test_processor(self):
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_1080_adv_attack.mp4'}, {'path': 'testing/tests/data/rend2_4s_1080_adv_attack.mp4'}]
+        asset_processor = VideoAssetProcessor(master, renditions, ['temporal_ssim', 'temporal_psnr'], max_samples=6,
+                                              metric_backends=['opencv_qoe'], batch_metrics=True)
+        metrics_df, _, _ = asset_processor.process()
+        assert np.all((metrics_df['temporal_ssim-mean'] > 0) & (metrics_df['temporal_ssim-mean'] <= 1))
+        assert np.all(np.isfinite(metrics_df['temporal_psnr-mean'].astype(np.float64)))
+        # renditions of the same size share statistics of source samples
+        assert asset_processor.frame_features.hits > 0
@@ -0,0 +1,67 @@
+import os
+import pytest
+from scripts.asset_processor import MediaProbe
+from verifier.reject_rules import RejectRules
+
+
+class TestFastReject:
+    master = 'testing/tests/data/master_4s_1080.mp4'
+
+    def _check(self, rendition, path, rules=None):
+        source = MediaProbe.read(self.master, headers=True).video_metadata()
+        metadata = MediaProbe.read(path, headers=True).video_metadata()
+        # values set by Verifier.pre_verify()
+        if 'resolution' in rendition:
+            rendition['resolution']['height_pre_verification'] = metadata['resolution']['height'] / rendition['resolution']['height']
+            rendition['resolution']['width_pre_verification'] = metadata['resolution']['width'] / rendition['resolution']['width']
+        if 'pixels' in rendition:
+            rendition['pixels_pre_verification'] = rendition['pixels'] / metadata['pixels']
+        return RejectRules(rules).check(source, rendition, metadata)
+
+    def test_plausible_renditions_pass(self):
+        assert self._check({}, 'testing/tests/data/rend_4s_720_bw.mp4') is None
+        assert self._check({'resolution': {'width': 1280, 'height': 720}, 'frame_rate': True, 'pixels': 1280 * 720 * 242},
+                           'testing/tests/data/rend_4s_720_bw.mp4') is None
+
+    def test_mismatches_rejected(self):
+        assert self._check({'resolution': {'width': 1920, 'height': 1080}}, 'testing/tests/data/rend_4s_720_bw.mp4') == RejectRules.RESOLUTION_MISMATCH
+        assert self._check({'frame_rate': False}, 'testing/tests/data/rend_4s_720_bw.mp4') == RejectRules.FRAME_RATE_MISMATCH
+        assert self._check({}, 'testing/tests/data/master_2s_1080.mp4') == RejectRules.DURATION_MISMATCH
+        assert self._check({'pixels': 1280 * 720 * 300}, 'testing/tests/data/rend_4s_720_bw.mp4') == RejectRules.PIXELS_MISMATCH
+        # disabled rules are not applied
+        assert self._check({}, 'testing/tests/data/master_2s_1080.mp4', 'resolution_mismatch,frame_rate_mismatch') is None
+        with pytest.raises(ValueError):
+            RejectRules('bitrate_mismatch')
+
+    @staticmethod
+    def _verifier(verifier_class):
+        return verifier_class(4, 'testing/tests/data', False, False, False, compute_audio_dist=False, reject_rules=RejectRules())
+
+    def test_verify_mixed_renditions(self, stub_model_verifier):
+        accepted = ['testing/tests/data/rend_4s_720_bw.mp4', 'testing/tests/data/rend2_4s_1080_adv_attack.mp4']
+        renditions = [{'uri': 'testing/tests/data/master_2s_1080.mp4'},
+                      {'uri': accepted[0], 'resolution': {'width': 1280, 'height': 720}},
+                      {'uri': 'testing/tests/data/missing.mp4'},
+                      {'uri': 'testing/tests/data/rend_2s_720_bw.mp4'},
+                      {'uri': accepted[1]}]
+        results = self._verifier(stub_model_verifier).verify(self.master, renditions)
+        assert [r.get('reject_reason') for r in results] == [RejectRules.DURATION_MISMATCH, None, None, RejectRules.DURATION_MISMATCH, None]
+        assert all('ocsvm_dist' not in results[i] for i in [0, 2, 3])
+        assert not results[2]['video_available']
+        for i, path in zip([1, 4], accepted):
+            assert results[i]['ocsvm_dist'] == os.path.getsize(path)
+            assert results[i]['tamper'] == 0
+        # post-verification uses dimensions of the same rendition, not of the last decoded one
+        assert results[1]['resolution']['height_post_verification'] == results[1]['resolution']['width_post_verification'] == 1.0
+
+    def test_downloaded_rendition_probed_again(self, stub_model_verifier):
+        verifier = self._verifier(stub_model_verifier)
+        uri = 'http://localhost/rend_4s_720_bw.mp4'
+        for downloaded, rejected in [('testing/tests/data/rend_4s_720_bw.mp4', False), ('testing/tests/data/rend2_4s_1080_adv_attack.mp4', True)]:
+            # headers were checked on the remote file, the download returns the given file
+            probes = {MediaProbe.key(uri): MediaProbe.read('testing/tests/data/rend_4s_720_bw.mp4', headers=True)}
+            verifier.get_video = lambda _: downloaded
+            rendition = {'uri': uri}
+            assert verifier.fetch_rendition(rendition, probes) == rejected
+            assert rendition.get('reject_reason') == (RejectRules.CONTENT_CHANGED if rejected else None)
+            assert ('path' in rendition) != rejected
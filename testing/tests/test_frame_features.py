@@ -0,0 +1,59 @@
+import threading
+import time
+import numpy as np
+from scripts.asset_processor import VideoAssetProcessor, VideoMetrics, FrameFeatureCache
+
+
+class TestFrameFeatures:
+
+    metrics_list = ['temporal_dct', 'temporal_gaussian_mse', 'temporal_gaussian_difference', 'temporal_threshold_gaussian_difference',
+                    'temporal_difference', 'temporal_canny', 'temporal_texture', 'temporal_entropy', 'temporal_lbp', 'temporal_spatial_complexity',
+                    'temporal_histogram_distance', 'hash_euclidean', 'hash_hamming', 'hash_cosine']
+
+    def test_computed_once(self):
+        cache = FrameFeatureCache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return 42
+
+        threads = [threading.Thread(target=cache.get, args=(('a.mp4', 0, 'plane'), compute)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert cache.misses == 1 and cache.hits == 3
+        cache.evict('a.mp4')
+        assert cache.get(('a.mp4', 0, 'plane'), compute) == 42
+        assert len(calls) == 2
+
+    def test_cached_features_match(self):
+        np.random.seed(5)
+        frames = [np.random.randint(0, 256, (270, 480, 3), dtype=np.uint8) for _ in range(6)]
+        video_metrics = VideoMetrics(self.metrics_list, 16, 270, None, False)
+        cache = FrameFeatureCache()
+        for i in range(2):
+            rendition = frames[2 * i:2 * i + 2]
+            reference = frames[4:6]
+            expected = video_metrics.compute_metrics(*rendition, *reference)
+            features = (cache.frame('rendition', 2 * i, rendition[0]), cache.frame('rendition', 2 * i + 1, rendition[1]),
+                        cache.frame('source', 0, reference[0]), cache.frame('source', 1, reference[1]))
+            actual = video_metrics.compute_metrics(None, None, None, None, features=features)
+            assert expected.keys() == actual.keys()
+            for metric in expected:
+                assert np.allclose(expected[metric], actual[metric]), metric
+        # source features of the second comparison were reused
+        assert cache.hits > 0
+
+    def test_processor_reuses_source_features(self):
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}, {'path': 'testing/tests/data/rend_4s_1080_adv_attack.mp4'}]
+        asset_processor = VideoAssetProcessor(master, renditions, ['temporal_dct', 'temporal_gaussian_mse'], max_samples=10)
+        metrics_df, _, _ = asset_processor.process()
+        assert np.all(np.isfinite(metrics_df['temporal_dct-mean'].astype(np.float64)))
+        # source samples are transformed for the first rendition only
+        assert asset_processor.frame_features.hits >= asset_processor.frame_features.misses / 2
+        assert not asset_processor.frame_features.entries
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from scripts.asset_processor import VideoAssetProcessor
+
+
+class TestFrameMemory:
+    master = 'testing/tests/data/master_4s_1080.mp4'
+    rendition = 'testing/tests/data/rend_4s_720_bw.mp4'
+
+    def _process(self, metrics_list, **kwargs):
+        np.random.seed(123)
+        asset_processor = VideoAssetProcessor({'path': self.master}, [{'path': self.rendition}], metrics_list, max_samples=5, **kwargs)
+        metrics_df, _, _ = asset_processor.process()
+        return asset_processor, metrics_df
+
+    def test_hd_samples_only_for_qoe_metrics(self):
+        asset_processor, _ = self._process(['temporal_dct'])
+        assert len(asset_processor.master_samples_hd) == 0
+        # only downscaled samples were held
+        assert 0 < asset_processor.peak_frame_buffer_bytes < 5 * 1920 * 1080 * 3
+
+    def test_budget_downscales_source_samples(self):
+        metrics_list = ['temporal_psnr', 'temporal_dct']
+        unlimited, expected_df = self._process(metrics_list)
+        assert unlimited.master_samples_hd.shape[1:] == (1080, 1920, 3)
+        budgeted, metrics_df = self._process(metrics_list, frame_memory_budget=20 * 1024 ** 2)
+        assert budgeted.master_samples_hd.shape[1:] == (720, 1280, 3)
+        assert budgeted.peak_frame_buffer_bytes < unlimited.peak_frame_buffer_bytes
+        # metrics of the largest rendition are not affected
+        for metric in ['temporal_psnr-mean', 'temporal_dct-mean']:
+            assert np.isclose(float(metrics_df[metric].iloc[0]), float(expected_df[metric].iloc[0]))
+
+    def test_resolution_change(self):
+        asset_processor = VideoAssetProcessor({'path': self.master}, [{'path': self.rendition}], ['temporal_psnr'], max_samples=2)
+        samples = asset_processor._store_sample(None, 0, 3, np.zeros((1080, 1920, 3), np.uint8))
+        # later frames are stored at the size of the first one
+        samples = asset_processor._store_sample(samples, 1, 3, np.full((720, 1280, 3), 255, np.uint8))
+        assert samples.shape == (3, 1080, 1920, 3) and np.all(samples[1] == 255)
+        with pytest.raises(ValueError):
+            asset_processor._store_sample(samples, 2, 3, np.zeros((1080, 1920), np.uint8))
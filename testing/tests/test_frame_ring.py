@@ -0,0 +1,77 @@
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pytest
+from scripts.asset_processor import FrameRing, VideoAssetProcessor, shared_memory
+
+
+def fill_slot(ring, slot, value):
+    ring.write(slot, np.full(ring.frame_shape, value, dtype=np.uint8))
+    return slot
+
+
+@pytest.mark.skipif(shared_memory is None, reason='Shared memory is not available')
+class TestFrameRing:
+
+    def test_refcounting(self):
+        ring = FrameRing(4, (2, 3))
+        try:
+            master_slots = ring.acquire(2)
+            rendition_slots = ring.acquire(2)
+            with pytest.raises(Exception):
+                ring.acquire(1)
+            ring.retain(master_slots)
+            ring.release(rendition_slots)
+            ring.release(master_slots)
+            # source slots are still referenced once
+            assert ring.free == 2
+            ring.release(master_slots)
+            assert ring.free == 4
+            with pytest.raises(Exception):
+                ring.release(master_slots)
+        finally:
+            ring.close()
+
+    def test_cross_process_writes(self):
+        ring = FrameRing(3, (270, 480, 3))
+        try:
+            attached = pickle.loads(pickle.dumps(ring))
+            assert not attached.owner
+            attached.close()
+            slots = ring.acquire(3)
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                written = list(executor.map(fill_slot, [ring] * 3, slots, [10, 20, 30]))
+            assert written == slots
+            for slot, value in zip(slots, [10, 20, 30]):
+                assert np.all(ring.frame(slot) == value)
+        finally:
+            ring.close()
+
+    @staticmethod
+    def rings_freed(rings):
+        for ring in rings:
+            with pytest.raises(FileNotFoundError):
+                shared_memory.SharedMemory(name=ring.shm.name)
+        return True
+
+    @pytest.mark.parametrize('failing', ['compute', 'retain_sample_slots'])
+    def test_freed_on_errors(self, monkeypatch, failing):
+        # source metrics are computed in the constructor, source slots are retained by process()
+        rings = []
+        create_frame_rings = VideoAssetProcessor.create_frame_rings
+
+        def record_rings(processor):
+            create_frame_rings(processor)
+            rings.extend(processor.frame_rings.values())
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('failure')
+
+        monkeypatch.setattr(VideoAssetProcessor, 'create_frame_rings', record_rings)
+        monkeypatch.setattr(VideoAssetProcessor, failing, fail)
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}]
+        with pytest.raises(RuntimeError):
+            with VideoAssetProcessor(master, renditions, ['temporal_dct'], max_samples=4, decode_workers=2, decode_processes=True) as processor:
+                processor.process()
+        assert rings and self.rings_freed(rings)
@@ -0,0 +1,40 @@
+import numpy as np
+from scripts.asset_processor import VideoAssetProcessor, VideoMetrics
+
+
+class TestHistogramDistance:
+
+    @staticmethod
+    def random_frames(count):
+        return np.random.randint(0, 256, (count, 90, 160, 3), dtype=np.uint8)
+
+    def test_same_as_bin_by_bin(self):
+        np.random.seed(7)
+        hist_a, hist_b = VideoMetrics.histogram_batch(self.random_frames(2))
+        expected = 0.5 * np.sum([((a - b) ** 2) / (a + b + 1e-10) for (a, b) in zip(hist_a, hist_b)])
+        assert VideoMetrics.chi_square(hist_a, hist_b) == expected
+        assert VideoMetrics.chi_square(hist_a, hist_a) == 0
+
+    def test_stacked_renditions(self):
+        np.random.seed(8)
+        reference = VideoMetrics.histogram_batch(self.random_frames(4))
+        renditions = np.stack([VideoMetrics.histogram_batch(self.random_frames(4)) for _ in range(3)])
+        # all renditions are scored against the same source histograms in one call
+        distances = VideoMetrics.chi_square(reference, renditions)
+        assert distances.shape == (3, 4)
+        for r in range(3):
+            for i in range(4):
+                assert distances[r, i] == VideoMetrics.chi_square(reference[i], renditions[r, i])
+
+    def test_source_histograms_cached(self):
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}, {'path': 'testing/tests/data/rend_4s_1080_adv_attack.mp4'}]
+        results = {}
+        for batch_metrics in [False, True]:
+            np.random.seed(123)
+            asset_processor = VideoAssetProcessor(master, renditions, ['temporal_histogram_distance'], max_samples=8, batch_metrics=batch_metrics)
+            metrics_df, _, _ = asset_processor.process()
+            results[batch_metrics] = metrics_df
+            # histograms of source samples are computed once, and reused by the second rendition
+            assert asset_processor.frame_features.hits > 0
+        assert np.array_equal(results[False]['temporal_histogram_distance-mean'], results[True]['temporal_histogram_distance-mean'])
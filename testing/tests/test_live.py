@@ -0,0 +1,63 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+import pytest
+from scripts.asset_processor.live_asset_processor import SampleSchedule, LiveAssetProcessor
+
+
+class TestLive:
+
+    def test_sample_schedule(self):
+        schedule = SampleSchedule(1.0, 5, seed=1)
+        # order of queries doesn't affect sampling decisions
+        other = SampleSchedule(1.0, 5, seed=1)
+        other.is_retained(99)
+        timestamps = [schedule.timestamp(w) for w in range(100)]
+        assert timestamps == [other.timestamp(w) for w in range(100)]
+        assert all(w <= ts < w + 1 for w, ts in enumerate(timestamps))
+        retained = [w for w in range(100) if schedule.is_retained(w)]
+        assert len(retained) == 5
+        assert sorted(retained) == sorted(other.retained)
+
+    def test_live_processing(self):
+        pytest.importorskip('av')
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for name in ['master_4s_1080', 'rend_4s_720_bw']:
+                path = os.path.join(tmp_dir, f'{name}.ts')
+                subprocess.check_call(['ffmpeg', '-loglevel', 'error', '-i', f'testing/tests/data/{name}.mp4', '-c', 'copy', '-bsf:v', 'h264_mp4toannexb', path])
+                paths.append(path)
+            asset_processor = LiveAssetProcessor({'path': paths[0]}, [{'path': paths[1]}], ['temporal_dct', 'temporal_gaussian_mse'],
+                                                 max_samples=5, sample_interval=0.5, idle_timeout=0.2, seed=1)
+            asset_processor.start()
+            while asset_processor.wait(1):
+                pass
+            metrics_df, _, _ = asset_processor.process()
+            asset_processor.release()
+            assert 2 <= asset_processor.sample_count <= 5
+            assert np.isfinite(float(metrics_df['temporal_dct-mean'].iloc[0]))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_verify_live_end_of_stream(self, stub_model_verifier):
+        pytest.importorskip('av')
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            paths = []
+            # the second rendition ends before two of its samples can be matched
+            for name, duration in [('master_4s_1080', 4), ('rend_4s_720_bw', 4), ('rend_4s_720_bw', 0.3)]:
+                path = os.path.join(tmp_dir, f'{name}_{duration}.ts')
+                subprocess.check_call(['ffmpeg', '-loglevel', 'error', '-i', f'testing/tests/data/{name}.mp4', '-t', str(duration), '-c', 'copy',
+                                       '-bsf:v', 'h264_mp4toannexb', path])
+                paths.append(path)
+            verifier = stub_model_verifier(5, 'testing/tests/data', False, False, False, compute_audio_dist=False)
+            results = list(verifier.verify_live(paths[0], [{'uri': paths[1]}], sample_interval=0.5, idle_timeout=0.2))
+            assert results and not results[-1][0]['provisional']
+            assert results[-1][0]['ocsvm_dist'] == os.path.getsize(paths[1])
+            with pytest.raises(ValueError):
+                list(verifier.verify_live(paths[0], [{'uri': paths[2]}], sample_interval=0.5, idle_timeout=0.2))
+        finally:
+            shutil.rmtree(tmp_dir)
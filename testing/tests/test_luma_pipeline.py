@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+import pytest
+from scripts.asset_processor import VideoAssetProcessor, VideoMetrics
+from verifier.verifier import Verifier
+
+
+class TestLumaPipeline:
+
+    metrics_list = ['temporal_dct', 'temporal_gaussian_mse', 'temporal_gaussian_difference', 'temporal_threshold_gaussian_difference',
+                    'temporal_difference', 'temporal_mse', 'temporal_canny', 'temporal_cross_correlation', 'temporal_entropy']
+
+    def test_planes_match_hsv_v(self):
+        # V channel of a gray BGR frame equals its luminance, so both paths have to produce identical values.
+        # This only checks plane plumbing, color footage is covered by test_y_not_a_substitute_for_hsv_v
+        np.random.seed(7)
+        frames = [np.random.randint(0, 256, (270, 480), dtype=np.uint8) for _ in range(4)]
+        bgr = [cv2.cvtColor(f, cv2.COLOR_GRAY2BGR) for f in frames]
+        video_metrics = VideoMetrics(self.metrics_list, 16, 270, None, False)
+        expected = video_metrics.compute_metrics(*bgr)
+        actual = video_metrics.compute_metrics(None, None, None, None, planes=tuple(frames))
+        assert expected.keys() == actual.keys()
+        for metric in expected:
+            assert np.isclose(expected[metric], actual[metric]), metric
+
+    @pytest.mark.parametrize('video_reader', ['ffmpeg_bgr', 'pyav'])
+    def test_luma_planes_parity(self, video_reader):
+        # decoders produce luminance planes differently (scaler, range expansion), but they have to stay close to the OpenCV ones
+        if video_reader == 'pyav':
+            pytest.importorskip('av')
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}]
+        metrics_list = ['temporal_dct', 'temporal_gaussian_mse']
+        samples = {}
+        for reader in ['opencv', video_reader]:
+            np.random.seed(123)
+            asset_processor = VideoAssetProcessor(master, renditions, metrics_list, max_samples=10, video_reader=reader, luminance_plane='y')
+            # no color metrics requested, so BGR samples shouldn't be kept
+            assert len(asset_processor.master_samples) == 0
+            metrics_df, _, _ = asset_processor.process()
+            assert np.all(np.isfinite(metrics_df['temporal_dct-mean'].astype(np.float64)))
+            samples[reader] = asset_processor.master_samples_luma.astype(np.float64)
+        assert samples['opencv'].shape == samples[video_reader].shape
+        assert np.mean(np.abs(samples['opencv'] - samples[video_reader])) < 3
+
+    def run(self, luminance_plane):
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}, {'path': 'testing/tests/data/rend_4s_1080_adv_attack.mp4'}]
+        np.random.seed(123)
+        asset_processor = VideoAssetProcessor(master, renditions, self.metrics_list, max_samples=10, luminance_plane=luminance_plane)
+        metrics_df, _, _ = asset_processor.process()
+        return metrics_df
+
+    @staticmethod
+    def deviations(expected, actual, metrics_list):
+        # relative deviation of mean values of each metric, per rendition
+        return {metric: np.abs(actual[f'{metric}-mean'].astype(np.float64) - expected[f'{metric}-mean'].astype(np.float64)) /
+                np.maximum(np.abs(expected[f'{metric}-mean'].astype(np.float64)), 1e-12) for metric in metrics_list}
+
+    def test_y_not_a_substitute_for_hsv_v(self):
+        # on color footage Y plane metrics are far from hsv_v ones, which is why verification refuses luminance_plane='y'
+        expected = self.run('hsv_v')
+        actual = self.run('y')
+        deviations = self.deviations(expected, actual, self.metrics_list)
+        # metrics models rely on most are off by more than 10%, some by orders of magnitude
+        within_tolerance = [metric for metric, deviation in deviations.items() if np.all(deviation < 0.1)]
+        assert 'temporal_dct' not in within_tolerance and 'temporal_gaussian_mse' not in within_tolerance
+        assert len(within_tolerance) < len(self.metrics_list) / 2
+        with pytest.raises(ValueError):
+            Verifier(10, 'model', False, False, False, luminance_plane='y')
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from scripts.asset_processor import VideoAssetProcessor, MasterSampleCache
+
+
+class TestMasterCache:
+
+    def test_reuse_source_samples(self):
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        metrics_list = ['temporal_dct', 'temporal_gaussian_mse']
+        cache = MasterSampleCache(512 * 1024 ** 2)
+        results = []
+        for rendition in ['testing/tests/data/rend_4s_720_bw.mp4', 'testing/tests/data/rend_4s_1080_adv_attack.mp4']:
+            np.random.seed(123)
+            asset_processor = VideoAssetProcessor(master, [{'path': rendition}], metrics_list, max_samples=10, master_cache=cache)
+            metrics_df, _, _ = asset_processor.process()
+            results.append(metrics_df)
+        assert cache.hits == 1 and cache.misses == 1
+        # same samples must be used without cache
+        np.random.seed(123)
+        asset_processor = VideoAssetProcessor(master, [{'path': 'testing/tests/data/rend_4s_1080_adv_attack.mp4'}], metrics_list, max_samples=10)
+        metrics_df, _, _ = asset_processor.process()
+        for metric in ['temporal_dct-mean', 'temporal_gaussian_mse-mean']:
+            assert np.isclose(float(metrics_df[metric].iloc[0]), float(results[1][metric].iloc[0]))
+
+    def test_lru_eviction(self):
+        cache = MasterSampleCache(250)
+        for key in ['a', 'b']:
+            cache.put(key, {'samples': np.zeros(100, np.uint8)})
+        cache.get('a')
+        cache.put('c', {'samples': np.zeros(100, np.uint8)})
+        assert list(cache.entries) == ['a', 'c']
+        assert cache.bytes == 200
+        # entries larger than the cache are not stored
+        cache.put('d', {'samples': np.zeros(300, np.uint8)})
+        assert 'd' not in cache.entries
+
+    def test_key_covers_whole_content(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            paths = [os.path.join(tmp_dir, name) for name in ['a.mp4', 'b.mp4']]
+            with open('testing/tests/data/master_2s_1080.mp4', 'rb') as f:
+                data = bytearray(f.read())
+            with open(paths[0], 'wb') as f:
+                f.write(data)
+            # same size, head and tail, different bytes in the middle
+            data[len(data) // 2] ^= 0xFF
+            with open(paths[1], 'wb') as f:
+                f.write(data)
+            keys = [MasterSampleCache.key(path, (10,), ['temporal_dct']) for path in paths]
+            assert keys[0] != keys[1]
+            assert MasterSampleCache.key(paths[0], (10,), ['temporal_dct']) == keys[0]
+        finally:
+            shutil.rmtree(tmp_dir)
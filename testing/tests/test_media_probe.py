@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import cv2
+from scripts.asset_processor import MediaProbe, VideoCapture
+
+
+class TestMediaProbe:
+    files = ['testing/tests/data/master_4s_1080.mp4', 'testing/tests/data/rend_4s_720_bw.mp4']
+
+    def test_opencv_parity(self):
+        for path in self.files:
+            probe = MediaProbe.probe(path)
+            cap = cv2.VideoCapture(path)
+            try:
+                assert probe.fps == cap.get(cv2.CAP_PROP_FPS)
+                assert probe.frame_count == int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                assert probe.width == int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                assert probe.height == int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            finally:
+                cap.release()
+            assert probe.has_video and not probe.has_audio
+            assert probe.size == os.path.getsize(path)
+
+    def test_memoized_and_persisted(self):
+        probes = {}
+        probe = MediaProbe.get(self.files[0], probes)
+        assert MediaProbe.get(os.path.abspath(self.files[0]), probes) is probe
+        # captures reuse the probe instead of reading metadata again
+        cap = VideoCapture(self.files[0], use_gpu=False, video_reader='ffmpeg_bgr', probe=probe)
+        try:
+            assert (cap.fps, cap.frame_count, cap.width, cap.height) == (probe.fps, probe.frame_count, probe.width, probe.height)
+        finally:
+            cap.release()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            MediaProbe.load(self.files[0], tmp_dir)
+            assert len(os.listdir(tmp_dir)) == 1
+            assert MediaProbe.load(self.files[0], tmp_dir).to_dict() == probe.to_dict()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_header_probes_replaced_for_decoding(self):
+        probes = {}
+        probe = MediaProbe.get(self.files[1], probes, headers=True)
+        assert probe.headers
+        assert MediaProbe.get(self.files[1], probes, headers=True) is probe
+        # readers get decode geometry from ffprobe
+        decoding_probe = MediaProbe.get(self.files[1], probes)
+        assert not decoding_probe.headers and decoding_probe.to_dict() == MediaProbe.probe(self.files[1]).to_dict()
+        assert MediaProbe.get(self.files[1], probes, headers=True) is decoding_probe
+        cap = VideoCapture(self.files[1], use_gpu=False, video_reader='ffmpeg_bgr', probe=probe)
+        try:
+            assert not cap.probe.headers
+        finally:
+            cap.release()
@@ -0,0 +1,115 @@
+import pickle
+import threading
+import numpy as np
+import pytest
+from scripts.asset_processor import VideoAssetProcessor, MetricExecutor, SharedFrames
+from scripts.asset_processor.frame_ring import shared_memory
+
+
+class TestMetricExecutor:
+
+    metrics_list = ['temporal_dct', 'temporal_gaussian_mse', 'temporal_histogram_distance', 'temporal_entropy', 'hash_hamming']
+
+    def test_split(self):
+        assert MetricExecutor('threads', 4).split(self.metrics_list, 10) == (self.metrics_list, [])
+        assert MetricExecutor('processes', 4).split(self.metrics_list, 10) == ([], self.metrics_list)
+        # entropy and hashes are computed in Python, the rest in native code releasing the GIL
+        assert MetricExecutor('auto', 4).split(self.metrics_list, 10) == (['temporal_dct', 'temporal_gaussian_mse', 'temporal_histogram_distance'],
+                                                                         ['temporal_entropy', 'hash_hamming'])
+        # not worth it for a single worker or a few pairs
+        assert MetricExecutor('auto', 1).split(self.metrics_list, 10) == (self.metrics_list, [])
+        assert MetricExecutor('auto', 4).split(self.metrics_list, 1) == (self.metrics_list, [])
+        with pytest.raises(ValueError):
+            MetricExecutor('gpu')
+
+    def test_chunks(self):
+        assert MetricExecutor('processes', 4).chunks(10) == [[0, 1, 2], [3, 4, 5], [6, 7], [8, 9]]
+        assert MetricExecutor('processes', 4).chunks(2) == [[0], [1]]
+
+    def test_cpu_share(self, monkeypatch):
+        monkeypatch.setattr('multiprocessing.cpu_count', lambda: 16)
+        monkeypatch.setenv('WEB_CONCURRENCY', '8')
+        # pools of all server processes together use the host CPUs once
+        assert MetricExecutor.cpu_share() == 2
+        assert MetricExecutor().threads == 2 and MetricExecutor().max_workers == 2
+        assert MetricExecutor(threads=3).threads == 3
+        monkeypatch.setenv('WEB_CONCURRENCY', '32')
+        assert MetricExecutor.cpu_share() == 1
+        monkeypatch.delenv('WEB_CONCURRENCY')
+        assert MetricExecutor.cpu_share() == 16
+
+    @pytest.mark.skipif(shared_memory is None, reason='Python 3.8+ required')
+    def test_shared_frames(self):
+        frames = np.random.randint(0, 256, (3, 27, 48, 3), dtype=np.uint8)
+        planes = np.random.randint(0, 256, (3, 27, 48), dtype=np.uint8)
+        shared = SharedFrames({'frames': frames, 'planes': planes, 'hd': None})
+        try:
+            attached = pickle.loads(pickle.dumps(shared))
+            assert np.array_equal(attached.get('frames'), frames)
+            assert np.array_equal(attached.get('planes'), planes)
+            assert attached.get('hd') is None
+            attached.close()
+        finally:
+            shared.close()
+
+    @pytest.mark.skipif(shared_memory is None, reason='Python 3.8+ required')
+    @pytest.mark.parametrize('luminance_plane', ['hsv_v', 'y'])
+    def test_processes_parity(self, luminance_plane):
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}]
+        metrics_list = self.metrics_list + ['temporal_psnr']
+        results = {}
+        for mode in ['threads', 'processes']:
+            np.random.seed(123)
+            metric_executor = MetricExecutor(mode, 2)
+            asset_processor = VideoAssetProcessor(master, renditions, metrics_list, max_samples=10, luminance_plane=luminance_plane,
+                                                  metric_executor=metric_executor)
+            metrics_df, _, _ = asset_processor.process()
+            metric_executor.shutdown()
+            results[mode] = metrics_df
+        for column in results['threads'].columns:
+            if column.startswith(('temporal_', 'hash_')) and not column.endswith('-series'):
+                assert np.allclose(results['threads'][column].astype(np.float64), results['processes'][column].astype(np.float64),
+                                   equal_nan=True), column
+
+    def test_bounded_queue(self):
+        metric_executor = MetricExecutor(threads=1, max_queue=1)
+        release = threading.Event()
+        futures = [metric_executor.submit_thread(release.wait), metric_executor.submit_thread(release.wait)]
+        submitted = threading.Event()
+
+        def submit():
+            futures.append(metric_executor.submit_thread(lambda: 42))
+            submitted.set()
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        # a job is running and another is waiting, so the third one can't be queued yet
+        assert not submitted.wait(0.2)
+        stats = metric_executor.stats()
+        assert stats['running'] == 1 and stats['queued'] == 1
+        release.set()
+        thread.join()
+        assert futures[-1].result() == 42
+        metric_executor.shutdown()
+        stats = metric_executor.stats()
+        assert stats['completed'] == 3 and stats['queued'] == 0 and stats['running'] == 0
+        assert 0 < stats['utilization'] <= 1
+
+    def test_default_reused(self):
+        metric_executor = MetricExecutor(threads=2)
+        MetricExecutor.set_default(metric_executor)
+        try:
+            master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+            renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}]
+            thread_executors = []
+            for _ in range(2):
+                asset_processor = VideoAssetProcessor(master, renditions, ['temporal_dct'], max_samples=4)
+                assert asset_processor.metric_executor is metric_executor
+                asset_processor.process()
+                thread_executors.append(metric_executor.thread_executor)
+            # the same threads served both requests, source and rendition samples of each
+            assert thread_executors[0] is not None and thread_executors[0] is thread_executors[1]
+            assert metric_executor.stats()['completed'] == 2 * 2 * 3
+        finally:
+            MetricExecutor.set_default(None)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from scripts.asset_processor import VideoMetrics, FrameFeatures, Feature, Metric, MetricPlan
+
+
+class TestMetricRegistry:
+
+    def test_plan(self):
+        plan = MetricPlan.build(['temporal_gaussian_mse', 'temporal_gaussian_mse', 'audio_dist', 'temporal_difference'],
+                                VideoMetrics.METRICS, VideoMetrics.FEATURES)
+        # duplicates and metrics computed elsewhere are dropped
+        assert list(plan.metrics) == ['temporal_gaussian_mse', 'temporal_difference']
+        # features are listed once, after features they depend on
+        assert plan.features == [('reference', 'plane'), ('reference', 'gaussian'), ('rendition', 'plane'), ('rendition', 'gaussian'),
+                                 ('next_rendition', 'plane')]
+        assert plan.cost > 0
+        assert VideoMetrics.plan(['temporal_dct']) is VideoMetrics.plan(['temporal_dct'])
+
+    def test_circular_dependency(self):
+        features = {'a': Feature(None, 'b'), 'b': Feature(None, 'a')}
+        with pytest.raises(ValueError):
+            MetricPlan.build(['m'], {'m': Metric(None, {'value': ('reference', 'a')})}, features)
+
+    def test_only_required_features(self):
+        np.random.seed(3)
+        frames = [FrameFeatures(np.random.randint(0, 256, (270, 480, 3), dtype=np.uint8)) for _ in range(4)]
+        video_metrics = VideoMetrics(['temporal_mse'], 16, 270, None, False)
+        values = video_metrics.compute_metrics(None, None, None, None, features=tuple(frames))
+        assert list(values) == ['temporal_mse']
+        # neither Gaussian filters, nor hashes, nor planes of next frames were computed
+        assert [list(f.features) for f in frames] == [['plane'], [], ['plane'], []]
+
+    def test_registered_metrics(self):
+        np.random.seed(4)
+        frames = [np.random.randint(0, 256, (270, 480, 3), dtype=np.uint8) for _ in range(4)]
+        hd_frames = [np.random.randint(0, 256, (540, 960, 3), dtype=np.uint8) for _ in range(2)]
+        # BRISQUE needs opencv-contrib, SSIM of color frames depends on scikit-image version
+        metrics_list = [metric for metric in VideoMetrics.METRICS if metric not in ['temporal_brisque', 'temporal_ssim']]
+        video_metrics = VideoMetrics(metrics_list, 16, 270, None, False)
+        values = video_metrics.compute_metrics(*frames, *hd_frames)
+        assert list(values) == metrics_list
+        assert all(np.all(np.isfinite(value)) for value in values.values())
+        assert values['temporal_spatial_complexity'] == VideoMetrics.spatial_complexity(VideoMetrics.hsv_v(frames[2]))
@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+from sklearn.metrics import mean_squared_error
+from scripts.asset_processor import VideoAssetProcessor, VideoMetrics
+
+
+def sample_frames(path, count):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    for _ in range(count):
+        _, frame = capture.read()
+        frames.append(cv2.resize(frame, VideoAssetProcessor.FRAME_SIZE))
+    capture.release()
+    return np.array(frames)
+
+
+class TestOpencvGaussian:
+
+    metrics_list = ['temporal_gaussian_mse', 'temporal_gaussian_difference', 'temporal_threshold_gaussian_difference']
+    reference = sample_frames('testing/tests/data/master_4s_1080.mp4', 5)
+    rendition = sample_frames('testing/tests/data/rend_4s_720_bw.mp4', 5)
+
+    def test_filter(self):
+        plane = VideoMetrics.hsv_v(self.reference[0])
+        video_metrics = VideoMetrics(self.metrics_list, 16, 270, None, False)
+        expected = video_metrics.gaussian_filter(plane)
+        actual = video_metrics.gaussian_filter_fast(plane)
+        assert actual.dtype == np.float32
+        assert np.allclose(actual, expected, atol=1e-6)
+        assert np.array_equal(VideoMetrics.gaussian_batch_fast(plane[np.newaxis])[0], actual)
+        other = video_metrics.gaussian_filter(VideoMetrics.hsv_v(self.rendition[0]))
+        assert np.isclose(VideoMetrics.gaussian_mse(expected, other), mean_squared_error(expected, other), rtol=1e-12)
+
+    def test_metrics_within_tolerance(self):
+        default = VideoMetrics(self.metrics_list, 16, 270, None, False)
+        fast = VideoMetrics(self.metrics_list, 16, 270, None, False, ['opencv_gaussian'])
+        for i in range(4):
+            frames = (self.rendition[i], self.rendition[i + 1], self.reference[i], self.reference[i + 1])
+            expected = default.compute_metrics(*frames)
+            actual = fast.compute_metrics(*frames)
+            assert np.isclose(actual['temporal_gaussian_mse'], expected['temporal_gaussian_mse'], rtol=1e-5)
+            assert np.isclose(actual['temporal_gaussian_difference'], expected['temporal_gaussian_difference'], rtol=1e-5)
+            # pixels close to the threshold may fall on either side of it
+            assert np.isclose(actual['temporal_threshold_gaussian_difference'], expected['temporal_threshold_gaussian_difference'], rtol=1e-3)
+
+    def test_batch_matches_per_pair(self):
+        fast = VideoMetrics(self.metrics_list, 16, 270, None, False, ['opencv_gaussian'])
+        expected = [fast.compute_metrics(self.rendition[i], self.rendition[i + 1], self.reference[i], self.reference[i + 1]) for i in range(4)]
+        reference = VideoMetrics.hsv_v_batch(self.reference)
+        rendition = VideoMetrics.hsv_v_batch(self.rendition)
+        actual = fast.compute_metrics_batch(rendition[:-1], rendition[1:], reference[:-1], reference[1:])
+        for metric, values in actual.items():
+            assert np.allclose(values, [e[metric] for e in expected], rtol=1e-5), metric
@@ -0,0 +1,42 @@
+import numpy as np
+from scripts.asset_processor import PacketTimestamps, FrameIndex, VideoCapture
+
+
+class TestPacketTimestamps:
+
+    def test_release_in_presentation_order(self):
+        # IBBP-like reordering: packets come in decoding order, pts is never less than dts
+        pts = np.arange(300) / 30
+        decode_order = []
+        for gop in range(0, 300, 4):
+            decode_order += [gop + 3, gop, gop + 1, gop + 2] if gop + 3 < 300 else list(range(gop, 300))
+        timestamps = PacketTimestamps('video.mp4')
+        for i, frame in enumerate(decode_order):
+            timestamps.feed(str(pts[frame] + 0.1), str(pts[i]))
+            # released timestamps are final
+            assert np.allclose(timestamps.values[:timestamps.count], pts[:timestamps.count] + 0.1)
+        assert len(timestamps) > 290
+        timestamps.finish()
+        assert np.allclose(timestamps.values[:len(timestamps)], pts + 0.1)
+        assert timestamps.get(299) == pts[299] + 0.1
+
+    def test_matches_frame_index(self):
+        filename = 'testing/tests/data/master_4s_1080.mp4'
+        timestamps = PacketTimestamps(filename)
+        timestamps.start()
+        index = FrameIndex.build(filename)
+        assert timestamps.get(len(index) - 1) == index.pts[-1]
+        timestamps.stop()
+        assert np.allclose(timestamps.values[:len(timestamps)], index.pts)
+
+    def test_ffmpeg_reader_timestamps(self):
+        filename = 'testing/tests/data/rend_4s_720_bw.mp4'
+        capture = VideoCapture(filename, video_reader='ffmpeg_bgr', frame_size=(480, 270), keep_hd=False)
+        index_capture = VideoCapture(filename, video_reader='ffmpeg_bgr', frame_size=(480, 270), keep_hd=False, use_index=True)
+        try:
+            for _ in range(capture.frame_count):
+                frame, index_frame = capture.read(grab=True), index_capture.read(grab=True)
+                assert np.isclose(frame.timestamp, index_frame.timestamp)
+        finally:
+            capture.release()
+            index_capture.release()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from scripts.asset_processor import VideoAssetProcessor, VideoCapture, FrameIndex, frame_index
+
+pd.options.display.width = 0
+pd.set_option('display.max_columns', None)
+
+
+class TestSparseDecoding:
+
+    def test_frame_index(self):
+        filename = 'testing/tests/data/master_2s_1080.mp4'
+        cap = VideoCapture(filename, video_reader='opencv')
+        index = cap.frame_index
+        timestamps = []
+        while True:
+            f = cap.read(grab=True)
+            if f is None:
+                break
+            timestamps.append(f.timestamp)
+        cap.release()
+        assert index.keyframe_before(0) == 0
+        assert all(np.isclose(index.pts[:len(timestamps)], timestamps, atol=0.001))
+
+    def test_frame_index_sidecar(self):
+        filename = 'testing/tests/data/master_2s_1080.mp4'
+        cache_dir = tempfile.mkdtemp()
+        try:
+            built = FrameIndex.load(filename, cache_dir)
+            loaded = FrameIndex._read_sidecar(filename, f'{cache_dir}/{FrameIndex.content_key(filename)}.fidx')
+            assert loaded is not None
+            assert np.array_equal(built.packets, loaded.packets)
+            assert built.start_time == loaded.start_time
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_frame_index_cache_bounded(self):
+        filename = 'testing/tests/data/master_2s_1080.mp4'
+        assert FrameIndex.CACHE_DIR is None
+        cache_dir = tempfile.mkdtemp()
+        try:
+            stale = []
+            for i in range(3):
+                path = os.path.join(cache_dir, f'{i}.fidx')
+                with open(path, 'wb') as f:
+                    f.write(bytes(1000))
+                os.utime(path, (i, i))
+                stale.append(path)
+            FrameIndex.load(filename, cache_dir)
+            sidecar = f'{cache_dir}/{FrameIndex.content_key(filename)}.fidx'
+            FrameIndex.evict(cache_dir, os.path.getsize(sidecar) + 1500)
+            # least recently used sidecars are deleted first
+            assert sorted(os.listdir(cache_dir)) == sorted([os.path.basename(stale[2]), os.path.basename(sidecar)])
+        finally:
+            shutil.rmtree(cache_dir)
+        size = FrameIndex.CONTENT_KEYS_SIZE
+        try:
+            FrameIndex.CONTENT_KEYS_SIZE = 2
+            for path in ['testing/tests/data/master_4s_1080.mp4', 'testing/tests/data/rend_2s_720_bw.mp4', filename]:
+                FrameIndex.content_key(path)
+            assert len(frame_index._content_keys) == 2
+        finally:
+            FrameIndex.CONTENT_KEYS_SIZE = size
+
+    def test_sparse_samples_match_sequential(self):
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}]
+        metrics_list = ['temporal_dct', 'temporal_gaussian_mse']
+        results = []
+        for sparse in [False, True]:
+            np.random.seed(123)
+            asset_processor = VideoAssetProcessor(master, renditions, metrics_list, max_samples=10, sparse_decoding=sparse)
+            metrics_df, _, _ = asset_processor.process()
+            results.append((asset_processor.master_samples, metrics_df))
+        assert np.array_equal(results[0][0], results[1][0])
+        for metric in ['temporal_dct-mean', 'temporal_gaussian_mse-mean']:
+            assert np.isclose(results[0][1][metric].iloc[0], results[1][1][metric].iloc[0])
+
+    def test_concurrent_decoding_matches_sequential(self):
+        master = {'path': 'testing/tests/data/master_4s_1080.mp4'}
+        renditions = [{'path': 'testing/tests/data/rend_4s_720_bw.mp4'}, {'path': 'testing/tests/data/rend_4s_1080_adv_attack.mp4'}]
+        metrics_list = ['temporal_dct', 'temporal_gaussian_mse']
+        results = []
+        for sparse, workers, processes in [(False, 1, False), (False, 2, False), (True, 2, False), (True, 2, True)]:
+            np.random.seed(123)
+            asset_processor = VideoAssetProcessor(master, renditions, metrics_list, max_samples=10, sparse_decoding=sparse,
+                                                  decode_workers=workers, decode_processes=processes)
+            metrics_df, _, _ = asset_processor.process()
+            results.append(metrics_df)
+        for metrics_df in results[1:]:
+            for metric in ['temporal_dct-mean', 'temporal_gaussian_mse-mean']:
+                assert np.allclose(results[0][metric].astype(np.float64), metrics_df[metric].astype(np.float64))
@@ -0,0 +1,41 @@
+import numpy as np
+from scripts.asset_processor import TimestampAligner
+
+
+class TestTimestampAligner:
+
+    @staticmethod
+    def _match_sequentially(master_timestamps, timestamps, tolerance):
+        # reference implementation, scans all master samples for each frame
+        diffs = [np.inf] * len(master_timestamps)
+        frames = [-1] * len(master_timestamps)
+        for frame_idx, ts in enumerate(timestamps):
+            ts_diffs = [abs(ts - mts) for mts in master_timestamps]
+            best_match_idx = int(np.argmin(ts_diffs))
+            best_match = ts_diffs[best_match_idx]
+            if best_match < tolerance and diffs[best_match_idx] > best_match:
+                diffs[best_match_idx] = best_match
+                frames[best_match_idx] = frame_idx
+        return np.array(frames), np.array(diffs)
+
+    def test_align_matches_sequential_scan(self):
+        np.random.seed(42)
+        master_pts = np.arange(600) / 60
+        master_timestamps = np.random.choice(master_pts, 50, False)
+        for fps in [24, 30, 60]:
+            # rendition with different frame rate and some timestamp jitter
+            pts = np.arange(int(10 * fps)) / fps + np.random.uniform(-0.002, 0.002, int(10 * fps))
+            tolerance = 1 / (2 * fps)
+            expected_frames, expected_diffs = self._match_sequentially(master_timestamps, pts, tolerance)
+            aligner = TimestampAligner(master_timestamps, tolerance)
+            frames, diffs = aligner.align(pts)
+            assert np.array_equal(expected_frames, frames)
+            assert np.allclose(expected_diffs, diffs)
+            for frame_idx, ts in enumerate(pts):
+                sample_idx, diff = aligner.match_one(ts)
+                assert sample_idx == -1 or frames[sample_idx] != frame_idx or np.isclose(diff, diffs[sample_idx])
+
+    def test_per_sample_tolerance(self):
+        aligner = TimestampAligner([1.0, 2.0], [0.1, 0.01])
+        frames, _ = aligner.align([1.05, 2.05])
+        assert list(frames) == [0, -1]
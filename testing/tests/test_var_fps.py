@@ -4,6 +4,9 @@ import random
 import numpy as np
 import pandas as pd
 import os
+import shutil
+import subprocess
+import tempfile
 import tqdm
 import glob
 from verifier import Verifier
@@ -38,6 +41,60 @@ class TestVarFps:
         ffmpeg_ts = cap.timestamps
         assert all(np.isclose(ffmpeg_ts, opencv_ts, atol=0.001))
 
+    def test_pyav_pts_validity(self):
+        pytest.importorskip('av')
+        filename = 'testing/tests/data/0fIdY5IAnhY_60.mp4'
+        timestamps = {}
+        for reader in ['opencv', 'pyav']:
+            cap = VideoCapture(filename, video_reader=reader)
+            while True:
+                f = cap.read(grab=True)
+                if f is None:
+                    break
+            cap.release()
+            timestamps[reader] = cap.timestamps
+        assert len(timestamps['pyav']) == len(timestamps['opencv'])
+        assert all(np.isclose(timestamps['pyav'], timestamps['opencv'], atol=0.001))
+
+    def test_pyav_missing_pts(self):
+        pytest.importorskip('av')
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # raw H.264 stream has no timestamps, frames are spaced by frame duration
+            filename = os.path.join(tmp_dir, 'master.h264')
+            subprocess.check_call(['ffmpeg', '-loglevel', 'error', '-i', 'testing/tests/data/master_2s_1080.mp4', '-c', 'copy', '-bsf:v', 'h264_mp4toannexb',
+                                   '-f', 'h264', filename])
+            cap = VideoCapture(filename, video_reader='pyav')
+            while cap.read(grab=True) is not None:
+                pass
+            cap.release()
+            assert len(cap.timestamps) > 1
+            assert np.allclose(np.diff(cap.timestamps), 1 / cap.fps)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_index_pts_validity(self):
+        filename = 'testing/tests/data/0fIdY5IAnhY_60.mp4'
+        # read timestamps streamed by ffprobe
+        cap = VideoCapture(filename, video_reader='ffmpeg_bgr')
+        while True:
+            f = cap.read()
+            if f is None:
+                break
+        cap.release()
+        ffmpeg_ts = cap.timestamps
+        # read timestamps from frame index
+        cap = VideoCapture(filename, video_reader='ffmpeg_bgr', use_index=True)
+        index_ts = []
+        while True:
+            f = cap.read()
+            if f is None:
+                break
+            index_ts.append(f.timestamp)
+        cap.release()
+        assert len(index_ts) == len(ffmpeg_ts)
+        assert all(np.isclose(ffmpeg_ts, index_ts, atol=0.001))
+
     @pytest.mark.usefixtures("check_dataset")
     def test_classification(self):
         source_dir = '../data/renditions/1080p/'
@@ -0,0 +1,72 @@
+"""
+Deterministic checks of rendition metadata, rejecting clearly tampered renditions before decoding
+"""
+import logging
+
+logger = logging.getLogger()
+
+
+class RejectRules:
+    """
+    Compares metadata read from container headers of a rendition with the source and with values declared by the broadcaster.
+    Renditions failing any enabled rule are reported as tampered with a reason code, without decoding or running models.
+    Tolerances are relative and only cover legitimate transcoding differences, e.g. a frame more or less at segment boundaries.
+    """
+    RESOLUTION_MISMATCH = 'resolution_mismatch'
+    FRAME_RATE_MISMATCH = 'frame_rate_mismatch'
+    DURATION_MISMATCH = 'duration_mismatch'
+    PIXELS_MISMATCH = 'pixels_mismatch'
+    RULES = [RESOLUTION_MISMATCH, FRAME_RATE_MISMATCH, DURATION_MISMATCH, PIXELS_MISMATCH]
+    # reason of remote renditions whose downloaded copy differs from the checked headers, see Verifier.fetch_rendition()
+    CONTENT_CHANGED = 'content_changed'
+
+    def __init__(self, rules=None, resolution_tolerance: float = 0.01, duration_tolerance: float = 0.1, pixels_tolerance: float = 0.1):
+        """
+
+        @param rules: list of enabled rules, or comma separated string of them, all by default
+        @param resolution_tolerance: max relative difference of width and height from declared resolution
+        @param duration_tolerance: max relative difference of duration from source duration
+        @param pixels_tolerance: max relative difference of total pixels from declared pixels
+        """
+        if rules is None:
+            rules = self.RULES
+        elif isinstance(rules, str):
+            rules = [rule.strip() for rule in rules.split(',') if rule.strip()]
+        unknown = set(rules) - set(self.RULES)
+        if unknown:
+            raise ValueError(f'Unknown reject rules: {sorted(unknown)}')
+        self.rules = list(rules)
+        self.resolution_tolerance = resolution_tolerance
+        self.duration_tolerance = duration_tolerance
+        self.pixels_tolerance = pixels_tolerance
+
+    def check(self, source: dict, rendition: dict, metadata: dict):
+        """
+        Applies enabled rules to a pre-verified rendition
+        @param source: source dict with metadata, see Verifier.read_video_metadata()
+        @param rendition: rendition dict after pre-verification
+        @param metadata: rendition metadata, see Verifier.read_video_metadata()
+        @return: reason code of the first failed rule, None if the rendition is plausible
+        """
+        for rule in self.rules:
+            if getattr(self, f'_{rule}')(source, rendition, metadata):
+                return rule
+        return None
+
+    def _resolution_mismatch(self, source, rendition, metadata):
+        resolution = rendition.get('resolution')
+        if not resolution or 'height_pre_verification' not in resolution:
+            return False
+        return any(abs(resolution[key] - 1) > self.resolution_tolerance for key in ['height_pre_verification', 'width_pre_verification'])
+
+    def _frame_rate_mismatch(self, source, rendition, metadata):
+        # pre-verification replaces declared frame rate with the result of comparison
+        return rendition.get('frame_rate') is False
+
+    def _duration_mismatch(self, source, rendition, metadata):
+        return abs(metadata['duration'] - source['duration']) > self.duration_tolerance * source['duration']
+
+    def _pixels_mismatch(self, source, rendition, metadata):
+        if 'pixels_pre_verification' not in rendition:
+            return False
+        return abs(rendition['pixels_pre_verification'] - 1) > self.pixels_tolerance
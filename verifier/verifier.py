@@ -9,24 +9,34 @@ import tarfile
 import os
 import sys
 import urllib
-import subprocess
 import logging
 from joblib import load
 import numpy as np
 import pandas as pd
 import cv2
-from scipy.io import wavfile
 from catboost import CatBoostClassifier
 from catboost import CatBoostRegressor
 from verifier import file_locker
+from verifier.reject_rules import RejectRules
 
 from scripts.asset_processor.video_asset_processor import VideoAssetProcessor
+from scripts.asset_processor.video_metrics import VideoMetrics
+from scripts.asset_processor.live_asset_processor import LiveAssetProcessor
+from scripts.asset_processor.audio_reader import AudioReader
+from scripts.asset_processor.audio_comparator import AudioComparator
+from scripts.asset_processor.media_probe import MediaProbe
+from scripts.asset_processor.master_cache import MasterSampleCache
+from scripts.asset_processor.metric_executor import MetricExecutor
 
 logger = logging.getLogger()
 
 
 class Verifier:
-    def __init__(self, max_samples, model, use_gpu, do_profiling, debug):
+    # length of audio windows compared around each video sample, seconds
+    AUDIO_WINDOW = 1.0
+
+    def __init__(self, max_samples, model, use_gpu, do_profiling, debug, sparse_decoding=False, video_reader='opencv', luminance_plane='hsv_v', decode_workers=1, master_cache_size=0, frame_memory_budget=0,
+                 compute_audio_dist=None, reject_rules: RejectRules = None, metric_executor: MetricExecutor = None, metric_backends: list = None):
         """
         Initialize verifier instance
         @param max_samples: Max number of samples to take for a video
@@ -34,9 +44,27 @@ class Verifier:
         @param use_gpu: Use GPU for video decoding and computations
         @param do_profiling: Output execution times to logs
         @param debug: Enable debug image output, greatly reduces performance
+        @param sparse_decoding: Decode only GOPs containing sampled frames instead of whole videos
+        @param video_reader: Video decoding backend, see VideoCapture
+        @param luminance_plane: Plane luminance metrics are computed on, see VideoAssetProcessor. Only 'hsv_v', which models were trained on, is supported.
+        @param decode_workers: Max number of renditions decoded concurrently
+        @param master_cache_size: Max size in bytes of source samples cached between verifications of the same source, 0 disables caching
+        @param frame_memory_budget: Max size in bytes of full resolution samples kept per verification, see VideoAssetProcessor
+        @param compute_audio_dist: Compare audio of renditions to the source. None = only if models use audio_dist feature
+        @param reject_rules: Rules to reject renditions by their metadata before decoding, None disables fast rejection
+        @param metric_executor: Thread and process pools metrics are computed in, reused by all verifications, see MetricExecutor. None = process-wide default executor.
+        @param metric_backends: Names of VideoMetrics.BACKENDS to compute metrics with instead of default implementations, e.g. 'opencv_gaussian'
         """
+        if luminance_plane != 'hsv_v':
+            raise ValueError(f'Luminance plane {luminance_plane} is not supported by verification models, which were trained on hsv_v')
         self.use_gpu = use_gpu
         self.debug = debug
+        self.sparse_decoding = sparse_decoding
+        self.video_reader = video_reader
+        self.luminance_plane = luminance_plane
+        self.decode_workers = decode_workers
+        self.master_cache = MasterSampleCache(master_cache_size) if master_cache_size else None
+        self.frame_memory_budget = frame_memory_budget
         self.model_dir = '/tmp/model'
         if os.path.isdir(model):
             self.model_dir = model
@@ -45,56 +73,52 @@ class Verifier:
         self.max_samples = max_samples
         self.do_profiling = do_profiling
         self.tmp_files = []
+        self.metric_backends = list(metric_backends or [])
         self.load_models()
+        logger.info(f'Metrics plan: {VideoMetrics.plan(self.get_metrics_list()[1], self.metric_backends)}')
+        if compute_audio_dist is None:
+            compute_audio_dist = 'audio_dist' in self.features_ul + self.features_sl
+        self.compute_audio_dist = compute_audio_dist
+        self.reject_rules = reject_rules
+        self.metric_executor = metric_executor if metric_executor is not None else MetricExecutor.default()
 
     @staticmethod
-    def read_video_metadata(filename):
-        try:
-            res = {}
-            cap = cv2.VideoCapture(filename)
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            height = float(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            width = float(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            res['frame_rate'] = fps
-            res['resolution'] = {'width': width, 'height': height}
-            res['pixels'] = width * height * frame_count
-            res['duration'] = frame_count / fps
-            res['bitrate'] = os.path.getsize(filename) / res['duration']
-        finally:
-            cap.release()
-        return res
+    def read_video_metadata(probe: MediaProbe):
+        """
+        Video properties checked by pre-verification
+        @param probe: metadata of the video file
+        @return: dict of frame_rate, resolution, pixels, duration and bitrate
+        """
+        return probe.video_metadata()
 
-    def pre_verify(self, source, rendition):
+    def pre_verify(self, source, rendition, probes=None):
         """
         Function to verify that rendition conditions and specifications
         are met as prescribed by the Broadcaster
+        @param source: source dict
+        @param rendition: rendition dict
+        @param probes: dict of metadata of files probed within the request, see MediaProbe.get()
         """
-        # Extract data from video capture
-        video_file, audio_file = self.get_video_audio(rendition['uri'])
+        # With reject rules, renditions are checked by their container headers only, remote ones are downloaded once they pass fast rejection,
+        # see fetch_rendition(). Decoding probes them again with ffprobe.
+        remote = self.reject_rules is not None and rendition['uri'].lower().startswith('http')
+        video_file = rendition['uri'] if remote else self.get_video(rendition['uri'])
         rendition['video_available'] = video_file is not None
-        rendition['audio_available'] = audio_file is not None
+        rendition['audio_available'] = False
 
         if video_file:
-            # Check that the audio exists
-            if audio_file:
-                _, source_file_series = wavfile.read(source['audio_path'])
-                _, rendition_file_series = wavfile.read(audio_file)
-
-                try:
-                    # Compute the Euclidean distance between source's and rendition's signals
-                    rendition['audio_dist'] = np.linalg.norm(source_file_series - rendition_file_series)
-                except:
-                    # Set to negative to indicate an error during audio comparison
-                    # (matching floating-point datatype of Euclidean distance)
-                    rendition['audio_dist'] = -1.0
-                finally:
-                    # Cleanup the audio file generated to avoid cluttering
-                    os.remove(audio_file)
-
-            metadata = self.read_video_metadata(video_file)
-
-            rendition['path'] = video_file
+            try:
+                probe = MediaProbe.get(video_file, probes, headers=self.reject_rules is not None)
+            except Exception:
+                # files without readable video stream are rejected before decoding
+                logger.exception(f'Unable to read metadata of {video_file}')
+                rendition['video_available'] = False
+                return rendition
+            rendition['audio_available'] = probe.has_audio
+            metadata = self.read_video_metadata(probe)
+
+            if not remote:
+                rendition['path'] = video_file
 
             # Create dictionary with passed / failed verification parameters
             if rendition.get('resolution'):
@@ -113,6 +137,78 @@ class Verifier:
 
         return rendition
 
+    def fast_reject(self, source, rendition, probes):
+        """
+        Applies reject rules to a pre-verified rendition, marking it as tampered if any of them fails
+        @param source: source dict
+        @param rendition: pre-verified rendition dict
+        @param probes: dict of metadata of files probed within the request
+        @return: True if the rendition was rejected
+        """
+        if self.reject_rules is None:
+            return False
+        metadata = self.read_video_metadata(MediaProbe.get(rendition.get('path', rendition['uri']), probes, headers=True))
+        reason = self.reject_rules.check(source, rendition, metadata)
+        if reason is None:
+            return False
+        logger.info(f'Rendition {rendition["uri"]} rejected before decoding: {reason}')
+        rendition.pop('path', None)
+        rendition['tamper'] = 1
+        rendition['reject_reason'] = reason
+        return True
+
+    def fetch_rendition(self, rendition, probes):
+        """
+        Downloads a remote rendition which passed fast rejection.
+        The file may have changed since its headers were checked, so the downloaded copy is probed again and rejected if its metadata differs.
+        @param rendition: pre-verified rendition dict
+        @param probes: dict of metadata of files probed within the request
+        @return: True if the downloaded rendition was rejected
+        """
+        video_file = self.get_video(rendition['uri'])
+        rendition['video_available'] = video_file is not None
+        if not video_file:
+            return False
+        checked = MediaProbe.get(rendition['uri'], probes, headers=True)
+        # read the same way as the remote file, so that equal content gives equal values
+        probe = MediaProbe.get(video_file, probes, headers=checked.headers)
+        if probe.video_metadata() != checked.video_metadata():
+            logger.info(f'Rendition {rendition["uri"]} rejected after download: {RejectRules.CONTENT_CHANGED}')
+            rendition['tamper'] = 1
+            rendition['reject_reason'] = RejectRules.CONTENT_CHANGED
+            return True
+        rendition['path'] = video_file
+        return False
+
+    def compare_audio(self, source, renditions, timestamps):
+        """
+        Computes audio_dist of renditions, Euclidean distance between source and rendition audio, decoded in windows around given timestamps.
+        Without timestamps, whole tracks are compared as they are decoded.
+        @param source: source dict
+        @param renditions: pre-verified rendition dicts
+        @param timestamps: window centers, seconds
+        @return:
+        """
+        comparator = AudioComparator(AudioReader.SAMPLE_RATE)
+        source_audio = None
+        if len(timestamps):
+            source_audio = AudioReader(source['path']).read_windows(timestamps, self.AUDIO_WINDOW)
+        for rendition in renditions:
+            if not rendition['audio_available']:
+                continue
+            try:
+                if source_audio is not None:
+                    rendition_audio = AudioReader(rendition['path']).read_windows(timestamps, self.AUDIO_WINDOW)
+                    rendition['audio_dist'] = comparator.compare(source_audio, rendition_audio)
+                else:
+                    rendition['audio_dist'] = comparator.compare_streams(AudioReader(source['path']).stream(comparator.chunk_samples),
+                                                                         AudioReader(rendition['path']).stream(comparator.chunk_samples))
+            except Exception:
+                logger.exception(f'Unable to compare audio of {rendition["path"]}')
+                # Set to negative to indicate an error during audio comparison
+                # (matching floating-point datatype of Euclidean distance)
+                rendition['audio_dist'] = -1.0
+
     def meta_model(self, row):
         """
         The goal is to reduce the number of False Positives (tamper) to prevent wrongfully penalizing transcoder nodes. OCSVM model is expected to have higher precision (low FP) on novel data.
@@ -128,37 +224,40 @@ class Verifier:
         with respect to a given source file using a specified model.
         """
         total_start = timeit.default_timer()
-        source_video, source_audio = self.get_video_audio(source_uri)
-        if not source_video and not source_audio:
+        source_video = self.get_video(source_uri)
+        if not source_video:
             raise ValueError('Couldn\'t retrieve source files')
         try:
             if source_video:
+                # every file is probed once per request
+                probes = {}
+                source_probe = MediaProbe.get(source_video, probes)
                 # Prepare source and renditions for verification
                 source = {'path': source_video,
-                          'audio_path': source_audio,
                           'video_available': True,
-                          'audio_available': source_audio is not None,
+                          'audio_available': source_probe.has_audio,
                           'uri': source_uri}
 
                 # read source metadata
-                metadata = self.read_video_metadata(source_video)
+                metadata = self.read_video_metadata(source_probe)
                 source.update(metadata)
 
                 # Create a list of preverified renditions
                 pre_verified_renditions = []
                 for rendition in renditions:
-                    pre_verification = self.pre_verify(source, rendition)
+                    pre_verification = self.pre_verify(source, rendition, probes)
+                    if not rendition['video_available'] or self.fast_reject(source, pre_verification, probes):
+                        continue
+                    if 'path' not in pre_verification and self.fetch_rendition(pre_verification, probes):
+                        continue
                     if rendition['video_available']:
                         pre_verified_renditions.append(pre_verification)
 
-                # Remove non numeric features from feature list
-                non_temporal_features = ['attack_ID', 'title', 'attack', 'dimension', 'size', 'size_dimension_ratio']
-                metrics_list = []
-                features = list(np.unique(self.features_ul + self.features_sl))
+                if not pre_verified_renditions:
+                    # nothing left to decode
+                    return renditions
 
-                for metric in features:
-                    if metric not in non_temporal_features:
-                        metrics_list.append(metric.split('-')[0])
+                features, metrics_list = self.get_metrics_list()
 
                 # Initialize times for assets processing profiling
                 start = timeit.default_timer()
@@ -171,11 +270,24 @@ class Verifier:
                                                       self.max_samples,
                                                       features,
                                                       self.debug,
-                                                      self.use_gpu)
+                                                      self.use_gpu,
+                                                      sparse_decoding=self.sparse_decoding,
+                                                      video_reader=self.video_reader,
+                                                      luminance_plane=self.luminance_plane,
+                                                      decode_workers=self.decode_workers,
+                                                      master_cache=self.master_cache,
+                                                      frame_memory_budget=self.frame_memory_budget,
+                                                      probes=probes,
+                                                      metric_executor=self.metric_executor,
+                                                      metric_backends=self.metric_backends)
 
                 # Record time for class initialization
                 initialize_time = timeit.default_timer() - start
 
+                if self.compute_audio_dist and source['audio_available']:
+                    # audio is compared around the same timestamps video samples are taken at
+                    self.compare_audio(source, pre_verified_renditions, asset_processor.master_timestamps)
+
                 # Register times for asset processing
                 start = timeit.default_timer()
 
@@ -185,39 +297,13 @@ class Verifier:
                 # Record time for processing of assets metrics
                 process_time = timeit.default_timer() - start
 
-                x_renditions_sl = np.asarray(metrics_df[self.features_sl])
-                x_renditions_ul = np.asarray(metrics_df[self.features_ul])
-                x_renditions_ul = self.loaded_scaler.transform(x_renditions_ul)
-
-                np.set_printoptions(precision=6, suppress=True)
-                logger.debug(f'INPUT SL ARRAY: {x_renditions_sl}')
-                logger.debug(f'Unscaled INPUT UL ARRAY: {np.asarray(metrics_df[self.features_ul])}')
-                logger.debug(f'SCALED INPUT UL ARRAY: {x_renditions_ul}')
                 # Make predictions for given data
                 start = timeit.default_timer()
-                predictions_df = pd.DataFrame()
-                predictions_df['sl_pred_tamper'] = self.loaded_model_sl.predict(x_renditions_sl)
-                predictions_df['ocsvm_dist'] = self.loaded_model_ul.decision_function(x_renditions_ul)
-                predictions_df['ul_pred_tamper'] = (-self.loaded_model_ul.predict(x_renditions_ul) + 1) / 2
-                predictions_df['meta_pred_tamper'] = predictions_df.apply(self.meta_model, axis=1)
+                predictions_df = self.predict(metrics_df)
                 prediction_time = timeit.default_timer() - start
 
                 # Add predictions to rendition dictionary
-                i = 0
-                for _, rendition in enumerate(renditions):
-                    if rendition['video_available']:
-                        rendition.pop('path', None)
-                        rendition['ocsvm_dist'] = float(predictions_df['ocsvm_dist'].iloc[i])
-                        rendition['tamper_ul'] = int(predictions_df['ul_pred_tamper'].iloc[i])
-                        rendition['tamper_sl'] = int(predictions_df['sl_pred_tamper'].iloc[i])
-                        rendition['tamper'] = int(predictions_df['meta_pred_tamper'].iloc[i])
-                        # Append the post-verification of resolution and pixel count
-                        if 'pixels' in rendition:
-                            rendition['pixels_post_verification'] = float(rendition['pixels']) / pixels_df[i]
-                        if 'resolution' in rendition:
-                            rendition['resolution']['height_post_verification'] = float(rendition['resolution']['height']) / int(dimensions_df[i].split(':')[0])
-                            rendition['resolution']['width_post_verification'] = float(rendition['resolution']['width']) / int(dimensions_df[i].split(':')[1])
-                        i += 1
+                self.update_renditions(renditions, predictions_df, pixels_df, dimensions_df)
 
                 if self.do_profiling:
                     logger.info(f'Features used: {features}')
@@ -225,6 +311,8 @@ class Verifier:
                     logger.info(f'Initialization time: {initialize_time}')
                     logger.info(f'Process time: {process_time}')
                     logger.info(f'Prediction time: {prediction_time}')
+                    logger.info(f'Peak frame buffers size: {asset_processor.peak_frame_buffer_bytes} bytes')
+                    logger.info(f'Metric executor: {self.metric_executor.stats()}')
 
             return renditions
         finally:
@@ -233,6 +321,120 @@ class Verifier:
                     os.remove(f)
             self.tmp_files.clear()
 
+    def get_metrics_list(self):
+        """
+        Returns features used by models and metrics they are computed from
+        @return: Tuple[features, metrics]
+        """
+        # Remove non numeric features from feature list
+        non_temporal_features = ['attack_ID', 'title', 'attack', 'dimension', 'size', 'size_dimension_ratio']
+        metrics_list = []
+        features = list(np.unique(self.features_ul + self.features_sl))
+
+        for metric in features:
+            # several features, e.g. mean and std, are aggregated from the same metric
+            if metric not in non_temporal_features and metric.split('-')[0] not in metrics_list:
+                metrics_list.append(metric.split('-')[0])
+        return features, metrics_list
+
+    def predict(self, metrics_df):
+        """
+        Runs models on rendition features
+        @param metrics_df: features dataframe, as returned by VideoAssetProcessor
+        @return: predictions dataframe
+        """
+        x_renditions_sl = np.asarray(metrics_df[self.features_sl])
+        x_renditions_ul = np.asarray(metrics_df[self.features_ul])
+        x_renditions_ul = self.loaded_scaler.transform(x_renditions_ul)
+
+        np.set_printoptions(precision=6, suppress=True)
+        logger.debug(f'INPUT SL ARRAY: {x_renditions_sl}')
+        logger.debug(f'Unscaled INPUT UL ARRAY: {np.asarray(metrics_df[self.features_ul])}')
+        logger.debug(f'SCALED INPUT UL ARRAY: {x_renditions_ul}')
+        predictions_df = pd.DataFrame()
+        predictions_df['sl_pred_tamper'] = self.loaded_model_sl.predict(x_renditions_sl)
+        predictions_df['ocsvm_dist'] = self.loaded_model_ul.decision_function(x_renditions_ul)
+        predictions_df['ul_pred_tamper'] = (-self.loaded_model_ul.predict(x_renditions_ul) + 1) / 2
+        predictions_df['meta_pred_tamper'] = predictions_df.apply(self.meta_model, axis=1)
+        return predictions_df
+
+    @staticmethod
+    def update_renditions(renditions, predictions_df, pixels_df, dimensions_df):
+        """
+        Adds predictions and post-verification values to rendition dicts
+        """
+        i = 0
+        for _, rendition in enumerate(renditions):
+            if rendition['video_available'] and 'reject_reason' not in rendition:
+                rendition.pop('path', None)
+                rendition['ocsvm_dist'] = float(predictions_df['ocsvm_dist'].iloc[i])
+                rendition['tamper_ul'] = int(predictions_df['ul_pred_tamper'].iloc[i])
+                rendition['tamper_sl'] = int(predictions_df['sl_pred_tamper'].iloc[i])
+                rendition['tamper'] = int(predictions_df['meta_pred_tamper'].iloc[i])
+                # Append the post-verification of resolution and pixel count
+                if 'pixels' in rendition:
+                    rendition['pixels_post_verification'] = float(rendition['pixels']) / pixels_df[i]
+                if 'resolution' in rendition:
+                    rendition['resolution']['height_post_verification'] = float(rendition['resolution']['height']) / int(dimensions_df[i].split(':')[0])
+                    rendition['resolution']['width_post_verification'] = float(rendition['resolution']['width']) / int(dimensions_df[i].split(':')[1])
+                i += 1
+
+    def verify_live(self, source_path, renditions, sample_interval=1.0, update_samples=5, idle_timeout=10.0):
+        """
+        Verifies renditions while they are still being written, e.g. streaming segments or named pipes.
+        Yields renditions with provisional predictions every time update_samples more samples are matched, and final predictions once all videos end.
+        Pre-verification and audio comparison need complete files, so they are not performed.
+        Raises ValueError once videos end if less than two samples of the source and some rendition were matched, as there are no final predictions then.
+        @param source_path: local path of source file or pipe
+        @param renditions: list of rendition dicts, with local file or pipe path in 'uri'
+        @param sample_interval: seconds between samples, on average
+        @param update_samples: number of new samples to recompute predictions after
+        @param idle_timeout: seconds to wait for a file to grow before treating it as complete
+        @return: generator of rendition lists, with 'provisional' and 'samples' keys added to each rendition
+        """
+        features, metrics_list = self.get_metrics_list()
+        for rendition in renditions:
+            rendition['path'] = rendition['uri']
+            rendition['video_available'] = True
+            rendition['audio_available'] = False
+        asset_processor = LiveAssetProcessor({'path': source_path},
+                                             renditions,
+                                             metrics_list,
+                                             features,
+                                             max_samples=self.max_samples,
+                                             sample_interval=sample_interval,
+                                             idle_timeout=idle_timeout,
+                                             luminance_plane=self.luminance_plane)
+        try:
+            asset_processor.start()
+            last_samples = 0
+            running = True
+            while running:
+                running = asset_processor.wait(sample_interval)
+                samples = asset_processor.sample_count
+                if running and samples - last_samples < update_samples:
+                    continue
+                result = asset_processor.process()
+                if result is None:
+                    if not running:
+                        raise ValueError(f'Videos ended with too few matched samples for final predictions: {samples}')
+                    continue
+                last_samples = samples
+                metrics_df, pixels_df, dimensions_df = result
+                predictions_df = self.predict(metrics_df)
+                # rendition paths are needed by next aggregation
+                self.update_renditions(renditions, predictions_df, pixels_df, dimensions_df)
+                for rendition in renditions:
+                    rendition['path'] = rendition['uri']
+                    rendition['provisional'] = running
+                    rendition['samples'] = samples
+                logger.info(f'{"Provisional" if running else "Final"} predictions on {samples} samples: {list(predictions_df["meta_pred_tamper"])}')
+                yield renditions
+        finally:
+            asset_processor.release()
+            for rendition in renditions:
+                rendition.pop('path', None)
+
     def retrieve_models(self, uri, model_dir):
         """
         Function to obtain pre-trained model for verification predictions
@@ -261,12 +463,11 @@ class Verifier:
             else:
                 logger.debug(f'Directory {model_dir} already exists, skipping download')
 
-    def get_video_audio(self, uri):
+    def get_video(self, uri):
         """
-        Function to obtain a path to a video and audio files from url or local path
+        Function to obtain a path to a video file from url or local path
         """
         video_file = None
-        audio_file = None
         if uri.lower().startswith('http'):
             try:
                 file_name = '/tmp/{}'.format(uuid.uuid4())
@@ -282,29 +483,7 @@ class Verifier:
                 logger.info(f'Video file {video_file} available in file system')
             else:
                 logger.info(f'Video file {video_file} NOT available in file system')
-
-        if video_file:
-            audio_file = '{}_audio.wav'.format(video_file)
-            logger.info('Extracting audio track')
-            ffmpeg = subprocess.Popen(' '.join(['ffmpeg',
-                                                '-i',
-                                                video_file,
-                                                '-vn',
-                                                '-acodec',
-                                                'pcm_s16le',
-                                                '-loglevel',
-                                                'quiet',
-                                                audio_file]), stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-            stdout, stderr = ffmpeg.communicate()
-            if ffmpeg.returncode:
-                logger.error(f'Could not extract audio from video file {stderr}')
-            if os.path.isfile(audio_file):
-                logger.info(f'Audio file {audio_file} available in file system')
-                self.tmp_files.append(audio_file)
-            else:
-                logger.info(f'Audio file {audio_file} NOT available in file system')
-                audio_file = None
-        return video_file, audio_file
+        return video_file
 
     def load_models(self):
         """